@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from ai_endpoints.models import AIAnalysis
+
+
+class Command(BaseCommand):
+    help = ('Deletes all but the latest AI analysis of each message. Run before migrating '
+            'AIAnalysis.message to a one-to-one field on databases that hold duplicates.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted.')
+
+    def handle(self, *args, **options):
+        duplicated = (AIAnalysis.objects.values('message_id')
+                      .annotate(rows=Count('id')).filter(rows__gt=1)
+                      .values_list('message_id', flat=True))
+        deleted = 0
+        for message_id in duplicated.iterator():
+            with transaction.atomic():
+                analyses = list(AIAnalysis.objects.select_for_update()
+                                .filter(message_id=message_id).order_by('-updated_at', '-id'))
+                # A staff correction is ground truth, so the latest corrected analysis wins.
+                keep = next((a for a in analyses if a.is_corrected), analyses[0])
+                stale = [a.id for a in analyses if a.id != keep.id]
+                if not options['dry_run']:
+                    AIAnalysis.objects.filter(id__in=stale).delete()
+                deleted += len(stale)
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {deleted} duplicate AI analyses."))
@@ -7,7 +7,9 @@ class InjectionLog(models.Model):
     """Log security and guardrail failures separately for clean audit trails."""
     id = models.BigAutoField(primary_key=True)
     
-    message = models.ForeignKey(
+    # One analysis per message; redeliveries and re-analyses update it. Databases created
+    # before this was one-to-one run `manage.py dedupe_ai_analysis` before migrating.
+    message = models.OneToOneField(
         Message,
         to_field="message_uuid",
         db_column="message_uuid",
@@ -38,7 +40,9 @@ class AIAnalysis(models.Model):
         on_delete=models.CASCADE,
         related_name="ai_logs"
     )
-    message = models.ForeignKey(
+    # One analysis per message; redeliveries and re-analyses update it. Databases created
+    # before this was one-to-one run `manage.py dedupe_ai_analysis` before migrating.
+    message = models.OneToOneField(
         Message,
         to_field="message_uuid",
         db_column="message_uuid",
@@ -71,6 +75,17 @@ class AIAnalysis(models.Model):
     corrected_department_id = models.BigIntegerField(null=True, blank=True)
     correction_notes = models.TextField(blank=True, null=True)
 
+    # Near-duplicate reuse: the decision was copied from a recently routed similar message.
+    is_near_duplicate = models.BooleanField(default=False, db_index=True)
+    reused_from_message_uuid = models.UUIDField(null=True, blank=True)
+
+    # Model that produced the decision; hedged when a slow primary was raced against the fast model.
+    llm_model = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    llm_hedged = models.BooleanField(default=False, db_index=True)
+
+    # Degraded result without a department (AI dependencies down); staff route the session by hand.
+    needs_manual_routing = models.BooleanField(default=False, db_index=True)
+
     # Performance Metrics.
     language_detected = models.CharField(max_length=64, blank=True, null=True, db_index=True) 
     embedding_tokens = models.IntegerField(null=True, blank=True)
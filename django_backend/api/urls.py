@@ -25,7 +25,9 @@ from support_tools.views import QuickReplyListAPIView
 urlpatterns = [
     path('internal/injection-alert/', views.injection_alert, name='injection_alert'),
     path('internal/routing-result/', views.routing_result, name='routing_result'),
+    path('internal/routing-result/batch/', views.routing_result_batch, name='routing_result_batch'),
     path('internal/train-correction/', views.train_correction_webhook, name='train_correction_webhook'),
+    path('internal/train-correction/batch/', views.train_correction_batch, name='train_correction_batch'),
     path('internal/frontend-logs/', views.frontend_logs, name='frontend_logs'),
     path('ai/route_message/', AIWebhookView.as_view(), name='ai_webhook'),
     path('train-correction/', views.train_correction, name='train_correction'),
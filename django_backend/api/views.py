@@ -2,7 +2,6 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from django.urls import reverse
 from django.conf import settings
 import requests
 import os
@@ -24,6 +23,18 @@ if FASTAPI_BASE.endswith('/api/v1'):
 elif FASTAPI_BASE.endswith('/api'):
     FASTAPI_BASE = FASTAPI_BASE[:-4]
 
+
+def train_correction_timeout():
+    """Seconds to wait for FastAPI's /train-correction.
+
+    Mirrors the AI service's CORRECTION_QUEUE_ENABLED: a queued correction is acknowledged at
+    once, synchronous training embeds and upserts before answering.
+    """
+    queue_enabled = getattr(settings, 'AI_CORRECTION_QUEUE_ENABLED',
+                            os.getenv('CORRECTION_QUEUE_ENABLED', 'true').lower() == 'true')
+    return 5.0 if queue_enabled else 30.0
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])  # TODO: Add IP whitelist or shared secret.
 def injection_alert(request):
@@ -50,13 +61,24 @@ def injection_alert(request):
     return Response({"status": "received"}, status=status.HTTP_200_OK)
 
 from departments.models import Department
+from message_app.views_ai_webhook import route_message_to_department
+
+def apply_inline_routing_result(data):
+    """Applies a decision the AI service returned inline (analyze mode=sync)."""
+    return _apply_routing_result(data)
+
 
 @api_view(['POST'])
 @permission_classes([AllowAny])  # TODO: Add IP whitelist or shared secret.
 def routing_result(request):
     data = request.data
     logger.info(f"Routing Result Received: {data}")
-    
+    result, status_code = _apply_routing_result(data)
+    return Response(result, status=status_code)
+
+
+def _apply_routing_result(data):
+    """Stores one AI routing result and routes its session. Returns (body, status)."""
     try:
         session_uuid = data.get('session_uuid')
         message_uuid = data.get('message_uuid')
@@ -66,7 +88,10 @@ def routing_result(request):
         
         if not session_obj or not message_obj:
             logger.error(f"Routing Result Error: Session {session_uuid} or Message {message_uuid} not found.")
-            return Response({"status": "error", "detail": "Session or Message not found"}, status=status.HTTP_404_NOT_FOUND)
+            return {"status": "error", "detail": "Session or Message not found"}, status.HTTP_404_NOT_FOUND
+
+        # A message has one analysis (one-to-one). Redeliveries and re-analyses update it.
+        previous = AIAnalysis.objects.filter(message=message_obj).first()
 
         # Retrieves department name based on language preference.
         dept_id = data.get('suggested_department_id')
@@ -83,21 +108,35 @@ def routing_result(request):
             except Department.DoesNotExist:
                 logger.warning(f"Department ID {dept_id} not found in DB.")
 
-        AIAnalysis.objects.create(
-            session=session_obj,
+        _, created = AIAnalysis.objects.update_or_create(
             message=message_obj,
-            intent_label=data.get('intent_label'),
-            suggested_department_id=dept_id,
-            suggested_department_name=dept_name,
-            confidence_score=data.get('confidence_score'),
-            reason=data.get('reason'),
-            vector_search_results=data.get('vector_search_results'),
-            language_detected=data.get('language_detected'),
-            embedding_tokens=data.get('embedding_tokens', 0), # safely get tokens
-            prompt_tokens=data.get('prompt_tokens', 0), # safely get tokens
-            total_tokens=data.get('total_tokens', 0),
-            processing_time_ms=data.get('processing_time_ms', 0)
+            defaults=dict(
+                session=session_obj,
+                intent_label=data.get('intent_label'),
+                suggested_department_id=dept_id,
+                suggested_department_name=dept_name,
+                confidence_score=data.get('confidence_score'),
+                reason=data.get('reason'),
+                vector_search_results=data.get('vector_search_results'),
+                language_detected=data.get('language_detected'),
+                embedding_tokens=data.get('embedding_tokens', 0), # safely get tokens
+                prompt_tokens=data.get('prompt_tokens', 0), # safely get tokens
+                total_tokens=data.get('total_tokens', 0),
+                processing_time_ms=data.get('processing_time_ms', 0),
+                is_near_duplicate=data.get('near_duplicate', False),
+                reused_from_message_uuid=data.get('reused_from_message_uuid'),
+                llm_model=data.get('llm_model'),
+                llm_hedged=data.get('llm_hedged', False),
+                needs_manual_routing=data.get('needs_manual_routing', False)
+            )
         )
+
+        # A redelivered decision doesn't route the session again once it reached the department;
+        # if the earlier routing failed, the redelivery retries it.
+        if (previous and not created and dept_id
+                and str(session_obj.assigned_department_id) == str(dept_id)):
+            logger.info(f"Routing Result for message {message_uuid} already applied, not rerouting.")
+            return {"status": "duplicate"}, status.HTTP_200_OK
         
         # Save intent_label to session
         intent_label = data.get('intent_label')
@@ -106,33 +145,37 @@ def routing_result(request):
             session_obj.save(update_fields=['intent_label'])
             logger.info(f"Saved intent_label '{intent_label}' to session {session_uuid}")
         
-        # Call routing function to assign session to department
+        # Assigns the session to the department in-process (no HTTP loopback to ai_webhook).
         if dept_id:
-            route_payload = {
-                "department_id": dept_id,
-                "session_uuid": str(session_uuid),
-                "message_uuid": str(message_uuid),
-                "intent_label": intent_label,  # Pass intent_label to webhook
-            }
-            webhook_url = request.build_absolute_uri(reverse('ai_webhook'))
-            try:
-                logger.info(f"Calling routing webhook: {webhook_url} with payload: {route_payload}")
-                response = requests.post(webhook_url, json=route_payload, timeout=5)
-                if response.status_code == 200:
-                    logger.info(f"Successfully routed session {session_uuid} to department {dept_id}")
-                else:
-                    logger.error(f"Routing webhook returned error {response.status_code}: {response.text}")
-            except requests.RequestException as req_err:
-                logger.error(f"Failed to call AI webhook: {req_err}")
+            body, code = route_message_to_department(session_uuid, dept_id, message_uuid, intent_label)
+            if code == status.HTTP_200_OK:
+                logger.info(f"Successfully routed session {session_uuid} to department {dept_id}")
+            else:
+                logger.error(f"Routing session {session_uuid} failed with {code}: {body}")
         
     except Exception as e:
         logger.error(f"Error processing routing result: {e}")
-        return Response(
-            {"status": "error", "error": str(e)}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return {"status": "error", "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    return {"status": "processed"}, status.HTTP_200_OK
 
-    return Response({"status": "processed"}, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@permission_classes([AllowAny])  # TODO: Add IP whitelist or shared secret.
+def routing_result_batch(request):
+    """Applies a batch of routing results sent by the AI microservice in one call."""
+    results = request.data.get('results')
+    if not isinstance(results, list):
+        return Response({"status": "error", "detail": "'results' must be a list"}, status=status.HTTP_400_BAD_REQUEST)
+    logger.info(f"Routing Result Batch Received: {len(results)} results")
+
+    items = []
+    for data in results:
+        result, status_code = _apply_routing_result(data)
+        items.append({"message_uuid": data.get('message_uuid'), "status_code": status_code, **result})
+
+    processed = sum(1 for item in items if item["status_code"] == status.HTTP_200_OK)
+    return Response({"status": "processed", "processed": processed, "results": items}, status=status.HTTP_200_OK)
 
 @api_view(['POST'])
 @permission_classes([AllowAny])  # TODO: Add IP whitelist or shared secret.
@@ -140,34 +183,49 @@ def train_correction_webhook(request):
     """Handle training correction callbacks from FastAPI and update AIAnalysis records."""
     data = request.data
     logger.info(f"Train Correction Webhook Received: {data}")
-    
+    result, status_code = _apply_train_correction(request, data)
+    return Response(result, status=status_code)
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])  # TODO: Add IP whitelist or shared secret.
+def train_correction_batch(request):
+    """Applies a batch of trained corrections sent by the AI microservice in one call."""
+    results = request.data.get('results')
+    if not isinstance(results, list):
+        return Response({"status": "error", "detail": "'results' must be a list"}, status=status.HTTP_400_BAD_REQUEST)
+    logger.info(f"Train Correction Batch Received: {len(results)} corrections")
+
+    items = []
+    for data in results:
+        result, status_code = _apply_train_correction(request, data)
+        items.append({"message_uuid": data.get('message_uuid'), "status_code": status_code, **result})
+
+    processed = sum(1 for item in items if item["status_code"] == status.HTTP_200_OK)
+    return Response({"status": "processed", "processed": processed, "results": items}, status=status.HTTP_200_OK)
+
+
+def _apply_train_correction(request, data):
+    """Stores one correction on its AIAnalysis and reroutes the session; returns (body, status)."""
     try:
         message_uuid = data.get('message_uuid')
         if not message_uuid:
             logger.error("Train Correction Webhook: Missing message_uuid")
-            return Response(
-                {"status": "error", "detail": "message_uuid is required"}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+            return {"status": "error", "detail": "message_uuid is required"}, status.HTTP_400_BAD_REQUEST
         
         # Find the Message by message_uuid
         message_obj = Message.objects.filter(message_uuid=message_uuid).first()
         if not message_obj:
             logger.error(f"Train Correction Webhook: Message {message_uuid} not found.")
-            return Response(
-                {"status": "error", "detail": "Message not found"}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
+            return {"status": "error", "detail": "Message not found"}, status.HTTP_404_NOT_FOUND
         
         # Find AIAnalysis by message
-        ai_analysis = AIAnalysis.objects.filter(message=message_obj).first()
-        if not ai_analysis:
-            logger.warning(f"Train Correction Webhook: AIAnalysis not found for message {message_uuid}. Creating new record.")
-            # Create new AIAnalysis if it doesn't exist
-            ai_analysis = AIAnalysis.objects.create(
-                session=message_obj.session,
-                message=message_obj,
-            )
+        ai_analysis, created = AIAnalysis.objects.get_or_create(
+            message=message_obj,
+            defaults={"session": message_obj.session},
+        )
+        if created:
+            logger.warning(f"Train Correction Webhook: AIAnalysis not found for message {message_uuid}. Created new record.")
         
         # Update correction fields
         ai_analysis.is_corrected = True
@@ -207,58 +265,50 @@ def train_correction_webhook(request):
                 session_obj.save(update_fields=['status', 'assigned_department', 'assigned_staff'])
                 logger.info(f"Train Correction Webhook: Updated session {session_obj.session_uuid} to unassigned and assigned to department {department.id}")
                 
-                # Call the routing webhook to properly route the session
-                route_payload = {
-                    "department_id": correct_department_id,
-                    "session_uuid": str(session_obj.session_uuid),
-                    "message_uuid": str(message_uuid),
-                }
-                webhook_url = request.build_absolute_uri(reverse('ai_webhook'))
-                try:
-                    logger.info(f"Train Correction Webhook: Calling routing webhook: {webhook_url} with payload: {route_payload}")
-                    response = requests.post(webhook_url, json=route_payload, timeout=5)
-                    if response.status_code == 200:
-                        logger.info(f"Train Correction Webhook: Successfully routed session {session_obj.session_uuid} to department {correct_department_id}")
-                        
-                        # Explicitly broadcast session.created to department so staff get notifications
-                        # This is needed because we updated the session before calling ai_webhook,
-                        # so ai_webhook doesn't detect it as a department change
-                        try:
-                            from websockets.utils import broadcast_session_created, broadcast_session_rerouted_to_vip
-                            # Reload session to ensure we have latest data
-                            session_obj.refresh_from_db()
-                            broadcast_session_created(department.id, session_obj, request=request)
-                            logger.info(f"Train Correction Webhook: Broadcasted session.created to department_{department.id}")
+                # Route the session in-process, as the routing webhook would
+                route_result, route_status = route_message_to_department(
+                    str(session_obj.session_uuid), correct_department_id, str(message_uuid)
+                )
+                if route_status == 200:
+                    logger.info(f"Train Correction Webhook: Successfully routed session {session_obj.session_uuid} to department {correct_department_id}")
+                    
+                    # Explicitly broadcast session.created to department so staff get notifications
+                    # This is needed because we updated the session before routing,
+                    # so routing doesn't detect it as a department change
+                    try:
+                        from websockets.utils import broadcast_session_created, broadcast_session_rerouted_to_vip
+                        # Reload session to ensure we have latest data
+                        session_obj.refresh_from_db()
+                        broadcast_session_created(department.id, session_obj, request=request)
+                        logger.info(f"Train Correction Webhook: Broadcasted session.created to department_{department.id}")
                             
-                            # Broadcast to VIP group that session was rerouted
-                            department_name = department.name_uz or department.name_ru or f"Department {department.id}"
-                            broadcast_session_rerouted_to_vip(session_obj, department_name, request=request)
-                            logger.info(f"Train Correction Webhook: Broadcasted session.rerouted to VIP group")
-                        except Exception as broadcast_err:
-                            logger.error(f"Train Correction Webhook: Failed to broadcast: {broadcast_err}")
+                        # Broadcast to VIP group that session was rerouted
+                        department_name = department.name_uz or department.name_ru or f"Department {department.id}"
+                        broadcast_session_rerouted_to_vip(session_obj, department_name, request=request)
+                        logger.info(f"Train Correction Webhook: Broadcasted session.rerouted to VIP group")
+                    except Exception as broadcast_err:
+                        logger.error(f"Train Correction Webhook: Failed to broadcast: {broadcast_err}")
                         
-                        # Send notification to citizen via Telegram (system message, not in chat)
-                        if session_obj.origin == 'telegram':
-                            try:
-                                telegram_profile = getattr(session_obj.citizen, 'telegram_profile', None)
-                                if telegram_profile and telegram_profile.telegram_chat_id:
-                                    from message_app.utils_telegram import send_text_to_telegram
-                                    notification_text = (
-                                        "<b>✅ Murojaatingiz qayta yo'naltirildi</b>\n\n"
-                                        "Sizning murojaatingiz to'g'ri bo'limga qayta yo'naltirildi. "
-                                        "Tez orada xodimlar sizga javob berishadi."
-                                    )
-                                    send_text_to_telegram(
-                                        telegram_profile.telegram_chat_id,
-                                        notification_text,
-                                        remove_keyboard=False
-                                    )
-                            except Exception as e:
-                                logger.error(f"Failed to send reroute notification to Telegram: {e}")
-                    else:
-                        logger.error(f"Train Correction Webhook: Routing webhook returned error {response.status_code}: {response.text}")
-                except requests.RequestException as req_err:
-                    logger.error(f"Train Correction Webhook: Failed to call routing webhook: {req_err}")
+                    # Send notification to citizen via Telegram (system message, not in chat)
+                    if session_obj.origin == 'telegram':
+                        try:
+                            telegram_profile = getattr(session_obj.citizen, 'telegram_profile', None)
+                            if telegram_profile and telegram_profile.telegram_chat_id:
+                                from message_app.utils_telegram import send_text_to_telegram
+                                notification_text = (
+                                    "<b>✅ Murojaatingiz qayta yo'naltirildi</b>\n\n"
+                                    "Sizning murojaatingiz to'g'ri bo'limga qayta yo'naltirildi. "
+                                    "Tez orada xodimlar sizga javob berishadi."
+                                )
+                                send_text_to_telegram(
+                                    telegram_profile.telegram_chat_id,
+                                    notification_text,
+                                    remove_keyboard=False
+                                )
+                        except Exception as e:
+                            logger.error(f"Failed to send reroute notification to Telegram: {e}")
+                else:
+                    logger.error(f"Train Correction Webhook: Routing returned error {route_status}: {route_result}")
             except Department.DoesNotExist:
                 logger.error(f"Train Correction Webhook: Department {correct_department_id} not found")
             except Exception as route_err:
@@ -268,12 +318,9 @@ def train_correction_webhook(request):
         logger.error(f"Error processing train correction webhook: {e}")
         import traceback
         logger.error(f"Full traceback: {traceback.format_exc()}")
-        return Response(
-            {"status": "error", "error": str(e)}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return {"status": "error", "error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
 
-    return Response({"status": "processed"}, status=status.HTTP_200_OK)
+    return {"status": "processed"}, status.HTTP_200_OK
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -307,7 +354,8 @@ def train_correction(request):
         if corrected_by_uuid:
             fastapi_payload["corrected_by"] = corrected_by_uuid
         
-        # Call FastAPI endpoint
+        # Call FastAPI endpoint; it queues the correction and trains it in the background (or, with
+        # the queue disabled, trains it before answering), then reports back through the webhook.
         fastapi_url = f"{FASTAPI_BASE}/api/v1/train-correction"
         logger.info(f"Calling FastAPI: {fastapi_url} with payload keys: {list(fastapi_payload.keys())}")
         
@@ -315,15 +363,21 @@ def train_correction(request):
             response = requests.post(
                 fastapi_url,
                 json=fastapi_payload,
-                timeout=30.0  # Training might take longer
+                timeout=train_correction_timeout()
             )
             
             if response.status_code == 200:
-                logger.info(f"FastAPI train-correction succeeded")
+                logger.info(f"FastAPI train-correction accepted")
                 return Response(
-                    {"status": "success"},
+                    {"status": "success", "queued": response.json().get("queued", False)},
                     status=status.HTTP_200_OK
                 )
+            elif response.status_code == 429:
+                logger.warning(f"FastAPI correction queue is full: {response.text}")
+                return Response(
+                    {"status": "error", "detail": "AI service is busy, try again shortly"},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
             else:
                 logger.error(f"FastAPI returned error {response.status_code}: {response.text}")
                 return Response(
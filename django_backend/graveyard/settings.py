@@ -265,6 +265,10 @@ MEDIA_URL = '/media/'
 THUMBNAIL_CACHE_DIR = config('THUMBNAIL_CACHE_DIR', default='thumbnails')
 THUMBNAIL_MAX_SIZE = (512, 512)  # px, max thumbnail dimension
 AI_MICROSERVICE_URL = config('AI_MICROSERVICE_URL', default='http://localhost:8001/api/v1')
+# Web messages are analyzed inline (analyze?mode=sync) and routed without the webhook round trip;
+# results later than the deadline still arrive by webhook.
+AI_SYNC_ANALYZE = config('AI_SYNC_ANALYZE', default=True, cast=bool)
+AI_SYNC_DEADLINE_MS = config('AI_SYNC_DEADLINE_MS', default=2500, cast=int)
 
 # SLA Configuration
 SLA_THRESHOLD_DAYS = config('SLA_THRESHOLD_DAYS', default=3, cast=int)
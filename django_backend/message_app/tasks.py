@@ -7,21 +7,35 @@ from django.conf import settings
 def analyze_message_task(self, session_uuid: str, message_uuid: str):
     """
     Sends the message to AI microservice for analysis and routing.
+    In sync mode the decision comes back in the response and is applied here.
     """
+    from api.views import apply_inline_routing_result
+    from support_tools.ai_client import message_text
+    from .models import Message
+
     try:
+        message = Message.objects.prefetch_related('contents').filter(message_uuid=message_uuid).first()
         payload = {
             "session_uuid": session_uuid,
-            "message_uuid": message_uuid
+            "message_uuid": message_uuid,
+            "text": message_text(message) if message else ""
         }
 
         # AI Microservice endpoint
         ai_endpoint = settings.AI_MICROSERVICE_URL + "/analyze"
+        timeout = 10
+        if settings.AI_SYNC_ANALYZE:
+            ai_endpoint += f"?mode=sync&deadline_ms={settings.AI_SYNC_DEADLINE_MS}"
+            timeout += settings.AI_SYNC_DEADLINE_MS / 1000
 
-        resp = requests.post(ai_endpoint, json=payload, timeout=10)
+        resp = requests.post(ai_endpoint, json=payload, timeout=timeout)
         resp.raise_for_status()
+        body = resp.json()
 
-        # The AI microservice will call your webhook / route_message after processing
-        return resp.json()
+        if body.get("status") == "completed":
+            apply_inline_routing_result(body["result"])
+        # Otherwise the AI microservice will call your webhook / route_message after processing
+        return body
 
     except requests.RequestException as exc:
         # retry automatically if transient network errors
@@ -37,6 +37,128 @@ def validate_webhook_request(request):
     return True
 
 
+def route_message_to_department(session_uuid, department_id, message_uuid, intent_label=None):
+    """
+    Routes the session to the department (when it changed) and broadcasts the message.
+    Returns (body, status). Used by the webhook and in-process by inline AI results.
+    """
+    try:
+        # Get session
+        try:
+            session = Session.objects.get(session_uuid=session_uuid)
+        except Session.DoesNotExist:
+            logger.error(f"Session not found: {session_uuid}")
+            return {"error": f"Session not found: {session_uuid}"}, status.HTTP_404_NOT_FOUND
+        
+        # Get department - handle both string and integer IDs
+        try:
+            # Convert to int if it's a string
+            if isinstance(department_id, str):
+                try:
+                    department_id = int(department_id)
+                except ValueError:
+                    # If it's not a number, try UUID lookup
+                    pass
+            department = Department.objects.get(id=department_id)
+            logger.info(f"Found department: {department.id} - {department.name_uz or department.name_ru}")
+        except Department.DoesNotExist:
+            logger.error(f"Department not found: {department_id}")
+            return {"error": f"Department not found: {department_id}"}, status.HTTP_404_NOT_FOUND
+        except Exception as dept_error:
+            logger.error(f"Error getting department {department_id}: {dept_error}")
+            return {"error": f"Invalid department_id: {department_id}"}, status.HTTP_400_BAD_REQUEST
+
+        # Get message with all relationships for proper serialization
+        try:
+            message = Message.objects.select_related(
+                'session',
+                'sender',
+                'session__citizen',
+                'session__assigned_staff',
+                'session__assigned_department'
+            ).prefetch_related(
+                'contents'
+            ).get(message_uuid=message_uuid)
+        except Message.DoesNotExist:
+            logger.error(f"Message not found: {message_uuid}")
+            return {"error": f"Message not found: {message_uuid}"}, status.HTTP_404_NOT_FOUND
+
+        # Update session assignment and intent_label (if provided)
+        old_department = session.assigned_department
+        department_changed = (old_department is None or old_department.id != department.id)
+        
+        # Only update session if department actually changed (new routing)
+        # If department is already assigned (citizen message in active session), don't touch the session at all
+        if department_changed:
+            # New routing - update department and set status to unassigned
+            session.assigned_department = department
+            session.status = "unassigned"
+            
+            # Update intent_label if provided
+            if intent_label:
+                session.intent_label = intent_label
+            
+            # Save only the fields we're updating
+            update_fields = ['assigned_department', 'status']
+            if intent_label:
+                update_fields.append('intent_label')
+            session.save(update_fields=update_fields)
+            
+            logger.info(f"Session {session_uuid} routed to department {department.id} (was: {old_department.id if old_department else 'None'})")
+        else:
+            # Department already assigned - this is just routing a message
+            # Only update intent_label if provided (and different), but DON'T touch status
+            if intent_label and session.intent_label != intent_label:
+                session.intent_label = intent_label
+                session.save(update_fields=['intent_label'])
+                logger.info(f"Updated intent_label for session {session_uuid} to {intent_label}")
+            else:
+                # DO NOT update session - just broadcast the message
+                logger.info(f"Session {session_uuid} already has department {department.id} - routing message only, not updating session")
+        
+        # Reload message with all relationships to ensure proper serialization
+        # We need to reload it because session might have been updated
+        message = Message.objects.select_related(
+            'session',
+            'sender',
+            'session__citizen',
+            'session__assigned_staff',
+            'session__assigned_department'
+        ).prefetch_related(
+            'contents'
+        ).get(message_uuid=message_uuid)
+
+        # Notify department dashboard only if department changed
+        if department_changed:
+            try:
+                broadcast_session_created(department.id, session)
+                logger.info(f"Broadcasted session creation to department_{department.id}")
+            except Exception as broadcast_error:
+                logger.warning(f"Failed to broadcast session creation: {broadcast_error}")
+
+        # ALWAYS broadcast the message to chat group (so staff can see citizen messages)
+        # This is critical for citizen messages from Telegram to appear in staff dashboard
+        try:
+            # Broadcast with request=None (we're in a webhook, no request context)
+            broadcast_message_created(str(session_uuid), message, request=None)
+            logger.info(f"Successfully broadcasted message {message_uuid} to chat_{str(session_uuid)} group")
+        except Exception as broadcast_error:
+            logger.error(f"Failed to broadcast message: {broadcast_error}", exc_info=True)
+            # Don't fail the request, but log the error
+
+        logger.info(f"Successfully routed message {message_uuid} for session {session_uuid} to department {department.id}")
+        return {
+            "status": "success",
+            "session_uuid": str(session_uuid),
+            "department_id": department.id,
+            "department_name": department.name_uz or department.name_ru
+        }, status.HTTP_200_OK
+
+    except Exception as e:
+        logger.error(f"Unexpected error in AI webhook: {e}", exc_info=True)
+        return {"error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
 class AIWebhookView(APIView):
     """
     Called by AI microservice after selecting the department.
@@ -78,118 +200,5 @@ class AIWebhookView(APIView):
         if not intent_label:
             logger.info(f"intent_label not provided, will be ignored")
 
-        try:
-            # Get session
-            try:
-                session = Session.objects.get(session_uuid=session_uuid)
-            except Session.DoesNotExist:
-                logger.error(f"Session not found: {session_uuid}")
-                return Response({"error": f"Session not found: {session_uuid}"}, status=status.HTTP_404_NOT_FOUND)
-            
-            # Get department - handle both string and integer IDs
-            try:
-                # Convert to int if it's a string
-                if isinstance(department_id, str):
-                    try:
-                        department_id = int(department_id)
-                    except ValueError:
-                        # If it's not a number, try UUID lookup
-                        pass
-                department = Department.objects.get(id=department_id)
-                logger.info(f"Found department: {department.id} - {department.name_uz or department.name_ru}")
-            except Department.DoesNotExist:
-                logger.error(f"Department not found: {department_id}")
-                return Response({"error": f"Department not found: {department_id}"}, status=status.HTTP_404_NOT_FOUND)
-            except Exception as dept_error:
-                logger.error(f"Error getting department {department_id}: {dept_error}")
-                return Response({"error": f"Invalid department_id: {department_id}"}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Get message with all relationships for proper serialization
-            try:
-                message = Message.objects.select_related(
-                    'session',
-                    'sender',
-                    'session__citizen',
-                    'session__assigned_staff',
-                    'session__assigned_department'
-                ).prefetch_related(
-                    'contents'
-                ).get(message_uuid=message_uuid)
-            except Message.DoesNotExist:
-                logger.error(f"Message not found: {message_uuid}")
-                return Response({"error": f"Message not found: {message_uuid}"}, status=status.HTTP_404_NOT_FOUND)
-
-            # Update session assignment and intent_label (if provided)
-            old_department = session.assigned_department
-            department_changed = (old_department is None or old_department.id != department.id)
-            
-            # Only update session if department actually changed (new routing)
-            # If department is already assigned (citizen message in active session), don't touch the session at all
-            if department_changed:
-                # New routing - update department and set status to unassigned
-                session.assigned_department = department
-                session.status = "unassigned"
-                
-                # Update intent_label if provided
-                if intent_label:
-                    session.intent_label = intent_label
-                
-                # Save only the fields we're updating
-                update_fields = ['assigned_department', 'status']
-                if intent_label:
-                    update_fields.append('intent_label')
-                session.save(update_fields=update_fields)
-                
-                logger.info(f"Session {session_uuid} routed to department {department.id} (was: {old_department.id if old_department else 'None'})")
-            else:
-                # Department already assigned - this is just routing a message
-                # Only update intent_label if provided (and different), but DON'T touch status
-                if intent_label and session.intent_label != intent_label:
-                    session.intent_label = intent_label
-                    session.save(update_fields=['intent_label'])
-                    logger.info(f"Updated intent_label for session {session_uuid} to {intent_label}")
-                else:
-                    # DO NOT update session - just broadcast the message
-                    logger.info(f"Session {session_uuid} already has department {department.id} - routing message only, not updating session")
-            
-            # Reload message with all relationships to ensure proper serialization
-            # We need to reload it because session might have been updated
-            message = Message.objects.select_related(
-                'session',
-                'sender',
-                'session__citizen',
-                'session__assigned_staff',
-                'session__assigned_department'
-            ).prefetch_related(
-                'contents'
-            ).get(message_uuid=message_uuid)
-
-            # Notify department dashboard only if department changed
-            if department_changed:
-                try:
-                    broadcast_session_created(department.id, session)
-                    logger.info(f"Broadcasted session creation to department_{department.id}")
-                except Exception as broadcast_error:
-                    logger.warning(f"Failed to broadcast session creation: {broadcast_error}")
-
-            # ALWAYS broadcast the message to chat group (so staff can see citizen messages)
-            # This is critical for citizen messages from Telegram to appear in staff dashboard
-            try:
-                # Broadcast with request=None (we're in a webhook, no request context)
-                broadcast_message_created(str(session_uuid), message, request=None)
-                logger.info(f"Successfully broadcasted message {message_uuid} to chat_{str(session_uuid)} group")
-            except Exception as broadcast_error:
-                logger.error(f"Failed to broadcast message: {broadcast_error}", exc_info=True)
-                # Don't fail the request, but log the error
-
-            logger.info(f"Successfully routed message {message_uuid} for session {session_uuid} to department {department.id}")
-            return Response({
-                "status": "success",
-                "session_uuid": str(session_uuid),
-                "department_id": department.id,
-                "department_name": department.name_uz or department.name_ru
-            }, status=status.HTTP_200_OK)
-
-        except Exception as e:
-            logger.error(f"Unexpected error in AI webhook: {e}", exc_info=True)
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        body, code = route_message_to_department(session_uuid, department_id, message_uuid, intent_label)
+        return Response(body, status=code)
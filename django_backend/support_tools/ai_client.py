@@ -6,6 +6,13 @@ from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+
+def message_text(message):
+    """Text the AI service analyzes: the message's text parts, or media captions."""
+    parts = [c.text or c.caption for c in message.contents.all()]
+    return "\n".join(p for p in parts if p)
+
+
 async def send_to_ai_service(session_uuid, message_uuid, text, language='uz'):
     """Send a user message to the AI Microservice for analysis."""
     url = f"{settings.AI_MICROSERVICE_URL}/analyze"
@@ -0,0 +1,56 @@
+import json
+import sys
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from django.utils import timezone
+from ai_endpoints.models import AIAnalysis
+from message_app.models import MessageContent
+from support_tools.ai_client import message_text
+
+
+class Command(BaseCommand):
+    help = ('Exports analyzed messages with their AI decision and staff correction as JSONL, '
+            'for replay through the AI pipeline (fastapi_microservice/replay.py).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='File to write (default: stdout).')
+        parser.add_argument('--days', type=int, help='Only messages analyzed in the last N days.')
+        parser.add_argument('--corrected-only', action='store_true', help='Only messages a staff member corrected.')
+        parser.add_argument('--limit', type=int, help='At most N messages, newest first.')
+
+    def handle(self, *args, **options):
+        analyses = AIAnalysis.objects.select_related('message').prefetch_related(
+            Prefetch('message__contents', queryset=MessageContent.objects.order_by('id'))
+        ).order_by('-created_at')
+        if options['days']:
+            analyses = analyses.filter(created_at__gte=timezone.now() - timedelta(days=options['days']))
+        if options['corrected_only']:
+            analyses = analyses.filter(is_corrected=True, corrected_department_id__isnull=False)
+        if options['limit']:
+            analyses = analyses[:options['limit']]
+
+        out = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        exported = 0
+        try:
+            for analysis in analyses.iterator(chunk_size=500):
+                text = message_text(analysis.message)
+                if not text:
+                    continue
+                out.write(json.dumps({
+                    "message_uuid": str(analysis.message_id),
+                    "session_uuid": str(analysis.session_id),
+                    "text": text,
+                    "language": analysis.language_detected,
+                    # Only staff corrections are ground truth; uncorrected decisions count for latency.
+                    "expected_department_id": analysis.corrected_department_id if analysis.is_corrected else None,
+                    "historical_department_id": analysis.suggested_department_id,
+                    "historical_processing_time_ms": analysis.processing_time_ms,
+                }, ensure_ascii=False) + "\n")
+                exported += 1
+        finally:
+            if options['output']:
+                out.close()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Exported {exported} messages to {options['output']}."))
@@ -1,26 +1,66 @@
 import os
-import uuid
 import time
+import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from departments.models import Department
 import google.generativeai as genai
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, PayloadSchemaType,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation,
+)
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+# Gemini accepts at most 100 texts per batch embedding request.
+MAX_BATCH_SIZE = 100
+LANGUAGES = ("uz", "ru")
+NAMESPACE = uuid.UUID('d87b3c2a-9e5f-4b1d-8c6a-2f3e4d5c6b7a')
+# The pipeline queries this name; it is an alias of the live versioned collection.
+ALIAS = "departments"
+VECTOR_SIZE = 768  # text-embedding-004 size
+PAYLOAD_INDEXES = {
+    "language": PayloadSchemaType.KEYWORD,
+    "department_id": PayloadSchemaType.KEYWORD,
+    "is_correction": PayloadSchemaType.BOOL,
+}
+
+
+def content_hash(name, description):
+    """Hash of everything a point's vector and payload derive from; unchanged hash, no re-embedding."""
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\n{name or ''}\n{description}".encode("utf-8")).hexdigest()
+
 
 class Command(BaseCommand):
-    help = 'Indexes departments into Qdrant vector database.'
+    help = ('Indexes departments into a new versioned Qdrant collection and switches the '
+            f'"{ALIAS}" alias to it, re-embedding only changed descriptions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without embedding or writing.')
+        parser.add_argument('--force', action='store_true', help='Re-embed every description, even unchanged ones.')
+        parser.add_argument('--batch-size', type=int, default=MAX_BATCH_SIZE, help='Texts per embedding call (max 100).')
+        parser.add_argument('--workers', type=int, default=4, help='Embedding calls in flight at once.')
+        parser.add_argument('--distance', choices=[d.value for d in Distance], default=Distance.COSINE.value,
+                            help='Distance of the new collection.')
+        parser.add_argument('--quantization', choices=['none', 'int8'], default='none',
+                            help='int8 scalar quantization of the new collection: int8 vectors in RAM, originals on disk (4x less RAM).')
+        parser.add_argument('--keep', type=int, default=3, help='Collection versions kept for rollback, live one included.')
+        parser.add_argument('--rollback', action='store_true', help='Point the alias back at the previous version.')
 
     def handle(self, *args, **options):
         self.stdout.write("Starting indexing process...")
 
         # 1. Setup & Configuration
         gemini_api_key = os.getenv("GEMINI_API_KEY")
-        if not gemini_api_key:
+        if not gemini_api_key and not (options['dry_run'] or options['rollback']):
             self.stdout.write(self.style.ERROR("GEMINI_API_KEY not found in environment."))
             return
 
-        genai.configure(api_key=gemini_api_key)
+        if gemini_api_key:
+            genai.configure(api_key=gemini_api_key)
 
         # Determine Qdrant host - try environment variable first, then fallback logic
         qdrant_host = os.getenv("QDRANT_HOST", None)
@@ -56,89 +96,258 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR("Make sure Qdrant is running (via Docker or locally)!"))
                 return
 
-        collection_name = "departments"
-        vector_size = 768 # text-embedding-004 size
+        if options['rollback']:
+            self.rollback(client)
+            return
 
-        # 2. Qdrant Collection Initialization
-        if not client.collection_exists(collection_name):
-            self.stdout.write(f"Collection '{collection_name}' not found. Creating...")
-            client.create_collection(
-                collection_name=collection_name,
-                vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
-            )
-            self.stdout.write(self.style.SUCCESS(f"Collection '{collection_name}' created."))
+        # 2. Current state: the collection the alias points at (or a pre-alias "departments" collection)
+        live = self.live_collection(client)
+        if live:
+            self.stdout.write(f"Live collection: '{live}'.")
+            existing, corrections = self.existing_points(client, live)
         else:
-            self.stdout.write(f"Collection '{collection_name}' already exists.")
+            self.stdout.write(f"No live collection behind '{ALIAS}' yet.")
+            existing, corrections = {}, {}
 
-        # 3. The UUID Strategy
-        NAMESPACE = uuid.UUID('d87b3c2a-9e5f-4b1d-8c6a-2f3e4d5c6b7a')
-
-        # 4. The Indexing Loop
+        # 3. Desired state: one point per active department and language with a description
         departments = Department.objects.filter(is_active=True)
-        points = []
-        total_vectors = 0
-
         self.stdout.write(f"Found {departments.count()} active departments.")
-
+        desired = {}
         for dept in departments:
-            # Pass 1: Uzbek
-            if dept.description_uz:
-                try:
-                    embedding_uz = genai.embed_content(
-                        model="models/text-embedding-004",
-                        content=dept.description_uz,
-                        task_type="retrieval_document"
-                    )['embedding']
-                    
-                    id_uz = str(uuid.uuid5(NAMESPACE, f"{dept.id}_uz"))
-                    
-                    points.append(PointStruct(
-                        id=id_uz,
-                        vector=embedding_uz,
-                        payload={
-                            "department_id": str(dept.id),
-                            "name": dept.name_uz,
-                            "description": dept.description_uz,
-                            "language": "uz"
-                        }
-                    ))
-                    total_vectors += 1
-                except Exception as e:
-                     self.stdout.write(self.style.ERROR(f"Error embedding UZ for Dept {dept.id}: {e}"))
+            for language in LANGUAGES:
+                description = getattr(dept, f"description_{language}")
+                if not description:
+                    continue
+                name = getattr(dept, f"name_{language}")
+                point_id = str(uuid.uuid5(NAMESPACE, f"{dept.id}_{language}"))
+                desired[point_id] = {
+                    "department_id": str(dept.id),
+                    "name": name,
+                    "description": description,
+                    "language": language,
+                    "content_hash": content_hash(name, description),
+                }
 
-            # Pass 2: Russian
-            if dept.description_ru:
-                try:
-                    embedding_ru = genai.embed_content(
-                        model="models/text-embedding-004",
-                        content=dept.description_ru,
-                        task_type="retrieval_document"
-                    )['embedding']
-                    
-                    id_ru = str(uuid.uuid5(NAMESPACE, f"{dept.id}_ru"))
-                    
-                    points.append(PointStruct(
-                        id=id_ru,
-                        vector=embedding_ru,
-                        payload={
-                            "department_id": str(dept.id),
-                            "name": dept.name_ru,
-                            "description": dept.description_ru,
-                            "language": "ru"
-                        }
-                    ))
-                    total_vectors += 1
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Error embedding RU for Dept {dept.id}: {e}"))
+        # 4. Diff against what the live collection holds
+        to_embed = {
+            point_id: payload for point_id, payload in desired.items()
+            if options['force'] or existing.get(point_id, (None, {}))[1].get("content_hash") != payload["content_hash"]
+        }
+        # Points of deactivated departments or removed descriptions are left out of the new version.
+        to_drop = [point_id for point_id in existing if point_id not in desired]
+        new = sum(1 for point_id in to_embed if point_id not in existing)
+        self.stdout.write(
+            f"Diff: {new} new, {len(to_embed) - new} changed, {len(desired) - len(to_embed)} unchanged, "
+            f"{len(to_drop)} to delete, {len(corrections)} corrections to carry over."
+        )
+
+        # A version is also rebuilt when the requested distance or quantization differs from the live one.
+        vectors_config, quantization_config = self.collection_config(Distance(options['distance']), options['quantization'])
+        config_changed = bool(live) and self.config_changed(client, live, vectors_config, quantization_config)
+        if config_changed:
+            self.stdout.write(
+                f"Collection config changed: {options['distance']}, quantization: {options['quantization']}."
+            )
 
-        # 5. Execution (Batch Upload)
+        if options['dry_run']:
+            for point_id, payload in to_embed.items():
+                action = "new" if point_id not in existing else "changed"
+                self.stdout.write(f"  [{action}] Dept {payload['department_id']} ({payload['language']}): {payload['name']}")
+            for point_id in to_drop:
+                payload = existing[point_id][1]
+                self.stdout.write(f"  [delete] Dept {payload.get('department_id')} ({payload.get('language')}): {payload.get('name')}")
+            self.stdout.write(self.style.SUCCESS("Dry run: nothing was embedded or written."))
+            return
+
+        if live and live != ALIAS and not to_embed and not to_drop and not config_changed:
+            self.stdout.write("Nothing changed; the live collection is up to date.")
+            return
+
+        # 5. Batched, parallel embedding of the changed descriptions only; unchanged points keep their vectors
+        # A changed point whose embedding fails is missing from the build, so validation stops it.
+        vectors = {
+            point_id: vector for point_id, (vector, _) in existing.items()
+            if point_id in desired and point_id not in to_embed
+        }
+        if to_embed:
+            vectors.update(self.embed_all(
+                [(point_id, payload["description"]) for point_id, payload in to_embed.items()],
+                min(max(options['batch_size'], 1), MAX_BATCH_SIZE),
+                max(options['workers'], 1),
+            ))
+        points = [
+            PointStruct(id=point_id, vector=vectors[point_id], payload=payload)
+            for point_id, payload in desired.items() if point_id in vectors
+        ]
+
+        # 6. Build the new version next to the live one
+        version = f"{ALIAS}_v{time.strftime('%Y%m%d%H%M%S')}"
+        self.create_version(client, version, vectors_config, quantization_config)
         if points:
-            self.stdout.write(f"Uploading {len(points)} vectors to Qdrant...")
-            client.upload_points(
+            self.stdout.write(f"Uploading {len(points)} department vectors to '{version}'...")
+            client.upload_points(collection_name=version, points=points, wait=True)
+        # Corrections are re-read right before the switch to miss as few new ones as possible.
+        if live:
+            _, corrections = self.existing_points(client, live)
+        self.copy_points(client, version, corrections)
+
+        # 7. Validation: a partial build never goes live
+        expected = len(desired) + len(corrections)
+        count = client.count(collection_name=version, exact=True).count
+        if count != expected:
+            self.stdout.write(self.style.ERROR(
+                f"Validation failed: '{version}' has {count} points, expected {expected}. The alias was not switched."
+            ))
+            client.delete_collection(collection_name=version)
+            return
+
+        # 8. Atomic switch
+        self.switch_alias(client, version, live)
+        self.stdout.write(self.style.SUCCESS(
+            f"'{ALIAS}' now points at '{version}': {len(to_embed)} vectors embedded, {len(points) - len(to_embed)} reused, "
+            f"{len(to_drop)} deleted, {len(corrections)} corrections carried over."
+        ))
+
+        # Corrections trained against the old version during the switch are carried over too.
+        if live and live != ALIAS:
+            _, late = self.existing_points(client, live)
+            late = {point_id: point for point_id, point in late.items() if point_id not in corrections}
+            if late:
+                self.copy_points(client, version, late)
+        self.prune_versions(client, options['keep'])
+
+    def live_collection(self, client):
+        for alias in client.get_aliases().aliases:
+            if alias.alias_name == ALIAS:
+                return alias.collection_name
+        if client.collection_exists(ALIAS):
+            return ALIAS
+        return None
+
+    def versions(self, client):
+        """Versioned collections, oldest first; the timestamp suffix sorts chronologically."""
+        return sorted(c.name for c in client.get_collections().collections if c.name.startswith(f"{ALIAS}_v"))
+
+    def existing_points(self, client, collection_name):
+        """Returns ({point_id: (vector, payload)} of department points, same for correction points)."""
+        departments, corrections = {}, {}
+        offset = None
+        while True:
+            records, offset = client.scroll(
                 collection_name=collection_name,
-                points=points,
-                wait=True
+                limit=256,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
             )
-            self.stdout.write(self.style.SUCCESS(f"Successfully indexed {departments.count()} departments (Total {total_vectors} vectors)."))
-        else:
-            self.stdout.write("No points to upload.")
+            for record in records:
+                payload = record.payload or {}
+                target = corrections if payload.get("is_correction") else departments
+                target[str(record.id)] = (record.vector, payload)
+            if offset is None:
+                return departments, corrections
+
+    def collection_config(self, distance, quantization='none'):
+        """Returns (vectors_config, quantization_config) of a new version."""
+        quantization_config = None
+        if quantization == 'int8':
+            # Only the int8 copies are kept in RAM; the pipeline rescores the top hits on the
+            # original vectors, which are moved to disk.
+            quantization_config = ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+            )
+        vectors_config = VectorParams(size=VECTOR_SIZE, distance=distance, on_disk=quantization_config is not None)
+        return vectors_config, quantization_config
+
+    def config_changed(self, client, collection_name, vectors_config, quantization_config):
+        """Whether the collection's vector size, distance, on-disk storage or quantization differ from the requested ones."""
+        config = client.get_collection(collection_name=collection_name).config
+        live_vectors = config.params.vectors
+        live_quantization = config.quantization_config
+
+        def scalar_type(quantization):
+            scalar = getattr(quantization, "scalar", None)
+            return getattr(scalar, "type", None)
+
+        return (
+            getattr(live_vectors, "size", None) != vectors_config.size
+            or getattr(live_vectors, "distance", None) != vectors_config.distance
+            or bool(getattr(live_vectors, "on_disk", False)) != bool(vectors_config.on_disk)
+            or scalar_type(live_quantization) != scalar_type(quantization_config)
+        )
+
+    def create_version(self, client, version, vectors_config, quantization_config=None):
+        quantization = quantization_config.scalar.type.value if quantization_config else 'none'
+        self.stdout.write(
+            f"Creating collection '{version}' ({VECTOR_SIZE} dims, {vectors_config.distance.value}, quantization: {quantization})..."
+        )
+        client.create_collection(
+            collection_name=version,
+            vectors_config=vectors_config,
+            quantization_config=quantization_config,
+        )
+        for field_name, schema in PAYLOAD_INDEXES.items():
+            client.create_payload_index(collection_name=version, field_name=field_name, field_schema=schema, wait=True)
+
+    def copy_points(self, client, collection_name, points):
+        if not points:
+            return
+        self.stdout.write(f"Copying {len(points)} correction points to '{collection_name}'...")
+        client.upload_points(
+            collection_name=collection_name,
+            points=[PointStruct(id=point_id, vector=vector, payload=payload) for point_id, (vector, payload) in points.items()],
+            wait=True
+        )
+
+    def switch_alias(self, client, version, live):
+        operations = [CreateAliasOperation(create_alias=CreateAlias(collection_name=version, alias_name=ALIAS))]
+        if live == ALIAS:
+            # One-time migration: the alias can't be created while a collection has its name.
+            self.stdout.write(self.style.WARNING(
+                f"Replacing the pre-alias '{ALIAS}' collection; searches fail until the alias exists."
+            ))
+            client.delete_collection(collection_name=ALIAS)
+        elif live:
+            operations.insert(0, DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=ALIAS)))
+        client.update_collection_aliases(change_aliases_operations=operations)
+
+    def rollback(self, client):
+        live = self.live_collection(client)
+        older = [version for version in self.versions(client) if live and version < live]
+        if not older:
+            self.stdout.write(self.style.ERROR("No earlier version to roll back to."))
+            return
+        self.switch_alias(client, older[-1], live)
+        self.stdout.write(self.style.SUCCESS(
+            f"'{ALIAS}' rolled back from '{live}' to '{older[-1]}'. Corrections trained since then are not in it."
+        ))
+
+    def prune_versions(self, client, keep):
+        live = self.live_collection(client)
+        older = [version for version in self.versions(client) if version != live]
+        for version in older[:max(len(older) - max(keep - 1, 0), 0)]:
+            self.stdout.write(f"Deleting old version '{version}'...")
+            client.delete_collection(collection_name=version)
+
+    def embed_all(self, items, batch_size, workers):
+        """Embeds (point_id, text) items in batches, `workers` calls at a time; failed batches are skipped."""
+        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        self.stdout.write(f"Embedding {len(items)} descriptions in {len(batches)} calls...")
+
+        def embed(batch):
+            result = genai.embed_content(
+                model=EMBEDDING_MODEL,
+                content=[text for _, text in batch],
+                task_type="retrieval_document"
+            )
+            return dict(zip([point_id for point_id, _ in batch], result['embedding']))
+
+        vectors = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(embed, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                try:
+                    vectors.update(future.result())
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"Error embedding a batch of {len(futures[future])} descriptions: {e}"))
+        return vectors
@@ -0,0 +1,47 @@
+"""
+Tests for the export_routing_history management command.
+"""
+import json
+import pytest
+from io import StringIO
+from django.core.management import call_command
+from ai_endpoints.models import AIAnalysis
+from message_app.models import Message, MessageContent
+
+
+@pytest.mark.django_db
+class TestExportRoutingHistory:
+    """Tests for the JSONL export used by the AI replay harness."""
+
+    def analysis(self, session, message, **fields):
+        return AIAnalysis.objects.create(session=session, message=message, suggested_department_id=7,
+                                         language_detected='uz', processing_time_ms=850, **fields)
+
+    def test_exports_text_decision_and_correction(self, telegram_session, message):
+        """Test that a corrected analysis is exported with the correction as the expected department."""
+        self.analysis(telegram_session, message, is_corrected=True, corrected_department_id=3)
+
+        out = StringIO()
+        call_command('export_routing_history', stdout=out)
+
+        record = json.loads(out.getvalue().splitlines()[0])
+        assert record["message_uuid"] == str(message.message_uuid)
+        assert record["text"] == "Test message content"
+        assert record["expected_department_id"] == 3
+        assert record["historical_department_id"] == 7
+
+    def test_corrected_only_and_textless_messages(self, telegram_session, citizen_user, message):
+        """Test that --corrected-only drops uncorrected analyses and messages without text are skipped."""
+        self.analysis(telegram_session, message)
+        sticker = Message.objects.create(session=telegram_session, sender=citizen_user, sender_platform='telegram')
+        MessageContent.objects.create(message=sticker, content_type='sticker')
+        self.analysis(telegram_session, sticker, is_corrected=True, corrected_department_id=3)
+
+        out = StringIO()
+        call_command('export_routing_history', '--corrected-only', stdout=out)
+        assert out.getvalue() == ""
+
+        out = StringIO()
+        call_command('export_routing_history', stdout=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert [r["expected_department_id"] for r in records] == [None]
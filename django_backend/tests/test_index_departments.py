@@ -0,0 +1,186 @@
+"""
+Tests for the index_departments management command.
+"""
+import uuid
+import pytest
+from io import StringIO
+from unittest.mock import patch, MagicMock
+from django.core.management import call_command
+from qdrant_client.models import Distance, Record, VectorParams
+from departments.models import Department
+from support_tools.management.commands.index_departments import NAMESPACE, ALIAS, content_hash
+
+COMMAND = 'support_tools.management.commands.index_departments'
+LIVE = f"{ALIAS}_v20250101000000"
+
+
+def point_id(dept, language):
+    return str(uuid.uuid5(NAMESPACE, f"{dept.id}_{language}"))
+
+
+def indexed(dept, language, **overrides):
+    """Record of a department point as a previous run stored it."""
+    name = getattr(dept, f"name_{language}")
+    description = getattr(dept, f"description_{language}")
+    payload = {"department_id": str(dept.id), "name": name, "description": description,
+               "language": language, "content_hash": content_hash(name, description), **overrides}
+    return Record(id=point_id(dept, language), vector=[0.5] * 768, payload=payload)
+
+
+def correction(department_id):
+    return Record(id=str(uuid.uuid4()), vector=[0.2] * 768,
+                  payload={"department_id": department_id, "is_correction": True, "description": "text"})
+
+
+def make_client(records, live=LIVE, versions=(LIVE,)):
+    """Qdrant client whose alias points at `live` holding `records`; count matches what was uploaded."""
+    client = MagicMock()
+    alias = MagicMock(alias_name=ALIAS, collection_name=live)
+    client.get_aliases.return_value.aliases = [alias] if live else []
+    client.collection_exists.return_value = False
+    # The live collection was built with the defaults: cosine, no quantization, vectors in RAM.
+    client.get_collection.return_value.config.params.vectors = VectorParams(size=768, distance=Distance.COSINE)
+    client.get_collection.return_value.config.quantization_config = None
+    client.scroll.return_value = (records, None)
+    collections = []
+    for name in versions:
+        collection = MagicMock()
+        collection.name = name
+        collections.append(collection)
+    client.get_collections.return_value.collections = collections
+
+    def count(collection_name, exact):
+        uploaded = sum(len(c.kwargs["points"]) for c in client.upload_points.call_args_list
+                       if c.kwargs["collection_name"] == collection_name)
+        return MagicMock(count=uploaded)
+    client.count.side_effect = count
+    return client
+
+
+def uploaded(client):
+    return [p for c in client.upload_points.call_args_list for p in c.kwargs["points"]]
+
+
+def run(client, *args):
+    out = StringIO()
+    with patch(f'{COMMAND}.QdrantClient', return_value=client), \
+            patch(f'{COMMAND}.genai') as mock_genai, \
+            patch.dict('os.environ', {"GEMINI_API_KEY": "test-key"}):
+        mock_genai.embed_content.side_effect = lambda model, content, task_type: {"embedding": [[0.1] * 768 for _ in content]}
+        call_command('index_departments', *args, stdout=out)
+    return mock_genai, out.getvalue()
+
+
+@pytest.mark.django_db
+class TestIndexDepartments:
+    """Tests for incremental blue/green indexing."""
+
+    def test_only_changed_description_is_embedded(self):
+        """Test that one edit costs one embedding call and unchanged vectors are reused in the new version."""
+        dept = Department.objects.create(name_uz="Suv", name_ru="Вода", description_uz="Suv ta'minoti",
+                                         description_ru="Водоснабжение", is_active=True)
+        client = make_client([indexed(dept, "uz"), indexed(dept, "ru", content_hash="stale")])
+
+        mock_genai, _ = run(client)
+
+        assert mock_genai.embed_content.call_count == 1
+        assert mock_genai.embed_content.call_args.kwargs["content"] == ["Водоснабжение"]
+        vectors = {p.id: p.vector for p in uploaded(client)}
+        assert vectors[point_id(dept, "uz")] == [0.5] * 768
+        assert vectors[point_id(dept, "ru")] == [0.1] * 768
+
+    def test_new_version_goes_live_with_corrections(self):
+        """Test that the alias switches to the new version, which carries the corrections."""
+        dept = Department.objects.create(name_uz="Yo'l", description_uz="Yo'llar", is_active=True)
+        client = make_client([indexed(dept, "uz", content_hash="stale"), correction(str(dept.id))])
+
+        run(client)
+
+        version = client.create_collection.call_args.kwargs["collection_name"]
+        assert version.startswith(f"{ALIAS}_v")
+        assert client.create_payload_index.called
+        assert any(p.payload.get("is_correction") for p in uploaded(client))
+        operations = client.update_collection_aliases.call_args.kwargs["change_aliases_operations"]
+        assert operations[-1].create_alias.collection_name == version
+        # The previous version is kept for rollback.
+        assert not client.delete_collection.called
+
+    def test_deactivated_department_is_left_out(self):
+        """Test that points of inactive departments are not carried into the new version."""
+        active = Department.objects.create(name_uz="Suv", description_uz="Suv", is_active=True)
+        inactive = Department.objects.create(name_uz="Yo'l", description_uz="Yo'llar", is_active=False)
+        client = make_client([indexed(active, "uz"), indexed(inactive, "uz")])
+
+        mock_genai, _ = run(client)
+
+        assert not mock_genai.embed_content.called
+        assert [p.id for p in uploaded(client)] == [point_id(active, "uz")]
+        assert client.update_collection_aliases.called
+
+    def test_failed_validation_keeps_alias(self):
+        """Test that a build with missing points is discarded instead of going live."""
+        dept = Department.objects.create(name_uz="Suv", description_uz="Suv", is_active=True)
+        client = make_client([])
+
+        with patch(f'{COMMAND}.Command.embed_all', return_value={}):
+            run(client)
+
+        assert not client.update_collection_aliases.called
+        assert client.delete_collection.called
+
+    def test_dry_run_reports_without_writing(self):
+        """Test that --dry-run prints the diff and neither embeds nor writes."""
+        Department.objects.create(name_uz="Chiroq", description_uz="Ko'cha chiroqlari", is_active=True)
+        client = make_client([])
+
+        mock_genai, output = run(client, '--dry-run')
+
+        assert "1 new" in output
+        assert "[new]" in output
+        assert not mock_genai.embed_content.called
+        assert not client.create_collection.called
+        assert not client.update_collection_aliases.called
+
+    def test_int8_quantization_is_configured(self):
+        """Test that --quantization int8 creates the version with scalar quantization and originals on disk."""
+        Department.objects.create(name_uz="Suv", description_uz="Suv", is_active=True)
+        client = make_client([])
+
+        run(client, '--quantization', 'int8')
+
+        config = client.create_collection.call_args.kwargs["quantization_config"]
+        assert config.scalar.type == "int8"
+        assert config.scalar.always_ram
+        assert client.create_collection.call_args.kwargs["vectors_config"].on_disk
+
+    def test_unchanged_index_builds_nothing(self):
+        """Test that same content and same collection config leave the live version in place."""
+        dept = Department.objects.create(name_uz="Suv", description_uz="Suv", is_active=True)
+        client = make_client([indexed(dept, "uz")])
+
+        _, output = run(client)
+
+        assert "Nothing changed" in output
+        assert not client.create_collection.called
+
+    def test_config_change_builds_new_version(self):
+        """Test that turning on quantization rebuilds the index from the live vectors without re-embedding."""
+        dept = Department.objects.create(name_uz="Suv", description_uz="Suv", is_active=True)
+        client = make_client([indexed(dept, "uz")])
+
+        mock_genai, _ = run(client, '--quantization', 'int8')
+
+        assert not mock_genai.embed_content.called
+        assert client.create_collection.call_args.kwargs["quantization_config"].scalar.type == "int8"
+        assert [p.vector for p in uploaded(client)] == [[0.5] * 768]
+        assert client.update_collection_aliases.called
+
+    def test_rollback_switches_to_previous_version(self):
+        """Test that --rollback points the alias at the version before the live one."""
+        previous = f"{ALIAS}_v20240101000000"
+        client = make_client([], versions=(previous, LIVE))
+
+        run(client, '--rollback')
+
+        operations = client.update_collection_aliases.call_args.kwargs["change_aliases_operations"]
+        assert operations[-1].create_alias.collection_name == previous
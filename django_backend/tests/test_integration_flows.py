@@ -38,8 +38,8 @@ class TestCompleteMessageFlow:
             # For now, we verify the message exists
             assert Message.objects.filter(message_uuid=message_uuid).exists()
     
-    @patch('api.views.requests.post')
-    def test_ai_routing_to_webhook_flow(self, mock_webhook, api_client, 
+    @patch('api.views.route_message_to_department', return_value=({'status': 'success'}, 200))
+    def test_ai_routing_to_webhook_flow(self, mock_route, api_client, 
                                         telegram_session, message, department):
         """Test flow: AI analysis → Routing result → Webhook → Session update."""
         # Step 1: AI microservice sends routing result
@@ -55,8 +55,6 @@ class TestCompleteMessageFlow:
             'processing_time_ms': 1500
         }
         
-        mock_webhook.return_value.status_code = 200
-        
         response = api_client.post('/api/internal/routing-result/', routing_data, format='json')
         
         assert response.status_code == status.HTTP_200_OK
@@ -64,8 +62,8 @@ class TestCompleteMessageFlow:
         # Step 2: Verify AIAnalysis was created
         assert AIAnalysis.objects.filter(session=telegram_session).exists()
         
-        # Step 3: Verify webhook was called (mocked)
-        assert mock_webhook.called
+        # Step 3: Verify the session was routed (mocked)
+        assert mock_route.called
     
     @patch('message_app.views_ai_webhook.validate_webhook_request', return_value=True)
     @patch('message_app.views_ai_webhook.broadcast_session_created')
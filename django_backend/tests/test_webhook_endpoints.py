@@ -3,6 +3,7 @@ Tests for webhook endpoints (internal and AI).
 """
 import pytest
 from unittest.mock import patch, MagicMock
+from django.test import override_settings
 from rest_framework import status
 from message_app.models import Session, Message
 from ai_endpoints.models import InjectionLog, AIAnalysis
@@ -45,11 +46,9 @@ class TestInjectionAlert:
 class TestRoutingResult:
     """Tests for POST /api/internal/routing-result/ endpoint."""
     
-    @patch('api.views.requests.post')
-    def test_routing_result_success(self, mock_post, api_client, telegram_session, message, department):
+    @patch('api.views.route_message_to_department', return_value=({'status': 'success'}, 200))
+    def test_routing_result_success(self, mock_route, api_client, telegram_session, message, department):
         """Test successful routing result processing."""
-        mock_post.return_value.status_code = 200
-        
         data = {
             'session_uuid': str(telegram_session.session_uuid),
             'message_uuid': str(message.message_uuid),
@@ -69,8 +68,8 @@ class TestRoutingResult:
         
         assert response.status_code == status.HTTP_200_OK
         assert AIAnalysis.objects.filter(session=telegram_session).exists()
-        # Verify webhook was called
-        assert mock_post.called
+        # Verify the session was routed
+        assert mock_route.called
     
     def test_routing_result_missing_session(self, api_client, message):
         """Test routing result with non-existent session."""
@@ -100,6 +99,200 @@ class TestRoutingResult:
         assert AIAnalysis.objects.filter(session=telegram_session).exists()
 
 
+    @patch('api.views.route_message_to_department', return_value=({'status': 'success'}, 200))
+    def test_routing_result_duplicate_is_ignored(self, mock_route, api_client, telegram_session, message, department):
+        """Test that a redelivered result doesn't create a second analysis or reroute."""
+        data = {
+            'session_uuid': str(telegram_session.session_uuid),
+            'message_uuid': str(message.message_uuid),
+            'suggested_department_id': department.id,
+            'intent_label': 'Complaint'
+        }
+        
+        api_client.post('/api/internal/routing-result/', data, format='json')
+        response = api_client.post('/api/internal/routing-result/', data, format='json')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['status'] == 'duplicate'
+        assert AIAnalysis.objects.filter(message=message).count() == 1
+        assert mock_route.call_count == 1
+
+    @patch('api.views.route_message_to_department', return_value=({'error': 'unavailable'}, 500))
+    def test_routing_result_redelivery_retries_failed_routing(self, mock_route, api_client, telegram_session, message, department):
+        """Test that a redelivery is applied again while the session hasn't reached the department."""
+        telegram_session.assigned_department = None
+        telegram_session.save(update_fields=['assigned_department'])
+        data = {
+            'session_uuid': str(telegram_session.session_uuid),
+            'message_uuid': str(message.message_uuid),
+            'suggested_department_id': department.id,
+        }
+
+        api_client.post('/api/internal/routing-result/', data, format='json')
+        response = api_client.post('/api/internal/routing-result/', data, format='json')
+
+        assert response.data['status'] == 'processed'
+        assert AIAnalysis.objects.filter(message=message).count() == 1
+        assert mock_route.call_count == 2
+
+    @patch('api.views.route_message_to_department', return_value=({'status': 'success'}, 200))
+    def test_routing_result_reanalysis_updates_and_reroutes(self, mock_route, api_client, telegram_session, message, department):
+        """Test that a newer result for an analyzed message updates its analysis instead of being dropped."""
+        other = Department.objects.create(name_uz="Suv ta'minoti", name_ru="Водоснабжение", is_active=True)
+        data = {
+            'session_uuid': str(telegram_session.session_uuid),
+            'message_uuid': str(message.message_uuid),
+            'suggested_department_id': department.id,
+        }
+
+        api_client.post('/api/internal/routing-result/', data, format='json')
+        response = api_client.post('/api/internal/routing-result/', {**data, 'suggested_department_id': other.id}, format='json')
+
+        assert response.data['status'] == 'processed'
+        analysis = AIAnalysis.objects.get(message=message)
+        assert analysis.suggested_department_id == other.id
+        assert mock_route.call_count == 2
+
+
+@pytest.mark.django_db
+class TestRoutingResultBatch:
+    """Tests for POST /api/internal/routing-result/batch/ endpoint."""
+    
+    @patch('api.views.route_message_to_department', return_value=({'status': 'success'}, 200))
+    def test_routing_result_batch_success(self, mock_route, api_client, telegram_session, message, department):
+        """Test that every result in the batch is applied."""
+        data = {'results': [
+            {
+                'session_uuid': str(telegram_session.session_uuid),
+                'message_uuid': str(message.message_uuid),
+                'suggested_department_id': department.id,
+                'intent_label': 'Complaint',
+                'confidence_score': 85,
+                'language_detected': 'uz'
+            },
+            {
+                'session_uuid': '00000000-0000-0000-0000-000000000000',
+                'message_uuid': str(message.message_uuid)
+            }
+        ]}
+        
+        response = api_client.post('/api/internal/routing-result/batch/', data, format='json')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['processed'] == 1
+        assert response.data['results'][1]['status_code'] == status.HTTP_404_NOT_FOUND
+        assert AIAnalysis.objects.filter(session=telegram_session).count() == 1
+        # Routed in-process, one call per routed result and no HTTP loopback.
+        assert mock_route.call_count == 1
+    
+    def test_routing_result_batch_invalid_body(self, api_client):
+        """Test batch without a results list."""
+        response = api_client.post('/api/internal/routing-result/batch/', {'results': 'x'}, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestTrainCorrectionBatch:
+    """Tests for POST /api/internal/train-correction/batch/ endpoint."""
+
+    @patch('message_app.utils_telegram.send_text_to_telegram')
+    @patch('api.views.route_message_to_department', return_value=({'status': 'success'}, 200))
+    def test_train_correction_batch_success(self, mock_route, mock_telegram, api_client, telegram_session, message, department):
+        """Test that every correction in the batch is stored, with a status per message."""
+
+        data = {'results': [
+            {
+                'message_uuid': str(message.message_uuid),
+                'correct_department_id': department.id,
+                'language': 'uz',
+                'correction_notes': 'Street lights belong here'
+            },
+            {
+                'message_uuid': '00000000-0000-0000-0000-000000000000',
+                'correct_department_id': department.id
+            }
+        ]}
+
+        response = api_client.post('/api/internal/train-correction/batch/', data, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['processed'] == 1
+        assert response.data['results'][1]['status_code'] == status.HTTP_404_NOT_FOUND
+        analysis = AIAnalysis.objects.get(message=message)
+        assert analysis.is_corrected
+        assert analysis.corrected_department_id == department.id
+        # Rerouted in-process, no HTTP loopback.
+        mock_route.assert_called_once_with(str(telegram_session.session_uuid), department.id, str(message.message_uuid))
+
+    def test_train_correction_batch_invalid_body(self, api_client):
+        """Test batch without a results list."""
+        response = api_client.post('/api/internal/train-correction/batch/', {'results': 'x'}, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestTrainCorrectionProxy:
+    """Tests for POST /api/train-correction/, which forwards staff corrections to FastAPI."""
+
+    @pytest.mark.parametrize('queue_enabled, timeout', [(True, 5.0), (False, 30.0)])
+    @patch('api.views.requests.post')
+    def test_timeout_follows_correction_queue_mode(self, mock_post, queue_enabled, timeout,
+                                                   authenticated_staff_client, message, department):
+        """Test the short timeout for queued corrections and the long one for synchronous training."""
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"queued": queue_enabled}
+        data = {'text': 'Suv yo\'q', 'correct_department_id': department.id, 'message_uuid': str(message.message_uuid)}
+
+        with override_settings(AI_CORRECTION_QUEUE_ENABLED=queue_enabled):
+            response = authenticated_staff_client.post('/api/train-correction/', data, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert mock_post.call_args.kwargs['timeout'] == timeout
+
+
+@pytest.mark.django_db
+class TestInlineRoutingResult:
+    """Tests for decisions returned inline by the AI service (analyze mode=sync)."""
+
+    @patch('message_app.views_ai_webhook.broadcast_session_created')
+    @patch('message_app.views_ai_webhook.broadcast_message_created')
+    @patch('api.views.requests.post')
+    def test_inline_result_routes_without_loopback(self, mock_post, mock_broadcast_msg, mock_broadcast_session,
+                                                   telegram_session, message):
+        """Test that an inline decision is stored and routed in-process, without HTTP calls."""
+        from api.views import apply_inline_routing_result
+        other = Department.objects.create(name_uz="Suv ta'minoti", name_ru="Водоснабжение", is_active=True)
+
+        body, code = apply_inline_routing_result({
+            'session_uuid': str(telegram_session.session_uuid),
+            'message_uuid': str(message.message_uuid),
+            'suggested_department_id': other.id,
+            'intent_label': 'Complaint'
+        })
+
+        assert code == status.HTTP_200_OK
+        assert AIAnalysis.objects.filter(message=message).exists()
+        telegram_session.refresh_from_db()
+        assert telegram_session.assigned_department == other
+        assert not mock_post.called
+
+    @patch('api.views.apply_inline_routing_result')
+    @patch('message_app.tasks.requests.post')
+    def test_task_applies_sync_result(self, mock_post, mock_apply, telegram_session, message):
+        """Test that the analyze task sends the text in sync mode and applies a completed result."""
+        from message_app.tasks import analyze_message_task
+        result = {'session_uuid': str(telegram_session.session_uuid), 'message_uuid': str(message.message_uuid)}
+        mock_post.return_value.json.return_value = {'status': 'completed', 'result': result}
+
+        analyze_message_task.run(str(telegram_session.session_uuid), str(message.message_uuid))
+
+        assert 'mode=sync' in mock_post.call_args.args[0]
+        assert mock_post.call_args.kwargs['json']['text'] == 'Test message content'
+        mock_apply.assert_called_once_with(result)
+
+
 @pytest.mark.django_db
 class TestAIWebhook:
     """Tests for POST /api/ai/route_message/ endpoint."""
@@ -13,6 +13,10 @@ class AnalyzeRequest(BaseModel):
     text: str
     settings: Optional[GeminiSettings] = None
 
+class AnalyzeBatchRequest(BaseModel):
+    # Items are validated one by one so that a bad item doesn't reject the whole batch.
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=500)
+
 class TrainCorrectionRequest(BaseModel):
     text: str
     correct_department_id: str
@@ -26,6 +30,14 @@ class Candidate(BaseModel):
     name: str = ""
     description: str = ""
     score: float = 0.0
+    is_correction: bool = False
+    point_id: Optional[str] = None
+    # Set by hybrid retrieval: BM25 score and reciprocal-rank-fused score.
+    lexical_score: Optional[float] = None
+    fused_score: Optional[float] = None
+    # Set on correction kNN vote entries: agreeing corrections and share of the weighted vote.
+    votes: Optional[int] = None
+    vote_share: Optional[float] = None
 
 class RoutingResult(BaseModel):
     department_id: str
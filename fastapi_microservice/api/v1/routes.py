@@ -1,19 +1,135 @@
-from fastapi import APIRouter, BackgroundTasks, HTTPException
-from api.v1.models import AnalyzeRequest, TrainCorrectionRequest
-from services.ai_pipeline import process_message_pipeline, train_correction_pipeline
+from typing import Literal, Optional
+from uuid import UUID
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import ValidationError
+from api.v1.models import AnalyzeRequest, AnalyzeBatchRequest, TrainCorrectionRequest
+from services.ai_pipeline import (
+    train_correction_pipeline, embedding_batcher, analysis_queue, batch_queue, outbox,
+    analyze_sync, sync_stats, SYNC_ANALYZE_ENABLED, SYNC_ANALYZE_DEADLINE_MS, correction_queue, training_stats
+)
+from services.correction_queue import CorrectionQueueFull, CORRECTION_QUEUE_ENABLED
+from services.rate_limiter import generate_limiter, embed_limiter
+from services.embedding_provider import local_embedding_index
+from services.near_duplicate import near_duplicate_index
+from services.lexical_index import lexical_index
+from services.correction_classifier import correction_classifier
+from services.hedging import hedger
+from services.injection_scanner import injection_scanner
+from services.circuit_breaker import BREAKERS
+from services.fake_backends import AI_BACKEND, fake_gemini
+from services.embedding_cache import embedding_cache
+from services.vector_index import vector_index
+from services.work_queue import QueueFull, QueueUnavailable
+from services.routing_policy import routing_policy
+from services.decision_cache import decision_cache
 
 router = APIRouter()
 
 @router.post("/analyze")
-async def analyze_message(request: AnalyzeRequest, background_tasks: BackgroundTasks):
-    # Queues processing in the background.
-    background_tasks.add_task(process_message_pipeline, request)
+async def analyze_message(request: AnalyzeRequest, mode: Literal["async", "sync"] = "async",
+                          deadline_ms: Optional[int] = Query(None, gt=0, le=30000)):
+    # mode=sync returns the routing decision inline when it is ready within the deadline;
+    # later results, and anything the inline slots can't take, go the webhook way.
+    if mode == "sync" and SYNC_ANALYZE_ENABLED:
+        status, result = await analyze_sync(request, (deadline_ms or SYNC_ANALYZE_DEADLINE_MS) / 1000)
+        if status == "completed":
+            return {"status": "completed", "message_uuid": request.message_uuid, "result": result}
+        if status == "processing":
+            return {"status": "processing", "message_uuid": request.message_uuid}
+
+    # Queues processing for the worker pool; refuses work once the backlog is too deep.
+    try:
+        await analysis_queue.enqueue(request.model_dump(mode="json"))
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    except QueueUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     return {"status": "processing", "message_uuid": request.message_uuid}
 
+@router.post("/analyze/batch")
+async def analyze_batch(request: AnalyzeBatchRequest):
+    # Queues the accepted items as one batch with shared embedding, search and webhooks.
+    results = []
+    accepted = []
+    seen = set()
+    for item in request.items:
+        try:
+            parsed = AnalyzeRequest.model_validate(item)
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            message_uuid = item.get("message_uuid") if isinstance(item, dict) else None
+            results.append({"message_uuid": message_uuid, "accepted": False, "error": errors})
+            continue
+        if parsed.message_uuid in seen:
+            results.append({"message_uuid": str(parsed.message_uuid), "accepted": False, "error": "Duplicate message_uuid in batch."})
+            continue
+        seen.add(parsed.message_uuid)
+        accepted.append(parsed.model_dump(mode="json"))
+        results.append({"message_uuid": str(parsed.message_uuid), "accepted": True})
+
+    if accepted:
+        try:
+            await batch_queue.enqueue({"items": accepted})
+        except QueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+        except QueueUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    return {
+        "status": "processing",
+        "accepted": len(accepted),
+        "rejected": len(results) - len(accepted),
+        "results": results,
+    }
+
 @router.post("/train-correction")
 async def train_correction(request: TrainCorrectionRequest):
+    # Acknowledges at once; the correction queue trains corrections in batches.
+    if CORRECTION_QUEUE_ENABLED:
+        try:
+            pending = await correction_queue.add(str(request.message_uuid), request)
+        except CorrectionQueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+        return {"status": "success", "queued": True, "pending": pending}
     try:
         await train_correction_pipeline(request)
-        return {"status": "success"}
+        return {"status": "success", "queued": False}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/train-correction/status")
+async def train_correction_status(message_uuid: Optional[UUID] = None):
+    # Backlog of corrections waiting to be trained; with message_uuid, whether that one still waits.
+    status = {**correction_queue.stats(), "recent_dead_letters": await correction_queue.dead_letters(),
+              "training": dict(training_stats)}
+    if message_uuid:
+        status["message_uuid"] = message_uuid
+        status["queued"] = correction_queue.is_pending(str(message_uuid))
+    return status
+
+@router.get("/stats")
+async def stats():
+    # Exposes queue, cache, batching, index, routing and quota counters for tuning.
+    return {
+        "analysis_queue": await analysis_queue.stats(),
+        "batch_queue": await batch_queue.stats(),
+        "outbox": await outbox.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "embedding_batcher": embedding_batcher.stats(),
+        "vector_index": vector_index.stats(),
+        "local_embedding_index": local_embedding_index.stats(),
+        "lexical_index": lexical_index.stats(),
+        "correction_classifier": correction_classifier.stats(),
+        "hedger": hedger.stats(),
+        "injection_scanner": injection_scanner.stats(),
+        "circuit_breakers": {b.name: b.stats() for b in BREAKERS},
+        "routing_policy": routing_policy.stats(),
+        "decision_cache": decision_cache.stats(),
+        "near_duplicate_index": near_duplicate_index.stats(),
+        "generate_limiter": generate_limiter.stats(),
+        "embed_limiter": embed_limiter.stats(),
+        "sync_analyze": dict(sync_stats),
+        "correction_queue": correction_queue.stats(),
+        "training": dict(training_stats),
+        "fake_gemini": fake_gemini.stats() if AI_BACKEND == "fake" else None,
+    }
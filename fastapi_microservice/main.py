@@ -1,14 +1,105 @@
+import asyncio
+import contextlib
+from contextlib import asynccontextmanager
+
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
 load_dotenv()
 
 from api.v1.routes import router as v1_router
+from services import ai_pipeline
+from services.ai_pipeline import analysis_queue, batch_queue, correction_queue, embedding_batcher, outbox, logger
+from services.vector_index import vector_index, VECTOR_INDEX_ENABLED
+from services.embedding_cache import embedding_cache
+from services.routing_policy import routing_policy
+from services.decision_cache import decision_cache
+from services.metrics import stats_collector
+from services.rate_limiter import generate_limiter, embed_limiter
+from services.outbox import OUTBOX_ENABLED
+from services.embedding_provider import local_embedding_index
+from services.near_duplicate import near_duplicate_index
+from services.lexical_index import lexical_index
+from services.correction_classifier import correction_classifier
+from services.hedging import hedger
+from services.injection_scanner import injection_scanner
+from services.circuit_breaker import BREAKERS
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connects clients and warms up before serving, keeps the local index and injection rules in sync and runs the workers.
+    await ai_pipeline.connect_qdrant()
+    await ai_pipeline.warmup()
+    poll_task = None
+    if VECTOR_INDEX_ENABLED and ai_pipeline.qdrant_client:
+        poll_task = asyncio.create_task(vector_index.poll_forever(ai_pipeline.qdrant_client))
+    # Loads the injection rules before serving, then picks up changes.
+    await injection_scanner.refresh()
+    rules_task = asyncio.create_task(injection_scanner.poll_forever())
+    if OUTBOX_ENABLED:
+        await outbox.start()
+    await analysis_queue.start()
+    await batch_queue.start()
+    await correction_queue.start()
+
+    yield
+
+    # Trains the corrections still pending while Qdrant and the outbox are up.
+    await correction_queue.stop()
+    await analysis_queue.stop()
+    await batch_queue.stop()
+    await outbox.stop()
+    for task in (poll_task, rules_task):
+        if task:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+    await ai_pipeline.close_clients()
 
-app = FastAPI(title="CivicConnect AI Microservice")
+
+app = FastAPI(title="CivicConnect AI Microservice", lifespan=lifespan)
 
 app.include_router(v1_router, prefix="/api/v1")
 
+# Subsystem counters are exported alongside the pipeline's stage metrics.
+stats_collector.register("embedding_cache", embedding_cache.stats)
+stats_collector.register("embedding_batcher", embedding_batcher.stats)
+stats_collector.register("vector_index", vector_index.stats)
+stats_collector.register("local_embedding_index", local_embedding_index.stats)
+stats_collector.register("lexical_index", lexical_index.stats)
+stats_collector.register("correction_classifier", correction_classifier.stats)
+stats_collector.register("hedger", hedger.stats)
+stats_collector.register("injection_scanner", injection_scanner.stats)
+stats_collector.register("routing_policy", routing_policy.stats)
+stats_collector.register("decision_cache", decision_cache.stats)
+stats_collector.register("near_duplicate_index", near_duplicate_index.stats)
+stats_collector.register("generate_limiter", generate_limiter.stats)
+stats_collector.register("embed_limiter", embed_limiter.stats)
+stats_collector.register_async("analysis_queue", analysis_queue.stats)
+stats_collector.register_async("batch_queue", batch_queue.stats)
+stats_collector.register_async("outbox", outbox.stats)
+for breaker in BREAKERS:
+    stats_collector.register(f"circuit_{breaker.name}", breaker.stats)
+stats_collector.register("sync_analyze", lambda: dict(ai_pipeline.sync_stats))
+stats_collector.register("correction_queue", correction_queue.stats)
+stats_collector.register("training", lambda: dict(ai_pipeline.training_stats))
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Prometheus scrape endpoint.
+    await stats_collector.refresh()
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    # Readiness probe: 503 until this worker is warmed up and can search.
+    status = ai_pipeline.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8001, reload=True)
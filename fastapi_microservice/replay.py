@@ -0,0 +1,284 @@
+"""
+Offline routing evaluation: replays historical messages through the analysis pipeline.
+
+Input is JSONL, one message per line, e.g. as written by Django's
+`python manage.py export_routing_history`:
+
+    {"message_uuid": "...", "session_uuid": "...", "text": "...",
+     "expected_department_id": 12, "historical_department_id": 7}
+
+Only `text` is required (`body` is accepted too). `expected_department_id` is the staff
+correction or the accepted suggestion; messages without it count for latency only.
+
+    python replay.py history.jsonl --concurrency 8 --output decisions.jsonl
+    python replay.py history.jsonl --embeddings local --no-llm --cold
+    python replay.py history.jsonl --backend fake   # in-process Gemini/Qdrant, see fake_backends
+
+Results are not delivered to Django. The report covers accuracy, LLM-bypass rate,
+outcomes, throughput and p50/p95/p99 latency per stage. Accuracy, rates and latencies
+are over routing decisions the pipeline made; answers reused from the decision cache or
+a near-duplicate are counted apart under "reused". Near-duplicate reuse is off unless
+--near-duplicates is given; --cold also turns off the decision cache.
+
+A replayed message that staff corrected has its own correction point in the collection,
+which would hand the pipeline the expected answer. Replay searches a local snapshot of
+the collection with the replayed texts' correction points taken out; --keep-corrections
+searches everything. Redis (decision and embedding caches) is a separate DB, REPLAY_REDIS_DB,
+unless --shared-redis is given, so replays never write to the live decision cache.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import logging
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import numpy as np
+
+from services.metrics import PipelineTrace, pipeline_trace
+
+PERCENTILES = (50, 95, 99)
+# Outcomes that reuse an earlier decision instead of routing the message.
+REUSED_OUTCOMES = ("decision_cache_hit", "near_duplicate")
+# Redis DB of replay runs; 0-2 are Celery, the Django cache and the AI service.
+REPLAY_REDIS_DB = int(os.getenv("REPLAY_REDIS_DB", 3))
+
+logger = logging.getLogger("ai_pipeline.replay")
+
+
+def load_records(lines: Iterable[str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Parses JSONL messages; lines without text are skipped."""
+    records = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        text = record.get("text") or record.get("body")
+        if not text:
+            continue
+        records.append({
+            **record,
+            "text": text,
+            "session_uuid": record.get("session_uuid") or str(uuid.uuid4()),
+            "message_uuid": record.get("message_uuid") or str(uuid.uuid4()),
+        })
+        if limit and len(records) >= limit:
+            break
+    return records
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {f"p{p}": 0.0 for p in PERCENTILES}
+    points = np.percentile(np.array(values) * 1000, PERCENTILES)
+    return {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, points)}
+
+
+def same_department(a, b) -> bool:
+    return a is not None and b is not None and str(a) == str(b)
+
+
+def summarize(results: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """Aggregates per-message results into the report; reused decisions are reported apart."""
+    done = [r for r in results if not r.get("error")]
+    reused = [r for r in done if r["outcome"] in REUSED_OUTCOMES]
+    decided = [r for r in done if r["outcome"] not in REUSED_OUTCOMES]
+    labeled = [r for r in decided if r.get("expected_department_id") is not None]
+    historical = [r for r in labeled if r.get("historical_department_id") is not None]
+    reused_labeled = [r for r in reused if r.get("expected_department_id") is not None]
+
+    stages: Dict[str, List[float]] = {}
+    for r in decided:
+        for stage, seconds in r["stages"].items():
+            stages.setdefault(stage, []).append(seconds)
+
+    return {
+        "messages": len(results),
+        "errors": len(results) - len(done),
+        "decided": len(decided),
+        "labeled": len(labeled),
+        "accuracy": round(sum(same_department(r["department_id"], r["expected_department_id"]) for r in labeled)
+                          / len(labeled), 4) if labeled else None,
+        # Accuracy of the decisions stored at the time, on the same messages: the baseline to beat.
+        "historical_accuracy": round(sum(same_department(r["historical_department_id"], r["expected_department_id"])
+                                         for r in historical) / len(historical), 4) if historical else None,
+        "llm_bypass_rate": round(sum(r["llm_bypassed"] for r in decided) / len(decided), 4) if decided else 0.0,
+        "manual_routing_rate": round(sum(r["needs_manual_routing"] for r in decided) / len(decided), 4) if decided else 0.0,
+        "outcomes": dict(Counter(r["outcome"] for r in decided).most_common()),
+        "reused": {
+            **{outcome: sum(r["outcome"] == outcome for r in reused) for outcome in REUSED_OUTCOMES},
+            "labeled": len(reused_labeled),
+            "accuracy": round(sum(same_department(r["department_id"], r["expected_department_id"]) for r in reused_labeled)
+                              / len(reused_labeled), 4) if reused_labeled else None,
+        },
+        "throughput_per_second": round(len(results) / wall_seconds, 2) if wall_seconds else 0.0,
+        "wall_seconds": round(wall_seconds, 2),
+        "latency_ms": {
+            "total": percentiles([r["seconds"] for r in decided]),
+            **{stage: percentiles(values) for stage, values in sorted(stages.items())},
+        },
+    }
+
+
+async def replay_one(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Analyzes one message (Steps 1-5 of process_message_pipeline, without the webhook)."""
+    from services import ai_pipeline
+    from api.v1.models import AnalyzeRequest
+
+    trace = PipelineTrace()
+    token = pipeline_trace.set(trace)
+    result = {
+        "message_uuid": record["message_uuid"],
+        "expected_department_id": record.get("expected_department_id"),
+        "historical_department_id": record.get("historical_department_id"),
+    }
+    started = time.perf_counter()
+    try:
+        request = AnalyzeRequest(session_uuid=record["session_uuid"], message_uuid=record["message_uuid"],
+                                 text=record["text"], settings=record.get("settings"))
+        _, data = await ai_pipeline.analyze_request(request)
+    except Exception as e:
+        logger.error(f"Replay of {record['message_uuid']} failed: {e}")
+        return {**result, "error": str(e)}
+    finally:
+        pipeline_trace.reset(token)
+    return {
+        **result,
+        "department_id": data.get("suggested_department_id"),
+        "confidence": data.get("confidence_score"),
+        "outcome": trace.outcome or "unknown",
+        "llm_bypassed": bool(data.get("llm_bypassed")),
+        "needs_manual_routing": bool(data.get("needs_manual_routing")),
+        "seconds": trace.seconds or time.perf_counter() - started,
+        "stages": trace.stages,
+    }
+
+
+async def exclude_own_corrections(records: List[Dict[str, Any]]) -> int:
+    """Takes the replayed texts' correction points out of the local snapshot; returns how many.
+
+    Searches, kNN votes and the lexical index all read the snapshot, and Qdrant itself is
+    left untouched. A correction point is matched by its ID or, when it was trained under
+    another language, by its description being the replayed text.
+    """
+    from services import ai_pipeline
+
+    texts = {record["text"] for record in records}
+    own_ids = {ai_pipeline.correction_point_id(text, ai_pipeline.detect_language(text)) for text in texts}
+    excluded = [
+        point_id for point_id, payload in ai_pipeline.vector_index.points()
+        if payload.get("is_correction") and (str(point_id) in own_ids or payload.get("description") in texts)
+    ]
+    for point_id in excluded:
+        ai_pipeline.vector_index.remove(point_id)
+    await ai_pipeline.rebuild_local_embedding_index()
+    await ai_pipeline.rebuild_lexical_index()
+    await ai_pipeline.rebuild_correction_classifier()
+    return len(excluded)
+
+
+async def replay(records: List[Dict[str, Any]], concurrency: int = 8) -> List[Dict[str, Any]]:
+    """Replays records with at most `concurrency` analyses in flight; results keep input order."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(record):
+        async with semaphore:
+            return await replay_one(record)
+
+    return await asyncio.gather(*(run(r) for r in records))
+
+
+async def run_replay(args) -> Dict[str, Any]:
+    from services import ai_pipeline
+    # The pipeline logs every step to stdout, where the report goes.
+    logging.getLogger("ai_pipeline").setLevel(logging.WARNING)
+
+    if args.no_llm:
+        # Every LLM step takes the top-candidate fallback, as with an open circuit.
+        async def no_llm(*_, **__):
+            raise ai_pipeline.CircuitOpenError("LLM disabled for replay")
+        ai_pipeline.generate_decision = no_llm
+
+    with open(args.input, encoding="utf-8") as f:
+        records = load_records(f, args.limit)
+
+    await ai_pipeline.connect_qdrant()
+    await ai_pipeline.warmup()
+    excluded = 0
+    if not args.keep_corrections:
+        if not ai_pipeline.vector_index.ready:
+            await ai_pipeline.close_clients()
+            raise SystemExit("Replay needs the local vector index to leave out the messages' own corrections; "
+                             "check Qdrant or pass --keep-corrections.")
+        excluded = await exclude_own_corrections(records)
+    try:
+        started = time.perf_counter()
+        results = await replay(records, args.concurrency)
+        report = summarize(results, time.perf_counter() - started)
+        report["excluded_correction_points"] = excluded
+    finally:
+        await ai_pipeline.close_clients()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replays messages through the routing pipeline and reports quality and latency.")
+    parser.add_argument("input", help="JSONL file of messages.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Analyses in flight at once.")
+    parser.add_argument("--limit", type=int, help="Replay only the first N messages.")
+    parser.add_argument("--output", help="Writes one decision per message to this JSONL file.")
+    parser.add_argument("--backend", choices=["real", "fake"], help="Gemini/Qdrant or their stand-ins (default: AI_BACKEND).")
+    parser.add_argument("--embeddings", choices=["gemini", "local"], help="Embedding provider (default: EMBEDDING_PROVIDER).")
+    parser.add_argument("--no-llm", action="store_true", help="Skip Gemini generation; route on the top candidate.")
+    parser.add_argument("--cold", action="store_true",
+                        help="Disable the decision cache (embeddings stay cached).")
+    parser.add_argument("--near-duplicates", action="store_true",
+                        help="Reuse decisions of near-duplicate messages, as the service does (off by default).")
+    parser.add_argument("--keep-corrections", action="store_true",
+                        help="Search the replayed messages' own correction points too (leaks the expected answer).")
+    parser.add_argument("--shared-redis", action="store_true",
+                        help=f"Use the service's Redis DB instead of DB {REPLAY_REDIS_DB} (writes to the live decision cache).")
+    return parser.parse_args(argv)
+
+
+def replay_redis_url(url: str, db: int = REPLAY_REDIS_DB) -> str:
+    """Returns the Redis URL pointed at another DB."""
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=f"/{db}"))
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    # Read by the services at import, so set before the pipeline is loaded.
+    if args.backend:
+        os.environ["AI_BACKEND"] = args.backend
+    if args.embeddings:
+        os.environ["EMBEDDING_PROVIDER"] = args.embeddings
+    if args.cold:
+        os.environ["DECISION_CACHE_ENABLED"] = "false"
+    # A reused neighbour's decision isn't a routing decision, so replays route every message unless asked.
+    os.environ["NEAR_DUPLICATE_ENABLED"] = "true" if args.near_duplicates else "false"
+    if not args.keep_corrections:
+        # Corrections are left out of the local snapshot, so searches must not go to Qdrant.
+        os.environ["VECTOR_INDEX_ENABLED"] = "true"
+    if not args.shared_redis:
+        from services import redis_client
+        redis_client.REDIS_URL = replay_redis_url(redis_client.REDIS_URL)
+    report = asyncio.run(run_replay(args))
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
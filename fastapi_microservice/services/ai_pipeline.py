@@ -6,22 +6,85 @@ import json
 import asyncio
 import logging
 import sys
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
 import google.generativeai as genai
-from qdrant_client import QdrantClient
-from qdrant_client.models import Filter, FieldCondition, MatchValue
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Filter, FieldCondition, MatchValue, SearchParams, QuantizationSearchParams, PointStruct
 
 # Import models from the api/v1 folder
 from api.v1.models import AnalyzeRequest, TrainCorrectionRequest, Candidate
+from services.embedding_cache import embedding_cache
+from services.embedding_batcher import EmbeddingBatcher
+from services.vector_index import vector_index, VECTOR_INDEX_ENABLED
+from services.work_queue import WorkQueue
+from services.routing_policy import routing_policy
+from services.decision_cache import decision_cache
+from services.metrics import stage_timer, record_outcome, FALLBACKS, ERRORS, IN_FLIGHT
+from services.rate_limiter import generate_limiter, embed_limiter, is_rate_limit_error
+from services.outbox import Outbox, OUTBOX_ENABLED
+from services.correction_queue import CorrectionQueue
+from services.injection_scanner import injection_scanner
+from services.near_duplicate import near_duplicate_index
+from services.correction_classifier import correction_classifier
+from services.hedging import hedger
+from services.circuit_breaker import (
+    CircuitOpenError, embedding_breaker, generation_breaker, vector_search_breaker, webhook_breaker
+)
+from services.lexical_index import lexical_index, reciprocal_rank_fusion, HYBRID_SEARCH_ENABLED, HYBRID_RANK_DEPTH
+from services.fake_backends import AI_BACKEND, fake_gemini, create_fake_qdrant
+from services.embedding_provider import (
+    GeminiEmbeddingProvider, local_embedding_index, EMBEDDING_PROVIDER, EMBEDDING_FALLBACK_LOCAL
+)
 
 # Configuration values.
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 # Host defaults to localhost for local dev; can be overridden with 'qdrant' in Docker.
 QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost") 
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
+# gRPC has lower per-call overhead than REST for the small search requests of the pipeline.
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "true").lower() == "true"
+DEFAULT_GENERATION_MODEL = "gemini-2.0-flash-001"
+# Exact (brute-force) search; cheap for a few hundred department points.
+QDRANT_EXACT_SEARCH = os.getenv("QDRANT_EXACT_SEARCH", "false").lower() == "true"
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", 128))
+# With int8 quantization the top hits are rescored on the original vectors; no effect on unquantized collections.
+QDRANT_SEARCH_PARAMS = SearchParams(
+    hnsw_ef=QDRANT_HNSW_EF,
+    exact=QDRANT_EXACT_SEARCH,
+    quantization=QuantizationSearchParams(rescore=True, oversampling=2.0)
+)
+# Payload fields candidates are built from; content hashes and timestamps stay in Qdrant.
+CANDIDATE_PAYLOAD_FIELDS = ["department_id", "name", "description", "is_correction"]
 # Django backend URL defaults to localhost; can be overridden in Docker.
 DJANGO_BACKEND_URL = os.getenv("DJANGO_BACKEND_URL", "http://127.0.0.1:8000")
+INJECTION_ALERT_PATH = "/api/internal/injection-alert/"
+ROUTING_RESULT_PATH = "/api/internal/routing-result/"
+ROUTING_RESULT_BATCH_PATH = "/api/internal/routing-result/batch/"
+TRAIN_CORRECTION_PATH = "/api/internal/train-correction/"
+TRAIN_CORRECTION_BATCH_PATH = "/api/internal/train-correction/batch/"
+CORRECTION_NAMESPACE = uuid.UUID('d87b3c2a-9e5f-4b1d-8c6a-2f3e4d5c6b7a')
+# Candidates shown to the LLM and the routing policy.
+CANDIDATE_LIMIT = 3
+# Without the LLM, a candidate is auto-routed to only with at least this cosine score.
+LLM_FALLBACK_MIN_SCORE = float(os.getenv("LLM_FALLBACK_MIN_SCORE", 0.5))
+# Fields of a routing result copied onto near-duplicate messages.
+REUSABLE_DECISION_FIELDS = (
+    "intent_label", "suggested_department_id", "suggested_department_name", "confidence_score",
+    "reason", "llm_bypassed", "vector_search_results",
+)
+# Messages of one batch analyzed concurrently (bounds parallel LLM calls).
+ANALYSIS_BATCH_CONCURRENCY = int(os.getenv("ANALYSIS_BATCH_CONCURRENCY", 16))
+ANALYSIS_BATCH_WORKERS = int(os.getenv("ANALYSIS_BATCH_WORKERS", 2))
+ANALYSIS_BATCH_QUEUE_MAX_DEPTH = int(os.getenv("ANALYSIS_BATCH_QUEUE_MAX_DEPTH", 50))
+# A batch runs far longer than one message, so a crashed batch run is presumed later.
+ANALYSIS_BATCH_QUEUE_CLAIM_IDLE_MS = int(os.getenv("ANALYSIS_BATCH_QUEUE_CLAIM_IDLE_MS", 600000))
+# Synchronous /analyze?mode=sync: the decision is returned inline when ready within the deadline.
+SYNC_ANALYZE_ENABLED = os.getenv("SYNC_ANALYZE_ENABLED", "true").lower() == "true"
+SYNC_ANALYZE_DEADLINE_MS = int(os.getenv("SYNC_ANALYZE_DEADLINE_MS", 2500))
+# Inline analyses running at once; more are queued like asynchronous ones.
+SYNC_ANALYZE_MAX_CONCURRENCY = int(os.getenv("SYNC_ANALYZE_MAX_CONCURRENCY", 32))
 
 # Logging configuration.
 logger = logging.getLogger("ai_pipeline")
@@ -36,19 +99,30 @@ if not logger.handlers:
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
 
-# Qdrant client is stored globally.
-qdrant_client = None
+# Gemini API module, or its in-process stand-in with AI_BACKEND=fake.
+gemini = fake_gemini if AI_BACKEND == "fake" else genai
 
-def init_qdrant():
-    """Initializes Qdrant Client with fallback to localhost."""
-    global qdrant_client
-    
-    # Primary connection attempt.
+# Qdrant client is stored globally; connected by the FastAPI lifespan (see connect_qdrant).
+qdrant_client: Optional[AsyncQdrantClient] = None
+# Set once the lifespan warmup has finished.
+warmed_up = False
+
+async def _try_connect(host: str) -> AsyncQdrantClient:
+    client = AsyncQdrantClient(host=host, port=QDRANT_PORT, grpc_port=QDRANT_GRPC_PORT, prefer_grpc=QDRANT_PREFER_GRPC)
     try:
-        logger.info(f"Attempting connection to Qdrant at {QDRANT_HOST}:{QDRANT_PORT}...")
-        client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
         # Verifies connectivity.
-        client.get_collections() 
+        await client.get_collections()
+    except Exception:
+        await client.close()
+        raise
+    return client
+
+async def init_qdrant() -> Optional[AsyncQdrantClient]:
+    """Initializes the async Qdrant client with fallback to localhost."""
+    # Primary connection attempt.
+    try:
+        logger.info(f"Attempting connection to Qdrant at {QDRANT_HOST}:{QDRANT_PORT} (gRPC: {QDRANT_PREFER_GRPC})...")
+        client = await _try_connect(QDRANT_HOST)
         logger.info(f"✅ SUCCESS: Connected to Qdrant at {QDRANT_HOST}:{QDRANT_PORT}")
         return client
     except Exception as e:
@@ -58,8 +132,7 @@ def init_qdrant():
         if QDRANT_HOST != "localhost" and QDRANT_HOST != "127.0.0.1":
             try:
                 logger.info("🔄 Attempting fallback to 'localhost'...")
-                client = QdrantClient(host="localhost", port=QDRANT_PORT)
-                client.get_collections()
+                client = await _try_connect("localhost")
                 logger.info(f"✅ SUCCESS: Connected to Qdrant at localhost:{QDRANT_PORT}")
                 return client
             except Exception as e2:
@@ -69,30 +142,306 @@ def init_qdrant():
             
     return None
 
-# Initializes clients.
-qdrant_client = init_qdrant()
+async def connect_qdrant():
+    global qdrant_client
+    if AI_BACKEND == "fake":
+        logger.warning("AI_BACKEND=fake: using the in-memory Qdrant and Gemini stand-ins.")
+        qdrant_client = await create_fake_qdrant()
+        return
+    qdrant_client = await init_qdrant()
+
+async def warmup():
+    """Preloads what the first requests would otherwise pay for: collection info, the local index, models."""
+    global warmed_up
+    get_model(DEFAULT_GENERATION_MODEL)
+    if qdrant_client:
+        try:
+            collection_info = await qdrant_client.get_collection(collection_name="departments")
+            logger.info(f"Warmup: collection 'departments' has {collection_info.points_count} points.")
+            if VECTOR_INDEX_ENABLED:
+                await vector_index.load(qdrant_client)
+        except Exception as e:
+            logger.warning(f"Warmup: local vector index not loaded, falling back to Qdrant queries: {e}")
+    warmed_up = True
+
+def readiness() -> Dict[str, Any]:
+    """Readiness of this worker: warmed up, Qdrant connected and, when enabled, the local index loaded."""
+    checks = {
+        "warmed_up": warmed_up,
+        "qdrant": qdrant_client is not None,
+        "vector_index": vector_index.ready or not VECTOR_INDEX_ENABLED,
+    }
+    return {"ready": all(checks.values()), **checks}
+
+async def close_clients():
+    if qdrant_client:
+        await qdrant_client.close()
+    await http_client.aclose()
+
 http_client = httpx.AsyncClient(timeout=10.0)
+# Webhooks to Django survive Django outages; routing results and corrections are delivered in bulk.
+outbox = Outbox(http_client, batch_routes={
+    ROUTING_RESULT_PATH: ROUTING_RESULT_BATCH_PATH,
+    TRAIN_CORRECTION_PATH: TRAIN_CORRECTION_BATCH_PATH,
+}, breaker=webhook_breaker)
 
-async def async_embed(text: str, model: str = "models/text-embedding-004"):
-    """Runs the blocking embedding call in a separate thread."""
-    return await asyncio.to_thread(
-        genai.embed_content,
-        model=model,
-        content=text,
-        task_type="retrieval_query"
-    )
+async def embed_batch(model: str, task_type: str, texts: List[str]) -> List[List[float]]:
+    """Batch embedding call; one request for all texts."""
+    return await GeminiEmbeddingProvider(model, client=gemini).embed_async(texts, task_type)
+
+# Concurrent pipeline runs share batched embedding requests, paced by the embedding quota.
+# The breaker guards each batch request, not each caller.
+embedding_batcher = EmbeddingBatcher(embed_batch, limiter=embed_limiter, breaker=embedding_breaker)
+
+async def async_embed(text: str, model: str = "models/text-embedding-004", task_type: str = "retrieval_query"):
+    """Returns the embedding from the cache, or from the next batched embedding call."""
+    cached = await embedding_cache.get(model, task_type, text)
+    if cached is not None:
+        logger.info(f"Embedding cache hit ({model}, {task_type}).")
+        return {"embedding": cached, "cached": True}
+
+    vector = await embedding_batcher.embed(text, model, task_type)
+    await embedding_cache.set(model, task_type, text, vector)
+    return {"embedding": vector, "cached": False}
+
+# GenerativeModel objects are reused across requests, one per model name.
+_models: Dict[str, genai.GenerativeModel] = {}
+
+def get_model(model_name: str) -> genai.GenerativeModel:
+    model = _models.get(model_name)
+    if model is None:
+        model = _models[model_name] = gemini.GenerativeModel(model_name)
+    return model
 
 async def async_generate(model_name: str, prompt: str, config: dict):
-    """Runs the blocking generation call in a separate thread."""
-    model = genai.GenerativeModel(model_name)
-    return await asyncio.to_thread(
-        model.generate_content,
+    """Runs the generation call on the event loop, queued behind the generation quota."""
+    model = get_model(model_name)
+    response = await generate_limiter.call(
+        model.generate_content_async,
         prompt,
         generation_config=config
     )
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        generate_limiter.record_usage(usage.prompt_token_count or 0, usage.total_token_count or 0)
+    return response
+
+
+def manual_routing(processing_data: Dict[str, Any], reason: str, start_time: float) -> Tuple[str, Dict[str, Any]]:
+    """Result without a department; Django keeps the session unassigned for staff to route."""
+    logger.warning(f"Needs manual routing: {reason}")
+    FALLBACKS.labels("manual_routing").inc()
+    processing_data["needs_manual_routing"] = True
+    processing_data["reason"] = f"Needs manual routing: {reason}."
+    processing_data["processing_time_ms"] = int((time.time() - start_time) * 1000)
+    record_outcome("manual_routing", time.time() - start_time)
+    return ROUTING_RESULT_PATH, processing_data
+
+
+async def generate_decision(model_name: str, prompt: str, config: dict) -> Tuple[Dict[str, Any], Any]:
+    """Generates and parses the routing JSON; a malformed answer raises, so it never wins a hedge."""
+    response = await generation_breaker.call(async_generate, model_name, prompt, config)
+    result_text = response.text
+    logger.info(f"Step 5 [LLM]: Raw Response from {model_name}: {result_text}")
+
+    if result_text.startswith("```json"):
+        result_text = result_text[7:-3]
+
+    return json.loads(result_text), response
+
+
+def detect_language(text: str) -> str:
+    """Returns 'ru' for Cyrillic text, otherwise 'uz'."""
+    if any("\u0400" <= char <= "\u04FF" for char in text): # Cyrillic check
+        return "ru"
+    return "uz"
+
+
+def detect_injection(text: str) -> Tuple[bool, float]:
+    """Returns whether the text looks like a prompt injection, and its risk score."""
+    result = injection_scanner.scan(text)
+    return result.is_injection, result.risk_score
+
+
+def hits_to_candidates(hits) -> List[Candidate]:
+    """Converts Qdrant (or local index) hits into pipeline candidates."""
+    candidates = []
+    for i, hit in enumerate(hits):
+        payload = hit.payload
+        dept_id = payload.get("department_id")
+        name = payload.get("name")
+        score = hit.score if hasattr(hit, 'score') else 0.0
+        logger.info(f"   Hit #{i+1}: Score={score:.4f}, ID={dept_id}, Name={name}")
+        
+        candidates.append(Candidate(
+            id=str(dept_id),
+            name=name,
+            description=payload.get("description", ""),
+            score=score,
+            is_correction=bool(payload.get("is_correction", False)),
+            point_id=str(hit.id) if getattr(hit, "id", None) is not None else None
+        ))
+    return candidates
+
+
+def hybrid_enabled() -> bool:
+    return HYBRID_SEARCH_ENABLED and lexical_index.ready
+
+
+def search_limit() -> int:
+    """Vector ranking depth: deeper when it is fused with the BM25 ranking."""
+    return HYBRID_RANK_DEPTH if hybrid_enabled() else CANDIDATE_LIMIT
+
+
+def fuse_candidates(candidates: List[Candidate], text: str, language: str) -> List[Candidate]:
+    """Reciprocal-rank fusion of the vector ranking with a BM25 ranking, per point."""
+    with stage_timer("lexical_search"):
+        lexical_hits = lexical_index.search(text, language)
+
+    def key(candidate: Candidate) -> str:
+        return candidate.point_id or f"{candidate.id}:{candidate.description}"
+
+    by_key = {key(c): c for c in candidates}
+    lexical_ranking = []
+    for point_id, payload, bm25 in lexical_hits:
+        point_key = str(point_id)
+        lexical_ranking.append(point_key)
+        if point_key not in by_key:
+            # Found by BM25 only; no cosine score.
+            by_key[point_key] = Candidate(
+                id=str(payload.get("department_id")),
+                name=payload.get("name") or "",
+                description=payload.get("description", ""),
+                is_correction=bool(payload.get("is_correction", False)),
+                point_id=point_key
+            )
+        by_key[point_key].lexical_score = round(bm25, 4)
+
+    fused = reciprocal_rank_fusion([[key(c) for c in candidates], lexical_ranking])
+    for point_key, candidate in by_key.items():
+        candidate.fused_score = round(fused.get(point_key, 0.0), 6)
+    ranked = sorted(by_key.values(), key=lambda c: c.fused_score, reverse=True)[:CANDIDATE_LIMIT]
+    logger.info(f"Step 4 [Search]: Fused {len(candidates)} vector and {len(lexical_hits)} BM25 hits: "
+                f"{[(c.id, c.fused_score) for c in ranked]}")
+    return ranked
+
+
+def search_local(text: str, language: str) -> list:
+    """Steps 3-4 offline: embeds with the hashing vectorizer and searches the local embedding index."""
+    if not local_embedding_index.ready:
+        logger.error("Step 4 [Search] SKIPPED: Local embedding index is not built yet.")
+        return []
+    with stage_timer("local_search"):
+        hits = local_embedding_index.search(text, language, limit=search_limit())
+    logger.info(f"Step 4 [Search]: Local embedding index returned {len(hits)} hits.")
+    return hits
+
+
+async def search_candidates(vector: List[float], language: str) -> List[Candidate]:
+    """Finds the top department candidates, from the local index when loaded, otherwise from Qdrant."""
+    candidates = []
+    if VECTOR_INDEX_ENABLED and vector_index.ready:
+        # In-process mirror of the collection; no network round trip.
+        hits = vector_index.search(vector, language, limit=search_limit())
+        logger.info(f"Step 4 [Search]: Local index returned {len(hits)} hits (generation {vector_index.generation}).")
+        candidates = hits_to_candidates(hits)
+    elif qdrant_client:
+        try:
+            # One round trip: the language payload index lets Qdrant plan the filtered search
+            # (full scan on small partitions), so it returns up to `limit` hits without retries.
+            logger.info(f"Step 4 [Search]: Querying Qdrant (Collection: 'departments', language == '{language}')...")
+            search_response = await vector_search_breaker.call(
+                qdrant_client.query_points,
+                collection_name="departments",
+                query=vector,
+                query_filter=Filter(must=[FieldCondition(key="language", match=MatchValue(value=language))]),
+                limit=search_limit(),
+                search_params=QDRANT_SEARCH_PARAMS,
+                with_payload=CANDIDATE_PAYLOAD_FIELDS,
+                with_vectors=False
+            )
+            hits = search_response.points if hasattr(search_response, 'points') else []
+            if not hits:
+                logger.warning("Step 4 [Search]: No hits. Is the collection indexed? Run 'python manage.py index_departments'.")
+                FALLBACKS.labels("empty_collection").inc()
+            logger.info(f"Step 4 [Search]: Found {len(hits)} hits.")
+            candidates = hits_to_candidates(hits)
+        except CircuitOpenError:
+            # Lexical fusion in analyze_request still finds candidates when it is enabled.
+            logger.warning("Step 4 [Search] SKIPPED: Qdrant circuit is open.")
+            FALLBACKS.labels("vector_search_circuit_open").inc()
+        except Exception as e:
+            logger.error(f"Step 4 [Search] FAILED: {e}")
+            ERRORS.labels("search").inc()
+    else:
+        logger.error("Step 4 [Search] SKIPPED: Qdrant client is not connected.")
+        FALLBACKS.labels("qdrant_unavailable").inc()
+
+    return candidates
 
 
 async def process_message_pipeline(request: AnalyzeRequest):
+    with IN_FLIGHT.labels("pipeline").track_inprogress():
+        webhook_path, processing_data = await analyze_request(request)
+    if webhook_path:
+        logger.info(f"Step 6 [Completion]: Sending webhook to Django ({DJANGO_BACKEND_URL})...")
+        await send_webhook(f"{DJANGO_BACKEND_URL}{webhook_path}", processing_data)
+    logger.info(f"--- END PIPELINE: {request.message_uuid} ---")
+
+
+# Inline analyses past their deadline, finishing in the background (referenced so they aren't collected).
+_late_analyses = set()
+_sync_slots = asyncio.Semaphore(SYNC_ANALYZE_MAX_CONCURRENCY)
+sync_stats = {"completed": 0, "late": 0, "busy": 0}
+
+
+async def _deliver_late(task: asyncio.Task, request: AnalyzeRequest):
+    try:
+        webhook_path, processing_data = await task
+    except Exception as e:
+        logger.error(f"Late analysis of {request.message_uuid} FAILED: {e}")
+        return
+    if webhook_path:
+        await send_webhook(f"{DJANGO_BACKEND_URL}{webhook_path}", processing_data)
+
+
+async def analyze_sync(request: AnalyzeRequest, deadline_seconds: float) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Analyzes within the deadline and returns ("completed", routing result) for the caller to apply.
+
+    Returns ("processing", None) when the result goes by webhook instead: injection alerts, and
+    analyses past the deadline, which finish in the background. ("busy", None) means all inline
+    slots are taken and the caller should queue the message.
+    """
+    if _sync_slots.locked():
+        sync_stats["busy"] += 1
+        return "busy", None
+    async with _sync_slots:
+        with IN_FLIGHT.labels("pipeline").track_inprogress():
+            task = asyncio.create_task(analyze_request(request))
+            try:
+                webhook_path, processing_data = await asyncio.wait_for(asyncio.shield(task), deadline_seconds)
+            except asyncio.TimeoutError:
+                logger.warning(f"Sync analysis of {request.message_uuid} exceeded {deadline_seconds:.1f}s; delivering by webhook.")
+                FALLBACKS.labels("sync_deadline").inc()
+                sync_stats["late"] += 1
+                delivery = asyncio.create_task(_deliver_late(task, request))
+                _late_analyses.add(delivery)
+                delivery.add_done_callback(_late_analyses.discard)
+                return "processing", None
+    if webhook_path != ROUTING_RESULT_PATH:
+        if webhook_path:
+            await send_webhook(f"{DJANGO_BACKEND_URL}{webhook_path}", processing_data)
+        return "processing", None
+    sync_stats["completed"] += 1
+    return "completed", processing_data
+
+
+async def analyze_request(request: AnalyzeRequest, vector: Optional[List[float]] = None,
+                          hits: Optional[list] = None) -> Tuple[Optional[str], Dict[str, Any]]:
+    """Runs Steps 1-5 and returns the Django webhook path to deliver the result to (None to drop it).
+
+    The batch pipeline passes a precomputed `vector` and search `hits` to share work across messages.
+    """
     start_time = time.time()
     logger.info(f"\n--- START PIPELINE: {request.message_uuid} ---")
     logger.info(f"Input Text: {request.text[:100]}...") 
@@ -107,203 +456,139 @@ async def process_message_pipeline(request: AnalyzeRequest):
         "intent_label": "Unknown",
         "suggested_department_id": None,
         "confidence_score": 0,
-        "reason": "Processing initialized."
+        "reason": "Processing initialized.",
+        "llm_bypassed": False,
+        "needs_manual_routing": False,
+        "embedding_provider": EMBEDDING_PROVIDER
     }
     
     text = request.text
     
     # Step 1: Language Detection
-    language = "uz"
-    if any("\u0400" <= char <= "\u04FF" for char in text): # Cyrillic check
-        language = "ru"
+    with stage_timer("lang_detect"):
+        language = detect_language(text)
     
     processing_data["language_detected"] = language
     logger.info(f"Step 1 [Lang Detect]: Detected '{language}'")
 
     # Step 2: Injection Detection
-    is_injection = False
-    risk_score = 0.0
-    injection_keywords = ["ignore previous instructions", "system prompt", "delete all data"]
-    
-    if any(keyword in text.lower() for keyword in injection_keywords):
-        is_injection = True
-        risk_score = 0.95
+    with stage_timer("injection"):
+        scan = injection_scanner.scan(text)
     
-    logger.info(f"Step 2 [Injection]: Is Injection? {is_injection} (Risk: {risk_score})")
+    logger.info(f"Step 2 [Injection]: Is Injection? {scan.is_injection} (Risk: {scan.risk_score})")
 
-    if is_injection:
-        processing_data["risk_score"] = risk_score
-        processing_data["reason"] = "Potential injection keywords detected"
+    if scan.is_injection:
+        processing_data["risk_score"] = scan.risk_score
+        processing_data["reason"] = f"Potential injection keywords detected: {', '.join(scan.rules)}"
         processing_data["processing_time_ms"] = int((time.time() - start_time) * 1000)
+        record_outcome("injection", time.time() - start_time)
         
         logger.warning(f"Injection detected! Aborting and sending alert.")
-        await send_webhook(f"{DJANGO_BACKEND_URL}/api/internal/injection-alert/", processing_data)
-        return
+        return INJECTION_ALERT_PATH, processing_data
+
+    # Step 2b: Near-duplicate of a recently routed message (mass incidents)
+    with stage_timer("near_duplicate"):
+        duplicate = near_duplicate_index.find(text, language)
+    if duplicate:
+        logger.info(f"Step 2b [Near Duplicate]: {duplicate.similarity:.2%} similar to {duplicate.message_uuid}. Reusing its routing.")
+        processing_data.update(duplicate.decision)
+        processing_data["embedding_tokens"] = 0
+        processing_data["near_duplicate"] = True
+        processing_data["reused_from_message_uuid"] = duplicate.message_uuid
+        processing_data["near_duplicate_similarity"] = round(duplicate.similarity, 4)
+        processing_data["processing_time_ms"] = int((time.time() - start_time) * 1000)
+        record_outcome("near_duplicate", time.time() - start_time)
+        return ROUTING_RESULT_PATH, processing_data
 
     # Step 3: Vector Embedding (Non-Blocking)
     embedding_model = "models/text-embedding-004"
-    vector = []
-    try:
-        logger.info(f"Step 3 [Embedding]: Requesting embedding from Gemini ({embedding_model})...")
-        embedding_result = await async_embed(text, embedding_model)
-        vector = embedding_result['embedding']
-        processing_data["embedding_tokens"] = len(text) // 4 
-        logger.info(f"Step 3 [Embedding]: Success. Vector length: {len(vector)}")
-    except Exception as e:
-        logger.error(f"Step 3 [Embedding] FAILED: {e}")
-        # Fails gracefully and stops the pipeline.
-        return 
-        
-    # Step 4: Semantic Search
-    candidates = []
-    if qdrant_client:
+    # embed_content reports no usage, so this stays an estimate (zeroed on cache hits).
+    processing_data["embedding_tokens"] = len(text) // 4 if EMBEDDING_PROVIDER != "local" else 0
+    if vector is None and hits is None and EMBEDDING_PROVIDER == "local":
+        logger.info("Step 3 [Embedding]: Local provider, no API call.")
+        hits = search_local(text, language)
+    elif vector is None and hits is None:
         try:
-            logger.info(f"Step 4 [Search]: Querying Qdrant (Collection: 'departments')...")
-            
-            # First check if collection exists and has points
-            try:
-                collection_info = await asyncio.to_thread(
-                    qdrant_client.get_collection,
-                    collection_name="departments"
-                )
-                
-                if collection_info.points_count == 0:
-                    logger.warning(f"Step 4 [Search]: Collection 'departments' is empty. Please index departments first.")
-                    # Skip the query if collection is empty
-                else:
-                    logger.info(f"Step 4 [Search]: Collection has {collection_info.points_count} points.")
-                    
-                    # Debug: Try to check what language values exist in the collection
-                    # First try without filter to see sample payloads
-                    try:
-                        sample_response = await asyncio.to_thread(
-                            qdrant_client.scroll,
-                            collection_name="departments",
-                            limit=5,
-                            with_payload=True,
-                            with_vectors=False
-                        )
-                        sample_points = sample_response[0]  # Returns (points, next_page_offset)
-                        if sample_points:
-                            sample_languages = [p.payload.get("language") for p in sample_points if hasattr(p, 'payload')]
-                            logger.info(f"Step 4 [Search]: Sample language values in collection: {set(sample_languages)}")
-                    except Exception as debug_error:
-                        logger.warning(f"Step 4 [Search]: Could not get sample data for debugging: {debug_error}")
-                    
-                    q_filter = Filter(
-                        must=[
-                            FieldCondition(
-                                key="language",
-                                match=MatchValue(value=language)
-                            )
-                        ]
-                    )
-                    logger.info(f"Step 4 [Search]: Filter: language == '{language}'")
-
-                    # --- QDRANT V1.16+ FIX ---
-                    # The "OutputTooSmall" error occurs when filter returns fewer results than limit
-                    # Try with progressively smaller limits, then fallback to no filter
-                    search_response = None
-                    hits = []
-                    
-                    # Try filtered query with decreasing limits
-                    for limit in [3, 2, 1]:
-                        try:
-                            logger.info(f"Step 4 [Search]: Attempting query with limit={limit} and language filter...")
-                            search_response = await asyncio.to_thread(
-                                qdrant_client.query_points,
-                                collection_name="departments",
-                                query=vector,
-                                query_filter=q_filter,
-                                limit=limit,
-                                with_payload=True,
-                                with_vectors=False
-                            )
-                            hits = search_response.points if hasattr(search_response, 'points') else []
-                            if hits:
-                                logger.info(f"Step 4 [Search]: Query succeeded with limit={limit}, found {len(hits)} hits.")
-                                break
-                        except Exception as query_error:
-                            error_str = str(query_error)
-                            if "OutputTooSmall" in error_str or "500" in error_str:
-                                logger.warning(f"Step 4 [Search]: Query failed with limit={limit}: {error_str[:100]}")
-                                if limit > 1:
-                                    continue  # Try with smaller limit
-                                else:
-                                    # Last attempt failed, try without filter as fallback
-                                    logger.warning("Step 4 [Search]: Filtered query failed, trying without language filter...")
-                                    try:
-                                        search_response = await asyncio.to_thread(
-                                            qdrant_client.query_points,
-                                            collection_name="departments",
-                                            query=vector,
-                                            limit=5,  # Get more results when no filter
-                                            with_payload=True,
-                                            with_vectors=False
-                                        )
-                                        all_hits = search_response.points if hasattr(search_response, 'points') else []
-                                        # Filter results by language in Python instead
-                                        filtered_hits = [h for h in all_hits if h.payload.get("language") == language]
-                                        if filtered_hits:
-                                            hits = filtered_hits[:3]  # Take top 3 matching language
-                                            logger.info(f"Step 4 [Search]: Query without filter succeeded, filtered to {len(hits)} {language} results.")
-                                        else:
-                                            # No matching language, use all results
-                                            hits = all_hits[:3]
-                                            logger.warning(f"Step 4 [Search]: No {language} results found, using top 3 results regardless of language.")
-                                        break
-                                    except Exception as fallback_error:
-                                        logger.error(f"Step 4 [Search]: Fallback query also failed: {fallback_error}")
-                                        raise query_error
-                            else:
-                                raise
-                    
-                    logger.info(f"Step 4 [Search]: Found {len(hits)} hits.")
-                    
-                    for i, hit in enumerate(hits):
-                        payload = hit.payload
-                        dept_id = payload.get("department_id")
-                        name = payload.get("name")
-                        score = hit.score if hasattr(hit, 'score') else 0.0
-                        logger.info(f"   Hit #{i+1}: Score={score:.4f}, ID={dept_id}, Name={name}")
-                        
-                        candidates.append(Candidate(
-                            id=str(dept_id),
-                            name=name,
-                            description=payload.get("description", ""),
-                            score=score
-                        ))
-            except Exception as coll_error:
-                # Collection might not exist or be inaccessible
-                logger.error(f"Step 4 [Search]: Failed to access collection: {coll_error}")
-                # Check if collection exists
-                try:
-                    collections = await asyncio.to_thread(qdrant_client.get_collections)
-                    collection_names = [c.name for c in collections.collections]
-                    if "departments" not in collection_names:
-                        logger.warning("Step 4 [Search]: Collection 'departments' does not exist. Please run 'python manage.py index_departments' first.")
-                    else:
-                        logger.error(f"Step 4 [Search]: Collection exists but query failed: {coll_error}")
-                except:
-                    pass
-                    
+            logger.info(f"Step 3 [Embedding]: Requesting embedding from Gemini ({embedding_model})...")
+            with stage_timer("embed"):
+                embedding_result = await async_embed(text, embedding_model)
+            vector = embedding_result['embedding']
+            if embedding_result.get("cached"):
+                processing_data["embedding_tokens"] = 0
+            logger.info(f"Step 3 [Embedding]: Success. Vector length: {len(vector)}")
         except Exception as e:
-             logger.error(f"Step 4 [Search] FAILED: {e}")
-             # Log full error details for debugging
-             import traceback
-             logger.error(f"Full traceback: {traceback.format_exc()}")
+            if isinstance(e, CircuitOpenError):
+                logger.warning("Step 3 [Embedding] SKIPPED: Embedding circuit is open.")
+                FALLBACKS.labels("embedding_circuit_open").inc()
+            else:
+                logger.error(f"Step 3 [Embedding] FAILED: {e}")
+                ERRORS.labels("embed").inc()
+            processing_data["embedding_tokens"] = 0
+            if EMBEDDING_FALLBACK_LOCAL and local_embedding_index.ready:
+                # Degraded mode: routes on the offline vectorizer instead of dropping the message.
+                logger.warning("Step 3 [Embedding]: Falling back to the local embedding index.")
+                FALLBACKS.labels("local_embedding").inc()
+                processing_data["embedding_provider"] = "local"
+                hits = search_local(text, language)
+            elif hybrid_enabled():
+                # Keyword search alone still yields candidates (fused in Step 4).
+                logger.warning("Step 3 [Embedding]: Falling back to lexical search only.")
+                FALLBACKS.labels("lexical_only").inc()
+                processing_data["embedding_provider"] = "none"
+                hits = []
+            else:
+                # The ticket is still delivered, for staff to route by hand.
+                return manual_routing(processing_data, "embedding unavailable", start_time)
+        
+    # Step 4: Semantic Search
+    if hits is None:
+        with stage_timer("search"):
+            candidates = await search_candidates(vector, language)
     else:
-        logger.error("Step 4 [Search] SKIPPED: Qdrant client is not connected.")
+        logger.info(f"Step 4 [Search]: Using {len(hits)} precomputed hits.")
+        candidates = hits_to_candidates(hits)
+    if hybrid_enabled():
+        candidates = fuse_candidates(candidates, text, language)
+
+    # Step 4b: Vote of the closest staff corrections (same embedding space as Gemini vectors only)
+    knn, votes = None, []
+    if vector is not None and correction_classifier.ready:
+        with stage_timer("knn"):
+            knn, votes = correction_classifier.classify(vector, language)
+        logger.info(f"Step 4b [kNN]: Votes {[(v.department_id, v.votes, v.share) for v in votes]}")
 
+    # A clearly dominant vector hit is routed directly, without the LLM.
+    bypass = None if knn else routing_policy.decide(candidates)
+
+    if knn:
+        logger.info(f"Step 5 [LLM]: SKIPPED. {knn.votes} corrections agree on Dept ID={knn.department_id} ({knn.share:.0%}).")
+        processing_data["intent_label"] = "Auto-routed"
+        processing_data["suggested_department_id"] = knn.department_id
+        processing_data["confidence_score"] = int(knn.share * 100)
+        processing_data["suggested_department_name"] = knn.name
+        processing_data["reason"] = knn.reason
+        processing_data["llm_bypassed"] = True
+        outcome = "knn"
     # --- CRITICAL SAFETY CHECK ---
     # If Qdrant returns 0 results (empty database), DO NOT ask Gemini to pick an ID.
-    if not candidates:
+    elif not candidates:
         logger.warning("Step 5 [LLM]: SKIPPED. No candidates found in Qdrant (Database might be empty).")
         processing_data["reason"] = "No relevant department found in knowledge base."
+        processing_data["needs_manual_routing"] = True
+        outcome = "no_candidates"
         # We allow the process to continue to Step 6, but with NO suggested ID.
+    elif bypass:
+        logger.info(f"Step 5 [LLM]: SKIPPED. Top candidate dominates (score={bypass.score:.4f}, margin={bypass.margin:.4f}, corrections={bypass.correction_votes}).")
+        processing_data["intent_label"] = "Auto-routed"
+        processing_data["suggested_department_id"] = bypass.department_id
+        processing_data["confidence_score"] = int(bypass.score * 100)
+        processing_data["suggested_department_name"] = bypass.name
+        processing_data["reason"] = bypass.reason
+        processing_data["llm_bypassed"] = True
+        outcome = "bypassed"
     else:
         # Step 5: LLM Reranking & Decision
-        model_name = request.settings.model if request.settings else "gemini-2.0-flash-001"
+        model_name = request.settings.model if request.settings else DEFAULT_GENERATION_MODEL
         temperature = request.settings.temperature if request.settings else 0.2
         
         candidates_str = "\n".join([f"ID: {c.id}, Name: {c.name}, Desc: {c.description}" for c in candidates])
@@ -332,22 +617,36 @@ async def process_message_pipeline(request: AnalyzeRequest):
         }}
         """
         
-        logger.info(f"Step 5 [LLM]: Sending prompt to {model_name}...")
+        candidate_ids = [c.id for c in candidates]
 
         try:
-            response = await async_generate(
-                model_name, 
-                prompt, 
-                {"temperature": temperature, "response_mime_type": "application/json"}
-            )
-            
-            result_text = response.text
-            logger.info(f"Step 5 [LLM]: Raw Response: {result_text}")
-
-            if result_text.startswith("```json"):
-                result_text = result_text[7:-3]
+            llm_result = await decision_cache.get(text, language, model_name, candidate_ids)
+            if llm_result is not None:
+                # Same normalized text and candidate set was decided before.
+                logger.info(f"Step 5 [LLM]: Decision cache hit. Skipping {model_name}.")
+                processing_data["decision_cache_hit"] = True
+                outcome = "decision_cache_hit"
+            else:
+                logger.info(f"Step 5 [LLM]: Sending prompt to {model_name}...")
+                with stage_timer("llm"):
+                    # A slow primary is raced against the hedge model; the first valid JSON answer wins.
+                    hedge = await hedger.run(model_name, lambda model: generate_decision(
+                        model,
+                        prompt,
+                        {"temperature": temperature, "response_mime_type": "application/json"}
+                    ))
+                outcome = "llm"
+                llm_result, response = hedge.value
+                processing_data["llm_model"] = hedge.model
+                processing_data["llm_hedged"] = hedge.hedged
                 
-            llm_result = json.loads(result_text)
+                usage = response.usage_metadata
+                if usage:
+                    processing_data["prompt_tokens"] = usage.prompt_token_count
+                    processing_data["total_tokens"] = usage.total_token_count
+
+                # Keyed on the model that answered, so a hedged answer never stands in for the primary's.
+                await decision_cache.set(text, language, hedge.model, candidate_ids, llm_result)
             
             processing_data["intent_label"] = llm_result.get("intent")
             processing_data["suggested_department_id"] = llm_result.get("department_id")
@@ -356,108 +655,291 @@ async def process_message_pipeline(request: AnalyzeRequest):
             processing_data["suggested_department_name"] = "Unknown" 
             processing_data["reason"] = llm_result.get("reason")
             
-            usage = response.usage_metadata
-            if usage:
-                processing_data["prompt_tokens"] = usage.prompt_token_count
-                processing_data["total_tokens"] = usage.total_token_count
-            
             logger.info(f"Step 5 [LLM]: Parsed successfully. Suggested Dept: {processing_data['suggested_department_id']}")
 
         except Exception as e:
-            error_str = str(e)
-            # Check if it's a quota/rate limit error
-            if "429" in error_str or "quota" in error_str.lower() or "rate limit" in error_str.lower():
-                logger.warning(f"Step 5 [LLM]: Quota/Rate limit exceeded. Using top vector search result as fallback.")
+            # Quota errors reach here only after the limiter's retries are exhausted.
+            # An open circuit fails fast and takes the same fallback.
+            circuit_open = isinstance(e, CircuitOpenError)
+            if is_rate_limit_error(e) or circuit_open:
+                cause = "circuit open" if circuit_open else "quota exceeded"
+                logger.warning(f"Step 5 [LLM]: LLM unavailable ({cause}). Using best vector search result as fallback.")
+                outcome = "llm_circuit_open" if circuit_open else "llm_rate_limited"
+                FALLBACKS.labels(outcome).inc()
                 
-                # Fallback: Use the top candidate from vector search
-                if candidates:
-                    top_candidate = candidates[0]
-                    processing_data["intent_label"] = "Auto-detected"
-                    processing_data["suggested_department_id"] = top_candidate.id
-                    processing_data["confidence_score"] = int(top_candidate.score * 100)  # Convert 0-1 to 0-100
-                    processing_data["suggested_department_name"] = top_candidate.name
-                    processing_data["reason"] = f"LLM unavailable (quota exceeded). Using top vector search result with {top_candidate.score:.2%} similarity."
-                    logger.info(f"Step 5 [LLM]: Fallback applied. Using Dept ID={top_candidate.id}, Name={top_candidate.name}, Score={top_candidate.score:.2%}")
-                else:
-                    processing_data["reason"] = "LLM quota exceeded and no vector search results available."
+                # Fallback: the candidate with the best cosine score. After hybrid fusion the first
+                # candidate may be a BM25-only hit, which has no similarity to report.
+                top_candidate = max((c for c in candidates if c.score > 0), key=lambda c: c.score, default=None)
+                if top_candidate is None or top_candidate.score < LLM_FALLBACK_MIN_SCORE:
+                    processing_data["vector_search_results"] = [c.model_dump() for c in candidates]
+                    return manual_routing(
+                        processing_data,
+                        f"LLM unavailable ({cause}) and no candidate reaches {LLM_FALLBACK_MIN_SCORE:.0%} similarity",
+                        start_time
+                    )
+                processing_data["intent_label"] = "Auto-detected"
+                processing_data["suggested_department_id"] = top_candidate.id
+                processing_data["confidence_score"] = int(top_candidate.score * 100)  # Convert 0-1 to 0-100
+                processing_data["suggested_department_name"] = top_candidate.name
+                processing_data["reason"] = f"LLM unavailable ({cause}). Using best vector search result with {top_candidate.score:.2%} similarity."
+                logger.info(f"Step 5 [LLM]: Fallback applied. Using Dept ID={top_candidate.id}, Name={top_candidate.name}, Score={top_candidate.score:.2%}")
             else:
                 logger.error(f"Step 5 [LLM] FAILED: {e}")
+                ERRORS.labels("llm").inc()
+                outcome = "llm_error"
                 processing_data["reason"] = f"LLM Error: {e}"
 
     # Step 6: Completion
     processing_data["processing_time_ms"] = int((time.time() - start_time) * 1000)
-    processing_data["vector_search_results"] = [c.dict() for c in candidates]
-    
-    logger.info(f"Step 6 [Completion]: Sending webhook to Django ({DJANGO_BACKEND_URL})...")
-    await send_webhook(f"{DJANGO_BACKEND_URL}/api/internal/routing-result/", processing_data)
-    logger.info(f"--- END PIPELINE: {request.message_uuid} ---")
+    # The correction vote distribution is reported after the retrieved candidates.
+    processing_data["vector_search_results"] = [c.model_dump() for c in candidates] + [
+        Candidate(id=v.department_id, name=v.name, description="Correction kNN vote", score=v.best_similarity,
+                  is_correction=True, votes=v.votes, vote_share=v.share).model_dump()
+        for v in votes
+    ]
+    record_outcome(outcome, time.time() - start_time)
+
+    # Only real decisions are reused; fallbacks and errors are not.
+    if outcome in ("llm", "bypassed", "knn", "decision_cache_hit") and processing_data["suggested_department_id"]:
+        near_duplicate_index.add(text, language, str(request.message_uuid), {
+            key: processing_data.get(key) for key in REUSABLE_DECISION_FIELDS
+        })
+    return ROUTING_RESULT_PATH, processing_data
+
+async def process_batch_pipeline(requests: List[AnalyzeRequest]):
+    """Runs a batch of messages with shared embedding and search; the outbox delivers results in bulk."""
+    logger.info(f"\n--- START BATCH PIPELINE: {len(requests)} messages ---")
+    by_uuid = {r.message_uuid: r for r in requests}
+
+    # Injections and near-duplicates of routed messages need no embedding.
+    embeddable = [
+        r for r in requests
+        if not detect_injection(r.text)[0]
+        and not near_duplicate_index.find(r.text, detect_language(r.text), count=False)
+    ]
+    if EMBEDDING_PROVIDER == "local":
+        # Steps 3-4 offline for the whole batch.
+        found = [[] for _ in embeddable]
+        if local_embedding_index.ready and embeddable:
+            with stage_timer("batch_search"):
+                found = local_embedding_index.search_many(
+                    [r.text for r in embeddable], [detect_language(r.text) for r in embeddable], limit=search_limit()
+                )
+        hits = {r.message_uuid: h for r, h in zip(embeddable, found)}
+        return await analyze_batch(requests, {}, hits)
+
+    # Step 3 for the whole batch: concurrent embeds are coalesced into batched calls.
+    with stage_timer("batch_embed"):
+        embeddings = await asyncio.gather(*(async_embed(r.text) for r in embeddable), return_exceptions=True)
+    vectors = {}
+    for r, result in zip(embeddable, embeddings):
+        if isinstance(result, Exception):
+            logger.error(f"Batch Step 3 [Embedding] FAILED for {r.message_uuid}: {result}")
+            ERRORS.labels("batch_embed").inc()
+        else:
+            vectors[r.message_uuid] = result['embedding']
+    logger.info(f"Batch Step 3 [Embedding]: {len(vectors)}/{len(embeddable)} embedded.")
+
+    # Step 4 for the whole batch: one matmul per language partition.
+    hits = {}
+    if VECTOR_INDEX_ENABLED and vector_index.ready and vectors:
+        uuids = list(vectors)
+        languages = [detect_language(by_uuid[u].text) for u in uuids]
+        with stage_timer("batch_search"):
+            found = vector_index.search_many([vectors[u] for u in uuids], languages, limit=search_limit())
+        hits = dict(zip(uuids, found))
+        logger.info(f"Batch Step 4 [Search]: Local index searched {len(uuids)} vectors.")
+    await analyze_batch(requests, vectors, hits)
+
+
+async def analyze_batch(requests: List[AnalyzeRequest], vectors: Dict[Any, Any], hits: Dict[Any, list]):
+    """Runs Step 5 for a batch with the shared vectors and hits, and hands the results to the outbox."""
+    semaphore = asyncio.Semaphore(ANALYSIS_BATCH_CONCURRENCY)
+
+    async def analyze_one(request: AnalyzeRequest):
+        async with semaphore:
+            with IN_FLIGHT.labels("pipeline").track_inprogress():
+                return await analyze_request(request, vector=vectors.get(request.message_uuid),
+                                             hits=hits.get(request.message_uuid))
+
+    outcomes = await asyncio.gather(*(analyze_one(r) for r in requests), return_exceptions=True)
+
+    routed = 0
+    for request, outcome in zip(requests, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(f"Batch pipeline FAILED for {request.message_uuid}: {outcome}")
+            continue
+        webhook_path, processing_data = outcome
+        if webhook_path:
+            await send_webhook(f"{DJANGO_BACKEND_URL}{webhook_path}", processing_data)
+            routed += webhook_path == ROUTING_RESULT_PATH
+    logger.info(f"--- END BATCH PIPELINE: {routed}/{len(requests)} routed ---")
+
+
+async def run_queued_analysis(payload: Dict[str, Any]):
+    """Worker entry point for analyses taken off the queue."""
+    await process_message_pipeline(AnalyzeRequest(**payload))
+
+# A re-index changes candidate descriptions, so cached and reusable decisions are dropped.
+vector_index.on_reindex(decision_cache.invalidate_all)
+vector_index.on_reindex(near_duplicate_index.invalidate_all)
+
+async def rebuild_local_embedding_index():
+    """Refits the offline vectorizer on the texts of the freshly loaded points."""
+    if EMBEDDING_PROVIDER == "local" or EMBEDDING_FALLBACK_LOCAL:
+        await local_embedding_index.rebuild(vector_index.points())
+
+async def rebuild_lexical_index():
+    if HYBRID_SEARCH_ENABLED:
+        await lexical_index.rebuild(vector_index.points())
+
+async def rebuild_correction_classifier():
+    if correction_classifier.enabled:
+        await correction_classifier.rebuild(vector_index.entries())
+
+vector_index.on_load(rebuild_local_embedding_index)
+vector_index.on_load(rebuild_lexical_index)
+vector_index.on_load(rebuild_correction_classifier)
+
+async def run_queued_batch(payload: Dict[str, Any]):
+    """Worker entry point for batches taken off the batch queue."""
+    await process_batch_pipeline([AnalyzeRequest(**item) for item in payload["items"]])
+
+# Durable, bounded queues feeding the analysis worker pools.
+analysis_queue = WorkQueue("ai:analysis", run_queued_analysis)
+batch_queue = WorkQueue("ai:analysis-batch", run_queued_batch, workers=ANALYSIS_BATCH_WORKERS,
+                        max_depth=ANALYSIS_BATCH_QUEUE_MAX_DEPTH, claim_idle_ms=ANALYSIS_BATCH_QUEUE_CLAIM_IDLE_MS)
 
 async def send_webhook(url: str, data: Dict[str, Any]):
+    """Queues the webhook in the outbox, or posts it directly when the outbox is disabled."""
+    if OUTBOX_ENABLED:
+        try:
+            await outbox.add(url, data)
+            return
+        except Exception as e:
+            logger.error(f"Outbox write failed, posting webhook directly: {e}")
+    await post_webhook(url, data)
+
+async def post_webhook(url: str, data: Dict[str, Any]):
     """Sends webhook using the global HTTP client."""
+    if not webhook_breaker.allow():
+        logger.error(f"Webhook to {url} dropped: Django circuit is open.")
+        FALLBACKS.labels("webhook_circuit_open").inc()
+        return
     try:
         # Debug print payload keys to ensure we aren't sending massive binary blobs
         logger.info(f"Sending webhook to {url} | Keys: {list(data.keys())}")
-        response = await http_client.post(url, json=data)
+        with stage_timer("webhook"):
+            response = await http_client.post(url, json=data)
         logger.info(f"Webhook response status: {response.status_code}")
+        if response.status_code >= 500:
+            webhook_breaker.record_failure()
+        else:
+            webhook_breaker.record_success()
         
         if response.status_code != 200:
              logger.error(f"Django Error Body: {response.text}")
+             ERRORS.labels("webhook").inc()
              
     except Exception as e:
+        webhook_breaker.record_failure()
         logger.error(f"Webhook connection failed: {e}")
+        ERRORS.labels("webhook").inc()
 
-async def train_correction_pipeline(request: TrainCorrectionRequest):
-    logger.info(f"--- START TRAINING: {request.text[:50]}... ---")
-    
-    # Step 1: Language Detection (reuse logic from process_message_pipeline)
-    language = request.language
-    if not language:
-        language = "uz"
-        if any("\u0400" <= char <= "\u04FF" for char in request.text):  # Cyrillic check
-            language = "ru"
-    logger.info(f"Language detected/specified: '{language}'")
-    
-    # Step 2: Generate Embedding
-    embedding_result = await async_embed(request.text)
-    vector = embedding_result['embedding']
-    logger.info(f"Generated embedding vector.")
-    
-    # Step 3: Generate Point ID
-    NAMESPACE = uuid.UUID('d87b3c2a-9e5f-4b1d-8c6a-2f3e4d5c6b7a')
-    point_id = str(uuid.uuid5(NAMESPACE, f"{request.text}_{language}"))
-    logger.info(f"Generated Point ID: {point_id}")
-    
-    # Step 4: Upsert to Qdrant
-    if qdrant_client:
-        await asyncio.to_thread(
-            qdrant_client.upsert,
-            collection_name="departments",
-            points=[{
-                "id": point_id,
-                "vector": vector,
-                "payload": {
-                    "department_id": request.correct_department_id,
-                    "language": language,
-                    "name": "User Correction",
-                    "description": request.text,
-                    "is_correction": True
-                }
-            }]
+# Counters of the correction training batches.
+training_stats = {"batches": 0, "corrections": 0, "points_upserted": 0, "embedding_cache_hits": 0}
+
+def correction_point_id(text: str, language: str) -> str:
+    """Stable Qdrant point ID of a correction; a repeated correction overwrites its point."""
+    return str(uuid.uuid5(CORRECTION_NAMESPACE, f"{text}_{language}"))
+
+async def send_webhooks(url: str, batch_url: str, items: List[Dict[str, Any]]):
+    """Queues several webhooks, which the outbox posts to the bulk endpoint together; posts them at once without it."""
+    if OUTBOX_ENABLED:
+        try:
+            for item in items:
+                await outbox.add(url, item)
+            return
+        except Exception as e:
+            logger.error(f"Outbox write failed, posting webhooks directly: {e}")
+    await post_webhook(batch_url, {"results": items})
+
+async def train_corrections(requests: List[TrainCorrectionRequest]):
+    """Trains a batch of corrections: one embedding pass, one Qdrant upsert and one batched webhook."""
+    logger.info(f"--- START TRAINING: {len(requests)} corrections ---")
+    languages = [request.language or detect_language(request.text) for request in requests]
+
+    # The corrected messages were embedded when they were routed, so most vectors come from
+    # the embedding cache; the misses share batched embedding calls.
+    texts = list(dict.fromkeys(request.text for request in requests))
+    embeddings = await asyncio.gather(*(async_embed(text) for text in texts))
+    vectors = {text: result["embedding"] for text, result in zip(texts, embeddings)}
+    training_stats["embedding_cache_hits"] += sum(1 for result in embeddings if result.get("cached"))
+
+    # The same text and language always map to the same point; the latest correction wins.
+    # PointStruct, not dicts: over gRPC the client only converts PointStruct objects.
+    points: Dict[str, PointStruct] = {}
+    for request, language in zip(requests, languages):
+        point_id = correction_point_id(request.text, language)
+        points[point_id] = PointStruct(
+            id=point_id,
+            vector=vectors[request.text],
+            payload={
+                "department_id": request.correct_department_id,
+                "language": language,
+                "name": "User Correction",
+                "description": request.text,
+                "is_correction": True,
+                # Recency weight of the correction's kNN vote.
+                "corrected_at": time.time()
+            }
         )
-        logger.info(f"Upserted correction to Qdrant: {point_id}")
+
+    if qdrant_client:
+        await qdrant_client.upsert(collection_name="departments", points=list(points.values()))
+        logger.info(f"Upserted {len(points)} correction points to Qdrant.")
+        # Keeps the local mirrors in step without waiting for the next poll.
+        for point_id, point in points.items():
+            if vector_index.ready:
+                vector_index.upsert(point_id, point.vector, point.payload)
+            if local_embedding_index.ready:
+                local_embedding_index.upsert(point_id, point.payload)
+            if lexical_index.ready:
+                lexical_index.add(point_id, point.payload)
+            if correction_classifier.enabled:
+                correction_classifier.add(point_id, point.vector, point.payload)
+        training_stats["points_upserted"] += len(points)
     else:
         logger.error("Qdrant client not connected, skipping upsert.")
-    
-    # Step 5: Send webhook to Django to update AIAnalysis
-    webhook_data = {
-        "message_uuid": str(request.message_uuid),
-        "correct_department_id": request.correct_department_id,
-        "language": language,
-        "correction_notes": request.correction_notes,
-    }
-    if request.corrected_by:
-        webhook_data["corrected_by"] = str(request.corrected_by)
-    
-    logger.info(f"Sending webhook to Django for AIAnalysis update...")
-    await send_webhook(f"{DJANGO_BACKEND_URL}/api/internal/train-correction/", webhook_data)
-    logger.info(f"--- END TRAINING: {request.text[:50]}... ---")
\ No newline at end of file
+
+    # Cached routing decisions for these texts are stale now. Dropped after the upsert, so
+    # nothing decided against the old points is cached again.
+    for text in texts:
+        await decision_cache.invalidate_text(text)
+        near_duplicate_index.invalidate_text(text)
+
+    # Django updates each message's AIAnalysis.
+    webhooks = []
+    for request, language in zip(requests, languages):
+        webhook_data = {
+            "message_uuid": str(request.message_uuid),
+            "correct_department_id": request.correct_department_id,
+            "language": language,
+            "correction_notes": request.correction_notes,
+        }
+        if request.corrected_by:
+            webhook_data["corrected_by"] = str(request.corrected_by)
+        webhooks.append(webhook_data)
+    await send_webhooks(f"{DJANGO_BACKEND_URL}{TRAIN_CORRECTION_PATH}",
+                        f"{DJANGO_BACKEND_URL}{TRAIN_CORRECTION_BATCH_PATH}", webhooks)
+
+    training_stats["batches"] += 1
+    training_stats["corrections"] += len(requests)
+    logger.info(f"--- END TRAINING: {len(requests)} corrections ---")
+
+async def train_correction_pipeline(request: TrainCorrectionRequest):
+    """Trains one correction right away (CORRECTION_QUEUE_ENABLED=false)."""
+    await train_corrections([request])
+
+# Corrections are acknowledged once persisted and trained in batches by a background flusher.
+correction_queue = CorrectionQueue(train_corrections, load_item=TrainCorrectionRequest.model_validate_json)
@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from services.metrics import CIRCUIT_STATE, CIRCUIT_TRANSITIONS
+
+# Configuration values.
+# Consecutive failures that open a circuit.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+# How long an open circuit fails fast before letting a probe through.
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", 30))
+# Trial calls allowed at once while half-open.
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", 1))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+logger = logging.getLogger("ai_pipeline.circuit_breaker")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing.
+
+    Closed: calls pass, failures are counted. Open: calls fail fast with CircuitOpenError
+    for CIRCUIT_RESET_SECONDS. Half-open: a few probe calls pass; a success closes the
+    circuit, a failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = CIRCUIT_RESET_SECONDS, half_open_probes: int = CIRCUIT_HALF_OPEN_PROBES):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+        self.rejected = 0
+        self.successes = 0
+        self.failures = 0
+        self.opened = 0
+        CIRCUIT_STATE.labels(name).set(0)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit '{self.name}': {self.state} -> {state}")
+        self.state = state
+        CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[state])
+        CIRCUIT_TRANSITIONS.labels(self.name, state).inc()
+        if state == OPEN:
+            self.opened += 1
+            self._opened_at = time.monotonic()
+        self._probes = 0
+
+    @property
+    def available(self) -> bool:
+        """Whether a call would be let through now (without claiming a probe)."""
+        if self.state == OPEN:
+            return time.monotonic() - self._opened_at >= self.reset_seconds
+        if self.state == HALF_OPEN:
+            return self._probes < self.half_open_probes
+        return True
+
+    def allow(self) -> bool:
+        """Claims permission for one call; False means fail fast."""
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self._transition(HALF_OPEN)
+        if self.state == OPEN or (self.state == HALF_OPEN and self._probes >= self.half_open_probes):
+            self.rejected += 1
+            return False
+        if self.state == HALF_OPEN:
+            self._probes += 1
+        return True
+
+    def record_success(self):
+        self.successes += 1
+        self._failures = 0
+        self._transition(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._failures += 1
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            self._transition(OPEN)
+
+    def record_cancelled(self):
+        if self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+
+    async def call(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            self.record_cancelled()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "successes": self.successes,
+            "failures": self.failures,
+        }
+
+
+embedding_breaker = CircuitBreaker("embedding")
+generation_breaker = CircuitBreaker("generation")
+vector_search_breaker = CircuitBreaker("vector_search")
+webhook_breaker = CircuitBreaker("webhook")
+BREAKERS = [embedding_breaker, generation_breaker, vector_search_breaker, webhook_breaker]
@@ -0,0 +1,175 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.vector_index import LocalVectorIndex
+
+# Configuration values.
+KNN_ROUTING_ENABLED = os.getenv("KNN_ROUTING_ENABLED", "true").lower() == "true"
+# Nearest correction points that vote.
+KNN_NEIGHBOURS = int(os.getenv("KNN_NEIGHBOURS", 7))
+# Corrections less similar than this to the message don't vote.
+KNN_MIN_SIMILARITY = float(os.getenv("KNN_MIN_SIMILARITY", 0.85))
+# Voting corrections needed before the vote can route a message.
+KNN_MIN_VOTES = int(os.getenv("KNN_MIN_VOTES", 3))
+# Share of the weighted vote the winning department needs.
+KNN_MIN_AGREEMENT = float(os.getenv("KNN_MIN_AGREEMENT", 0.8))
+# Votes lose half their weight per half-life; 0 disables recency weighting.
+KNN_RECENCY_HALF_LIFE_DAYS = float(os.getenv("KNN_RECENCY_HALF_LIFE_DAYS", 180))
+# Weight floor for old corrections and corrections without a timestamp.
+KNN_MIN_RECENCY_WEIGHT = float(os.getenv("KNN_MIN_RECENCY_WEIGHT", 0.25))
+
+logger = logging.getLogger("ai_pipeline.correction_classifier")
+
+
+@dataclass
+class Vote:
+    department_id: str
+    name: str
+    votes: int
+    weight: float
+    share: float
+    best_similarity: float
+
+
+@dataclass
+class KnnDecision:
+    department_id: str
+    name: str
+    votes: int
+    share: float
+    similarity: float
+
+    @property
+    def reason(self) -> str:
+        return (
+            f"Routed by {self.votes} similar staff corrections without LLM: "
+            f"{self.share:.0%} of the weighted vote, closest at {self.similarity:.2%} similarity."
+        )
+
+
+class CorrectionClassifier:
+    """Weighted kNN vote over the vectors of staff corrections.
+
+    Each correction within KNN_MIN_SIMILARITY of the message votes for its department
+    with weight similarity x recency. A department with enough votes and a large enough
+    share of the total weight gets the message without the LLM.
+    """
+
+    def __init__(self, enabled: bool = KNN_ROUTING_ENABLED, neighbours: int = KNN_NEIGHBOURS,
+                 min_similarity: float = KNN_MIN_SIMILARITY, min_votes: int = KNN_MIN_VOTES,
+                 min_agreement: float = KNN_MIN_AGREEMENT, half_life_days: float = KNN_RECENCY_HALF_LIFE_DAYS):
+        self.enabled = enabled
+        self.neighbours = neighbours
+        self.min_similarity = min_similarity
+        self.min_votes = min_votes
+        self.min_agreement = min_agreement
+        self.half_life_days = half_life_days
+        self._index = LocalVectorIndex("departments:corrections")
+        # Department names, taken from the department points; corrections are named "User Correction".
+        self._names: Dict[str, str] = {}
+
+        self.rebuilds = 0
+        self.evaluated = 0
+        self.routed = 0
+        self.rejections = {"no_neighbours": 0, "few_votes": 0, "low_agreement": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self.enabled and len(self._index) >= self.min_votes
+
+    def _build(self, entries) -> Tuple[LocalVectorIndex, Dict[str, str]]:
+        index = LocalVectorIndex("departments:corrections")
+        names = {}
+        for point_id, vector, payload in entries:
+            if payload.get("is_correction"):
+                index.upsert(point_id, vector, payload)
+            elif payload.get("name"):
+                names[str(payload.get("department_id"))] = payload["name"]
+        index.version = len(index)
+        return index, names
+
+    async def rebuild(self, entries: List[Tuple[Any, Any, Dict[str, Any]]]):
+        """Replaces the correction vectors with those of a fresh (id, vector, payload) snapshot."""
+        self._index, self._names = await asyncio.to_thread(self._build, entries)
+        self.rebuilds += 1
+        logger.info(f"Correction classifier rebuilt: {len(self._index)} corrections.")
+
+    def add(self, point_id, vector, payload: Dict[str, Any]):
+        self._index.upsert(point_id, vector, payload)
+
+    def _recency(self, payload: Dict[str, Any], now: float) -> float:
+        if self.half_life_days <= 0:
+            return 1.0
+        corrected_at = payload.get("corrected_at")
+        if not corrected_at:
+            return KNN_MIN_RECENCY_WEIGHT
+        age_days = max(0.0, now - float(corrected_at)) / 86400
+        return max(KNN_MIN_RECENCY_WEIGHT, 0.5 ** (age_days / self.half_life_days))
+
+    def vote(self, vector, language: Optional[str] = None) -> List[Vote]:
+        """Returns the vote distribution of the close corrections, strongest department first."""
+        now = time.time()
+        tallies: Dict[str, Dict[str, float]] = {}
+        for hit in self._index.search(vector, language, limit=self.neighbours):
+            if hit.score < self.min_similarity:
+                continue
+            department_id = str(hit.payload.get("department_id"))
+            tally = tallies.setdefault(department_id, {"votes": 0, "weight": 0.0, "best": 0.0})
+            tally["votes"] += 1
+            tally["weight"] += hit.score * self._recency(hit.payload, now)
+            tally["best"] = max(tally["best"], hit.score)
+
+        total = sum(t["weight"] for t in tallies.values())
+        votes = [
+            Vote(
+                department_id=department_id,
+                name=self._names.get(department_id, "Unknown"),
+                votes=int(t["votes"]),
+                weight=round(t["weight"], 4),
+                share=round(t["weight"] / total, 4),
+                best_similarity=round(t["best"], 4),
+            )
+            for department_id, t in tallies.items()
+        ]
+        return sorted(votes, key=lambda v: v.weight, reverse=True)
+
+    def classify(self, vector, language: Optional[str] = None) -> Tuple[Optional[KnnDecision], List[Vote]]:
+        """Returns a decision when the vote is confident, and the vote distribution either way."""
+        self.evaluated += 1
+        votes = self.vote(vector, language)
+        if not votes:
+            self.rejections["no_neighbours"] += 1
+            return None, votes
+        top = votes[0]
+        if top.votes < self.min_votes:
+            self.rejections["few_votes"] += 1
+            return None, votes
+        if top.share < self.min_agreement:
+            self.rejections["low_agreement"] += 1
+            return None, votes
+
+        self.routed += 1
+        return KnnDecision(department_id=top.department_id, name=top.name, votes=top.votes,
+                           share=top.share, similarity=top.best_similarity), votes
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "corrections": len(self._index),
+            "min_similarity": self.min_similarity,
+            "min_votes": self.min_votes,
+            "min_agreement": self.min_agreement,
+            "rebuilds": self.rebuilds,
+            "evaluated": self.evaluated,
+            "routed": self.routed,
+            "routed_rate": round(self.routed / self.evaluated, 4) if self.evaluated else 0.0,
+            "rejections": dict(self.rejections),
+        }
+
+
+correction_classifier = CorrectionClassifier()
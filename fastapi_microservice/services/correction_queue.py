@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import contextlib
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Configuration values.
+# /train-correction only queues corrections; a background flusher trains them in batches.
+CORRECTION_QUEUE_ENABLED = os.getenv("CORRECTION_QUEUE_ENABLED", "true").lower() == "true"
+# Queued corrections and dead letters are kept here, so a restart loses nothing.
+CORRECTION_QUEUE_PATH = os.getenv("CORRECTION_QUEUE_PATH", str(Path(__file__).resolve().parent.parent / "data" / "corrections.sqlite3"))
+# A batch is trained once this many corrections wait, or when the oldest has waited the window.
+CORRECTION_BATCH_SIZE = int(os.getenv("CORRECTION_BATCH_SIZE", 50))
+CORRECTION_BATCH_WINDOW_MS = float(os.getenv("CORRECTION_BATCH_WINDOW_MS", 1000))
+# /train-correction answers 429 once this many corrections wait.
+CORRECTION_QUEUE_MAX_PENDING = int(os.getenv("CORRECTION_QUEUE_MAX_PENDING", 5000))
+# Pause after a flush where nothing trained, doubled per failed flush in a row up to the max.
+CORRECTION_RETRY_SECONDS = float(os.getenv("CORRECTION_RETRY_SECONDS", 5.0))
+CORRECTION_MAX_BACKOFF_SECONDS = float(os.getenv("CORRECTION_MAX_BACKOFF_SECONDS", 300.0))
+# A correction that failed this many times on its own is parked as a dead letter.
+CORRECTION_MAX_ATTEMPTS = int(os.getenv("CORRECTION_MAX_ATTEMPTS", 8))
+
+logger = logging.getLogger("ai_pipeline.correction_queue")
+
+# Trains one batch of queued items; raising marks the batch as failed.
+TrainBatchFn = Callable[[List[Any]], Awaitable[None]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS corrections (
+    key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at REAL NOT NULL,
+    last_error TEXT,
+    dead_at REAL
+);
+CREATE INDEX IF NOT EXISTS corrections_status ON corrections (status, created_at);
+"""
+
+
+class CorrectionQueueFull(Exception):
+    """Raised when the pending backlog is at its limit."""
+
+
+def _dump(item: Any) -> str:
+    return item.model_dump_json() if hasattr(item, "model_dump_json") else json.dumps(item)
+
+
+class CorrectionQueue:
+    """Holds staff corrections until a background flusher trains them in batches.
+
+    Entries are keyed by message, so a newer correction of a message replaces the pending
+    one in place. Every entry is written to SQLite before it is acknowledged and deleted
+    only once trained, so corrections pending at a crash are trained after the restart.
+    A failed batch is bisected so its good entries still train; an entry failing on its
+    own goes back to the front, and after CORRECTION_MAX_ATTEMPTS it is kept as 'dead'.
+    """
+
+    def __init__(self, train_batch: TrainBatchFn, path: str = CORRECTION_QUEUE_PATH,
+                 load_item: Callable[[str], Any] = json.loads, batch_size: int = CORRECTION_BATCH_SIZE,
+                 window_ms: float = CORRECTION_BATCH_WINDOW_MS, max_pending: int = CORRECTION_QUEUE_MAX_PENDING,
+                 max_attempts: int = CORRECTION_MAX_ATTEMPTS):
+        self._train_batch = train_batch
+        self.path = path
+        self._load_item = load_item
+        self.batch_size = batch_size
+        self.window_seconds = window_ms / 1000.0
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        # In-memory view of the pending rows: key -> (item, monotonic time it was first queued,
+        # failed attempts, row version); insertion order is training order.
+        self._pending: Dict[str, Tuple[Any, float, int, int]] = {}
+        self._initialized = False
+        self.failures_in_row = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.enqueued = 0
+        self.replaced = 0
+        self.rejected = 0
+        self.restored = 0
+        self.batches = 0
+        self.trained = 0
+        self.failed_batches = 0
+        self.dead = 0
+        self.largest_batch = 0
+        self.last_error: Optional[str] = None
+        self.last_flush_at: Optional[float] = None
+
+    # --- Blocking SQLite operations (run in a worker thread) ---
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._initialized:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._initialized = True
+        return conn
+
+    def _upsert(self, key: str, payload: str) -> int:
+        with contextlib.closing(self._connect()) as conn:
+            return conn.execute(
+                """
+                INSERT INTO corrections (key, payload, created_at) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    payload = excluded.payload, version = version + 1, attempts = 0, status = 'pending',
+                    last_error = NULL, dead_at = NULL
+                RETURNING version
+                """,
+                (key, payload, time.time())
+            ).fetchone()[0]
+
+    def _load_pending(self) -> List[tuple]:
+        with contextlib.closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT key, payload, attempts, version FROM corrections WHERE status = 'pending' ORDER BY created_at"
+            ).fetchall()
+
+    def _record(self, trained: List[Tuple[str, int]], retried: List[Tuple[int, str, str, int]],
+                dead: List[Tuple[int, str, float, str, int]]):
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # A version bump means the entry was replaced while in flight; the newer one stays.
+            conn.executemany("DELETE FROM corrections WHERE key = ? AND version = ?", trained)
+            conn.executemany("UPDATE corrections SET attempts = ?, last_error = ? WHERE key = ? AND version = ?", retried)
+            conn.executemany(
+                "UPDATE corrections SET status = 'dead', attempts = ?, last_error = ?, dead_at = ? "
+                "WHERE key = ? AND version = ?",
+                [(attempts, error, dead_at, key, version) for attempts, error, dead_at, key, version in dead]
+            )
+            conn.execute("COMMIT")
+
+    def _dead_letters(self, limit: int) -> Tuple[int, List[Dict[str, Any]]]:
+        with contextlib.closing(self._connect()) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM corrections WHERE status = 'dead'").fetchone()[0]
+            rows = conn.execute(
+                "SELECT key, attempts, last_error, dead_at FROM corrections WHERE status = 'dead' "
+                "ORDER BY dead_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return count, [{"key": key, "attempts": attempts, "error": error, "dropped_at": dead_at}
+                       for key, attempts, error, dead_at in rows]
+
+    # --- Async API ---
+
+    async def add(self, key: str, item: Any) -> int:
+        """Persists one correction, then queues it; returns the number pending."""
+        entry = self._pending.get(key)
+        if entry is None and len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            raise CorrectionQueueFull(f"Correction queue is full ({len(self._pending)} pending).")
+        version = await asyncio.to_thread(self._upsert, key, _dump(item))
+
+        entry = self._pending.get(key)
+        if entry is not None:
+            self.replaced += 1
+            # A new version of the correction starts with a clean attempt count.
+            self._pending[key] = (item, entry[1], 0, version)
+        else:
+            self._pending[key] = (item, time.monotonic(), 0, version)
+        self.enqueued += 1
+        if self._wakeup:
+            self._wakeup.set()
+        return len(self._pending)
+
+    def is_pending(self, key: str) -> bool:
+        return key in self._pending
+
+    async def restore(self) -> int:
+        """Loads the corrections a previous process left pending; returns how many."""
+        rows = await asyncio.to_thread(self._load_pending)
+        now = time.monotonic()
+        for key, payload, attempts, version in rows:
+            if key not in self._pending:
+                self._pending[key] = (self._load_item(payload), now, attempts, version)
+        self.restored += len(rows)
+        self.dead = (await asyncio.to_thread(self._dead_letters, 0))[0]
+        if rows:
+            logger.warning(f"Correction queue restored {len(rows)} corrections left pending by the last run.")
+        return len(rows)
+
+    async def _train(self, batch: List[Tuple[str, Tuple[Any, float, int, int]]]) -> List[Tuple[str, Tuple[Any, float, int, int], str]]:
+        """Trains a batch, bisecting it on failure; returns the entries that failed on their own, with the error."""
+        try:
+            await self._train_batch([entry[0] for _, entry in batch])
+        except Exception as e:
+            self.failed_batches += 1
+            self.last_error = str(e)
+            if len(batch) == 1:
+                return [(batch[0][0], batch[0][1], str(e))]
+            middle = len(batch) // 2
+            return await self._train(batch[:middle]) + await self._train(batch[middle:])
+        self.batches += 1
+        self.trained += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        self.last_flush_at = time.time()
+        return []
+
+    async def flush_once(self) -> int:
+        """Trains the oldest batch; returns how many corrections were trained."""
+        keys = list(self._pending)[:self.batch_size]
+        if not keys:
+            return 0
+        batch = [(key, self._pending.pop(key)) for key in keys]
+        failed = await self._train(batch)
+        failed_keys = {key for key, _, _ in failed}
+
+        retry, retried, dead = {}, [], []
+        for key, (item, queued_at, attempts, version), error in failed:
+            if key in self._pending:
+                # Replaced while in flight; the newer version is tried instead.
+                continue
+            if attempts + 1 >= self.max_attempts:
+                dead.append((attempts + 1, error, time.time(), key, version))
+                logger.error(f"Correction {key} parked as dead after {attempts + 1} failed attempts: {error}")
+            else:
+                retry[key] = (item, queued_at, attempts + 1, version)
+                retried.append((attempts + 1, error, key, version))
+        trained_rows = [(key, entry[3]) for key, entry in batch if key not in failed_keys]
+        try:
+            await asyncio.to_thread(self._record, trained_rows, retried, dead)
+        except Exception as e:
+            # Trained rows left behind are trained again after a restart; the upsert is idempotent.
+            logger.error(f"Correction queue could not record the batch outcome: {e}")
+        self.dead += len(dead)
+        self._pending = {**retry, **self._pending}
+
+        trained = len(batch) - len(failed)
+        self.failures_in_row = self.failures_in_row + 1 if failed and not trained else 0
+        return trained
+
+    def _oldest_wait(self) -> float:
+        return time.monotonic() - next(iter(self._pending.values()))[1]
+
+    async def run(self):
+        """Flusher loop; trains as soon as a batch is full or its oldest entry has waited the window."""
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            remaining = self.window_seconds - self._oldest_wait()
+            if len(self._pending) < self.batch_size and remaining > 0:
+                self._wakeup.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                continue
+            try:
+                await self.flush_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures_in_row += 1
+                logger.error(f"Correction flush failed: {e}")
+            if self.failures_in_row:
+                delay = min(CORRECTION_MAX_BACKOFF_SECONDS, CORRECTION_RETRY_SECONDS * 2 ** (self.failures_in_row - 1))
+                logger.error(f"Correction training failing ({self.last_error}), retrying in {delay:.0f}s.")
+                await asyncio.sleep(delay)
+
+    async def start(self):
+        await self.restore()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stops the flusher, then trains the corrections still pending; the rest stay on disk."""
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        while self._pending:
+            if not await self.flush_once():
+                logger.error(f"Correction queue stopped with {len(self._pending)} corrections untrained, "
+                             f"kept for the next start: {self.last_error}")
+                break
+
+    async def dead_letters(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Most recently parked corrections."""
+        return (await asyncio.to_thread(self._dead_letters, limit))[1]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": CORRECTION_QUEUE_ENABLED,
+            "pending": len(self._pending),
+            "oldest_pending_age_seconds": round(self._oldest_wait(), 3) if self._pending else 0.0,
+            "enqueued": self.enqueued,
+            "replaced": self.replaced,
+            "rejected": self.rejected,
+            "restored": self.restored,
+            "batches": self.batches,
+            "trained": self.trained,
+            "failed_batches": self.failed_batches,
+            "failures_in_row": self.failures_in_row,
+            "dead": self.dead,
+            "largest_batch": self.largest_batch,
+            "avg_batch_size": round(self.trained / self.batches, 2) if self.batches else 0.0,
+            "last_flush_at": self.last_flush_at,
+            "last_error": self.last_error,
+        }
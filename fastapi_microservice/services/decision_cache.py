@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.cache import LRUCache, text_hash
+from services.redis_client import get_redis, mark_redis_down
+
+# Configuration values.
+DECISION_CACHE_ENABLED = os.getenv("DECISION_CACHE_ENABLED", "true").lower() == "true"
+DECISION_CACHE_TTL = int(os.getenv("DECISION_CACHE_TTL", 6 * 3600))
+DECISION_CACHE_SIZE = int(os.getenv("DECISION_CACHE_SIZE", 2000))
+# Kept short: another replica's invalidation only reaches this tier when it expires.
+DECISION_CACHE_LOCAL_TTL = int(os.getenv("DECISION_CACHE_LOCAL_TTL", 300))
+
+# Bumped to invalidate every cached decision at once (e.g. after a re-index).
+GENERATION_KEY = "dec:generation"
+# Only the parsed decision is cached, never token usage.
+DECISION_FIELDS = ("department_id", "intent", "confidence", "reason")
+
+logger = logging.getLogger("ai_pipeline.decision_cache")
+
+
+def text_key(text: str) -> str:
+    return f"dec:{text_hash(text)}"
+
+
+def decision_key(text: str, language: str, model: str, candidate_ids: List[str]) -> Tuple[str, str]:
+    """Returns (Redis hash of the text, field of the language, model and candidate set)."""
+    context = json.dumps([language, model, sorted(candidate_ids)])
+    return text_key(text), hashlib.sha256(context.encode("utf-8")).hexdigest()[:32]
+
+
+class DecisionCache:
+    """Caches parsed LLM routing decisions per normalized text, language, model and candidate set.
+
+    In Redis, all decisions for a text are fields of one hash, so invalidating a corrected
+    text is a single DEL. The hash's TTL is renewed on every write to it.
+    """
+
+    def __init__(self, enabled: bool = DECISION_CACHE_ENABLED, max_entries: int = DECISION_CACHE_SIZE,
+                 ttl_seconds: int = DECISION_CACHE_TTL, local_ttl_seconds: int = DECISION_CACHE_LOCAL_TTL,
+                 use_redis: bool = True):
+        self.enabled = enabled
+        self.local = LRUCache(max_entries, local_ttl_seconds)
+        self.ttl_seconds = ttl_seconds
+        self.use_redis = use_redis
+        # Last generation seen; entries from older generations are misses.
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get(self, text: str, language: str, model: str, candidate_ids: List[str]) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        key, field = decision_key(text, language, model, candidate_ids)
+
+        entry = self.local.get(f"{key}:{field}")
+        if entry is None:
+            entry = await self._get_shared(key, field)
+        if entry is None or entry["generation"] != self.generation:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return dict(entry["result"])
+
+    async def _get_shared(self, key: str, field: str) -> Optional[Dict[str, Any]]:
+        client = await get_redis() if self.use_redis else None
+        if client is None:
+            return None
+        try:
+            # The entry and the current generation come back in one round trip.
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.hget(key, field)
+                pipe.get(GENERATION_KEY)
+                data, generation = await pipe.execute()
+        except Exception as e:
+            mark_redis_down(e)
+            return None
+
+        self.generation = max(self.generation, int(generation or 0))
+        if data is None:
+            return None
+        entry = json.loads(data)
+        self.local.set(f"{key}:{field}", entry)
+        return entry
+
+    async def set(self, text: str, language: str, model: str, candidate_ids: List[str], result: Dict[str, Any]):
+        if not self.enabled:
+            return
+        key, field = decision_key(text, language, model, candidate_ids)
+        entry = {"generation": self.generation, "result": {k: result.get(k) for k in DECISION_FIELDS}}
+        self.local.set(f"{key}:{field}", entry)
+
+        client = await get_redis() if self.use_redis else None
+        if client is None:
+            return
+        try:
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.hset(key, field, json.dumps(entry))
+                pipe.expire(key, self.ttl_seconds)
+                await pipe.execute()
+        except Exception as e:
+            mark_redis_down(e)
+
+    async def invalidate_text(self, text: str):
+        """Drops every cached decision for a text, e.g. after staff trained a correction for it."""
+        key = text_key(text)
+        removed = self.local.delete_prefix(f"{key}:")
+        self.invalidations += 1
+
+        client = await get_redis() if self.use_redis else None
+        if client is not None:
+            try:
+                removed += await client.delete(key)
+            except Exception as e:
+                mark_redis_down(e)
+        logger.info(f"Decision cache: invalidated {removed} entries for corrected text.")
+
+    async def invalidate_all(self):
+        """Invalidates every cached decision, e.g. after the department index was re-indexed."""
+        self.local.clear()
+        self.generation += 1
+        self.invalidations += 1
+
+        client = await get_redis() if self.use_redis else None
+        if client is not None:
+            try:
+                self.generation = max(self.generation, await client.incr(GENERATION_KEY))
+            except Exception as e:
+                mark_redis_down(e)
+        logger.info(f"Decision cache: invalidated all entries (generation {self.generation}).")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "local": self.local.stats(),
+        }
+
+
+decision_cache = DecisionCache()
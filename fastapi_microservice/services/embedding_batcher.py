@@ -0,0 +1,155 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from services.circuit_breaker import CircuitOpenError
+
+# Configuration values.
+# How long the first request of a batch waits for company before the batch is sent.
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", 10))
+# Gemini accepts at most 100 texts per batch embedding request.
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", 100))
+
+# Upper bounds of the batch-size histogram buckets.
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100)
+
+logger = logging.getLogger("ai_pipeline.embedding_batcher")
+
+# Signature: (model, task_type, texts) -> one vector per text. Awaited if a coroutine function, otherwise called in a worker thread.
+EmbedBatchFn = Callable[[str, str, List[str]], List[List[float]]]
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent embed requests into batched embedding calls and fans the results back out.
+
+    The optional circuit breaker guards the batch call, so a failed upstream request counts
+    as one failure however many callers it served.
+    """
+
+    def __init__(self, embed_batch: EmbedBatchFn, window_ms: float = EMBED_BATCH_WINDOW_MS,
+                 max_batch_size: int = EMBED_BATCH_MAX_SIZE, limiter: Optional[Any] = None,
+                 breaker: Optional[Any] = None):
+        self._embed_batch = embed_batch
+        # Optional AdaptiveLimiter the batch calls are run through.
+        self._limiter = limiter
+        # Optional CircuitBreaker around each batch call (after the limiter's retries).
+        self._breaker = breaker
+        self.window_seconds = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[Tuple[str, str], List[Tuple[str, asyncio.Future, float]]] = {}
+        self._timers: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+        # The loop only keeps weak references to tasks; running dispatches are held here.
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.largest_batch = 0
+        self.size_histogram = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    async def embed(self, text: str, model: str, task_type: str) -> List[float]:
+        """Queues one text and waits for its vector from the next batch."""
+        if self._breaker and not self._breaker.available:
+            # Fails fast instead of waiting for a batch that would be refused.
+            raise CircuitOpenError(f"{self._breaker.name} circuit is open")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (model, task_type)
+
+        batch = self._pending.setdefault(key, [])
+        batch.append((text, future, time.monotonic()))
+
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.window_seconds, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: Tuple[str, str]):
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            task = asyncio.ensure_future(self._dispatch(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._dispatch_done)
+
+    def _dispatch_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+            logger.error(f"Embedding batch dispatch crashed: {task.exception()!r}")
+
+    async def _dispatch(self, key: Tuple[str, str], batch: List[Tuple[str, asyncio.Future, float]]):
+        model, task_type = key
+        # Identical texts within a burst are embedded once.
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        self._record_batch(batch, len(texts))
+
+        try:
+            if self._breaker:
+                vectors = await self._breaker.call(self._call, model, task_type, texts)
+            else:
+                vectors = await self._call(model, task_type, texts)
+            if len(vectors) != len(texts):
+                raise ValueError(f"Batch embedding returned {len(vectors)} vectors for {len(texts)} texts.")
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Batch embedding of {len(texts)} texts failed: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, vectors))
+        for text, future, _ in batch:
+            # Callers that were cancelled while waiting are skipped.
+            if not future.done():
+                future.set_result(by_text[text])
+
+    async def _call(self, model: str, task_type: str, texts: List[str]) -> List[List[float]]:
+        if self._limiter:
+            return await self._limiter.call(self._embed_batch, model, task_type, texts)
+        if asyncio.iscoroutinefunction(self._embed_batch):
+            return await self._embed_batch(model, task_type, texts)
+        return await asyncio.to_thread(self._embed_batch, model, task_type, texts)
+
+    def _record_batch(self, batch: List[Tuple[str, asyncio.Future, float]], unique_texts: int):
+        now = time.monotonic()
+        self.batches += 1
+        self.items += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for bucket in BATCH_SIZE_BUCKETS:
+            if len(batch) <= bucket:
+                self.size_histogram[bucket] += 1
+                break
+
+        for _, _, enqueued_at in batch:
+            wait_ms = (now - enqueued_at) * 1000
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+        if len(batch) > 1:
+            logger.info(f"Dispatching embedding batch: {len(batch)} requests, {unique_texts} unique texts.")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window_seconds * 1000,
+            "max_batch_size": self.max_batch_size,
+            "batches": self.batches,
+            "items": self.items,
+            "errors": self.errors,
+            "pending": sum(len(batch) for batch in self._pending.values()),
+            "in_flight_batches": len(self._tasks),
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "batch_size_histogram": {f"le_{bucket}": count for bucket, count in self.size_histogram.items()},
+            "avg_wait_ms": round(self.total_wait_ms / self.items, 2) if self.items else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 2),
+        }
@@ -0,0 +1,109 @@
+import os
+import struct
+import logging
+from typing import Any, Dict, List, Optional
+
+from services.cache import LRUCache, text_hash
+from services.redis_client import get_redis, mark_redis_down
+
+# Configuration values.
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 5000))
+# Applies to both tiers; embeddings of a fixed model never go stale, the TTL only bounds memory.
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", 7 * 24 * 3600))
+EMBEDDING_CACHE_REDIS = os.getenv("EMBEDDING_CACHE_REDIS", "true").lower() == "true"
+
+logger = logging.getLogger("ai_pipeline.embedding_cache")
+
+
+def encode_vector(vector: List[float]) -> bytes:
+    """Packs a vector as little-endian float16 (1.5 KB for a 768-dim embedding)."""
+    return struct.pack(f"<{len(vector)}e", *vector)
+
+
+def decode_vector(data: bytes) -> List[float]:
+    """Unpacks a float16 vector produced by encode_vector."""
+    return list(struct.unpack(f"<{len(data) // 2}e", data))
+
+
+def embedding_key(model: str, task_type: str, text: str) -> str:
+    return f"emb:{model}:{task_type}:{text_hash(text)}"
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache: an in-process LRU in front of a shared Redis tier."""
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_SIZE, ttl_seconds: int = EMBEDDING_CACHE_TTL,
+                 use_redis: bool = EMBEDDING_CACHE_REDIS):
+        self.local = LRUCache(max_entries, ttl_seconds)
+        self.ttl_seconds = ttl_seconds
+        self.use_redis = use_redis
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+        # Lookups that missed every tier and needed a network embedding call.
+        self.misses = 0
+
+    async def get(self, model: str, task_type: str, text: str) -> Optional[List[float]]:
+        key = embedding_key(model, task_type, text)
+
+        data = self.local.get(key)
+        if data is None:
+            data = await self._get_shared(key)
+        if data is None:
+            self.misses += 1
+            return None
+        return decode_vector(data)
+
+    async def _get_shared(self, key: str) -> Optional[bytes]:
+        if not self.use_redis:
+            return None
+        client = await get_redis()
+        if client is None:
+            return None
+
+        try:
+            data = await client.get(key)
+        except Exception as e:
+            self.redis_errors += 1
+            mark_redis_down(e)
+            return None
+
+        if data is None:
+            self.redis_misses += 1
+            return None
+
+        self.redis_hits += 1
+        # Promotes to the local tier so the next lookup skips Redis too.
+        self.local.set(key, data)
+        return data
+
+    async def set(self, model: str, task_type: str, text: str, vector: List[float]):
+        key = embedding_key(model, task_type, text)
+        data = encode_vector(vector)
+        self.local.set(key, data)
+
+        if not self.use_redis:
+            return
+        client = await get_redis()
+        if client is None:
+            return
+
+        try:
+            await client.set(key, data, ex=self.ttl_seconds)
+        except Exception as e:
+            self.redis_errors += 1
+            mark_redis_down(e)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"local": self.local.stats()}
+        stats["redis"] = {
+            "enabled": self.use_redis,
+            "hits": self.redis_hits,
+            "misses": self.redis_misses,
+            "errors": self.redis_errors,
+        }
+        stats["misses"] = self.misses
+        return stats
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,190 @@
+import os
+import math
+import zlib
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import google.generativeai as genai
+
+from services.cache import normalize_text
+from services.vector_index import LocalVectorIndex
+
+# Configuration values.
+# "gemini" embeds through the Gemini API; "local" routes with the offline hashing vectorizer only.
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "gemini").lower()
+# Falls back to the local vectorizer when a Gemini embedding fails.
+EMBEDDING_FALLBACK_LOCAL = os.getenv("EMBEDDING_FALLBACK_LOCAL", "true").lower() == "true"
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", 2048))
+LOCAL_EMBEDDING_NGRAMS = (2, 4)
+
+logger = logging.getLogger("ai_pipeline.embedding_provider")
+
+
+class EmbeddingProvider(ABC):
+    """Turns texts into vectors. `embed` is blocking; async callers run it in a thread."""
+
+    name = "base"
+
+    @abstractmethod
+    def embed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        """Returns one vector per text."""
+
+    async def embed_async(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        return await asyncio.to_thread(self.embed, texts, task_type)
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Gemini embedding API; one request for all texts. `client` is the genai module or a stand-in."""
+
+    name = "gemini"
+
+    def __init__(self, model: str = "models/text-embedding-004", client=None):
+        self.model = model
+        self.client = client or genai
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        result = self.client.embed_content(
+            model=self.model,
+            content=texts,
+            task_type=task_type
+        )
+        return result["embedding"]
+
+    async def embed_async(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        result = await self.client.embed_content_async(
+            model=self.model,
+            content=texts,
+            task_type=task_type
+        )
+        return result["embedding"]
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """Offline character n-gram hashing vectorizer with IDF weights.
+
+    Character n-grams handle the mixed Uzbek/Russian, Latin/Cyrillic spelling of messages
+    better than word tokens. Features are hashed into a fixed number of signed buckets, so
+    no vocabulary is stored; `fit` only learns per-bucket IDF weights from the corpus.
+    """
+
+    name = "local"
+
+    def __init__(self, dimension: int = LOCAL_EMBEDDING_DIM, ngrams: Tuple[int, int] = LOCAL_EMBEDDING_NGRAMS):
+        self.dimension = dimension
+        self.ngrams = ngrams
+        self.idf = np.ones(dimension, dtype=np.float32)
+        self.fitted_documents = 0
+
+    def _features(self, text: str) -> Dict[int, int]:
+        text = f" {normalize_text(text)} "
+        counts: Dict[int, int] = {}
+        for n in range(self.ngrams[0], self.ngrams[1] + 1):
+            for i in range(len(text) - n + 1):
+                feature = zlib.crc32(text[i:i + n].encode("utf-8"))
+                counts[feature] = counts.get(feature, 0) + 1
+        for word in text.split():
+            feature = zlib.crc32(b"w:" + word.encode("utf-8"))
+            counts[feature] = counts.get(feature, 0) + 1
+        return counts
+
+    def fit(self, texts: Iterable[str]) -> "HashingEmbeddingProvider":
+        document_frequency = np.zeros(self.dimension, dtype=np.float32)
+        documents = 0
+        for text in texts:
+            buckets = {feature % self.dimension for feature in self._features(text)}
+            document_frequency[list(buckets)] += 1
+            documents += 1
+        self.idf = (np.log((1 + documents) / (1 + document_frequency)) + 1).astype(np.float32)
+        self.fitted_documents = documents
+        return self
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_query") -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                bucket = feature % self.dimension
+                # The top hash bit picks the sign, so colliding features tend to cancel out.
+                sign = -1.0 if feature & 0x80000000 else 1.0
+                matrix[row, bucket] += sign * (1 + math.log(count)) * self.idf[bucket]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+
+def point_text(payload: Dict[str, Any]) -> str:
+    """Text a point is matched on: the department's name and description, or the correction text."""
+    if payload.get("is_correction"):
+        return payload.get("description") or ""
+    return f"{payload.get('name') or ''} {payload.get('description') or ''}"
+
+
+class LocalEmbeddingIndex:
+    """Hashing-vectorizer index over the same points as the Qdrant collection.
+
+    Its vectors live in a different space from Gemini's, so it is built from the payload
+    texts the mirror loads (department descriptions and correction texts) and searched
+    with queries embedded by the same fitted vectorizer.
+    """
+
+    def __init__(self, dimension: int = LOCAL_EMBEDDING_DIM):
+        self.dimension = dimension
+        self._provider = HashingEmbeddingProvider(dimension)
+        self._index = LocalVectorIndex("departments:local")
+        self.rebuilds = 0
+        self.queries = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._index.ready
+
+    def _build(self, points: List[Tuple[Any, Dict[str, Any]]]) -> Tuple[HashingEmbeddingProvider, LocalVectorIndex]:
+        texts = [point_text(payload) for _, payload in points]
+        provider = HashingEmbeddingProvider(self.dimension).fit(texts)
+        index = LocalVectorIndex("departments:local")
+        if points:
+            vectors = provider.embed(texts, "retrieval_document")
+            for (point_id, payload), vector in zip(points, vectors):
+                index.upsert(point_id, vector, payload)
+        index.version = len(points)
+        return provider, index
+
+    async def rebuild(self, points: List[Tuple[Any, Dict[str, Any]]]):
+        """Refits the vectorizer and re-embeds all points, then swaps both in at once."""
+        provider, index = await asyncio.to_thread(self._build, points)
+        self._provider, self._index = provider, index
+        self.rebuilds += 1
+        logger.info(f"Local embedding index rebuilt: {len(index)} points, {provider.fitted_documents} fitted texts.")
+
+    def upsert(self, point_id, payload: Dict[str, Any]):
+        """Adds one point (e.g. a correction) with the current IDF weights."""
+        vector = self._provider.embed([point_text(payload)], "retrieval_document")[0]
+        self._index.upsert(point_id, vector, payload)
+
+    def embed(self, text: str) -> np.ndarray:
+        return self._provider.embed([text])[0]
+
+    def search(self, text: str, language: Optional[str] = None, limit: int = 3):
+        self.queries += 1
+        return self._index.search(self.embed(text), language, limit)
+
+    def search_many(self, texts: List[str], languages: List[Optional[str]], limit: int = 3):
+        self.queries += len(texts)
+        return self._index.search_many(list(self._provider.embed(texts)), languages, limit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "provider": EMBEDDING_PROVIDER,
+            "fallback_enabled": EMBEDDING_FALLBACK_LOCAL,
+            "ready": self.ready,
+            "points": len(self._index),
+            "dimension": self.dimension,
+            "fitted_documents": self._provider.fitted_documents,
+            "rebuilds": self.rebuilds,
+            "queries": self.queries,
+        }
+
+
+local_embedding_index = LocalEmbeddingIndex()
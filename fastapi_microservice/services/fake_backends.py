@@ -0,0 +1,305 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from qdrant_client.http.models import PointStruct, QueryResponse, Record, ScoredPoint
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:  # pragma: no cover - google-api-core ships with google-generativeai
+    google_exceptions = None
+
+from services.embedding_provider import HashingEmbeddingProvider
+
+# Configuration values.
+# "fake" swaps Gemini and Qdrant for the in-process stand-ins below (benchmarks, chaos tests, CI).
+AI_BACKEND = os.getenv("AI_BACKEND", "real").lower()
+FAKE_GEMINI_SEED = int(os.getenv("FAKE_GEMINI_SEED", 0))
+# Injected latency per Gemini call: a base plus uniform jitter.
+FAKE_GEMINI_LATENCY_MS = float(os.getenv("FAKE_GEMINI_LATENCY_MS", 0))
+FAKE_GEMINI_JITTER_MS = float(os.getenv("FAKE_GEMINI_JITTER_MS", 0))
+# Share of calls answered with a 429 (quota storm) or hanging until a deadline error.
+FAKE_GEMINI_429_RATE = float(os.getenv("FAKE_GEMINI_429_RATE", 0))
+FAKE_GEMINI_TIMEOUT_RATE = float(os.getenv("FAKE_GEMINI_TIMEOUT_RATE", 0))
+FAKE_GEMINI_TIMEOUT_SECONDS = float(os.getenv("FAKE_GEMINI_TIMEOUT_SECONDS", 10))
+FAKE_QDRANT_LATENCY_MS = float(os.getenv("FAKE_QDRANT_LATENCY_MS", 0))
+# JSON list of {"department_id", "name", "description", "language"} loaded into the fake collection.
+FAKE_QDRANT_SEED_FILE = os.getenv("FAKE_QDRANT_SEED_FILE")
+FAKE_EMBEDDING_DIM = 768
+
+logger = logging.getLogger("ai_pipeline.fake_backends")
+
+_CANDIDATE_RE = re.compile(r"ID: (?P<id>[^,]+), Name: (?P<name>[^,\n]*)")
+_MESSAGE_RE = re.compile(r'User Message: "(?P<text>.*?)"\n', re.S)
+
+
+class FakeResponse:
+    """The parts of a Gemini GenerateContentResponse the pipeline reads."""
+
+    def __init__(self, text: str, prompt_tokens: int, output_tokens: int):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens,
+        )
+
+
+class FakeGemini:
+    """Stand-in for the `google.generativeai` module: embeddings and routing decisions, no network.
+
+    Embeddings come from the hashing vectorizer (deterministic, and similar texts stay close);
+    decisions pick the first candidate of the routing prompt. Latency, 429s and timeouts are
+    injected at the configured rates from a seeded generator, so runs are reproducible.
+    """
+
+    def __init__(self, seed: int = FAKE_GEMINI_SEED, latency_ms: float = FAKE_GEMINI_LATENCY_MS,
+                 jitter_ms: float = FAKE_GEMINI_JITTER_MS, rate_limit_rate: float = FAKE_GEMINI_429_RATE,
+                 timeout_rate: float = FAKE_GEMINI_TIMEOUT_RATE, timeout_seconds: float = FAKE_GEMINI_TIMEOUT_SECONDS,
+                 dimension: int = FAKE_EMBEDDING_DIM):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self._random = random.Random(seed)
+        self._embedder = HashingEmbeddingProvider(dimension)
+        self.calls = {"embed": 0, "generate": 0}
+        self.rate_limited = 0
+        self.timeouts = 0
+
+    def _fault(self) -> Tuple[float, Optional[Exception]]:
+        """Draws this call's latency and injected error."""
+        roll = self._random.random()
+        delay = (self.latency_ms + self._random.uniform(0, self.jitter_ms)) / 1000
+        if roll < self.rate_limit_rate:
+            self.rate_limited += 1
+            return delay, _error("ResourceExhausted", "429 Resource has been exhausted (fake quota).")
+        if roll < self.rate_limit_rate + self.timeout_rate:
+            self.timeouts += 1
+            return self.timeout_seconds, _error("DeadlineExceeded", "504 Deadline Exceeded (fake timeout).")
+        return delay, None
+
+    def _embed(self, content) -> Any:
+        texts = [content] if isinstance(content, str) else list(content)
+        vectors = [v.tolist() for v in self._embedder.embed(texts)]
+        return {"embedding": vectors[0] if isinstance(content, str) else vectors}
+
+    def embed_content(self, model: str, content, task_type: str = "retrieval_query", **kwargs) -> Dict[str, Any]:
+        self.calls["embed"] += 1
+        delay, error = self._fault()
+        time.sleep(delay)
+        if error:
+            raise error
+        return self._embed(content)
+
+    async def embed_content_async(self, model: str, content, task_type: str = "retrieval_query",
+                                  **kwargs) -> Dict[str, Any]:
+        self.calls["embed"] += 1
+        delay, error = self._fault()
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return self._embed(content)
+
+    def decide(self, prompt: str) -> str:
+        """Routing JSON for a prompt: the first (best-scored) listed candidate."""
+        candidates = _CANDIDATE_RE.findall(prompt)
+        if not candidates:
+            return json.dumps({"department_id": None, "intent": "Savol", "confidence": 0, "reason": "No candidates."})
+        department_id, name = candidates[0]
+        match = _MESSAGE_RE.search(prompt)
+        # Same message, same confidence.
+        confidence = 70 + int(self._embedder.embed([match.group("text") if match else prompt])[0][0] * 1000) % 30
+        return json.dumps({
+            "department_id": department_id.strip(), "intent": "Shikoyat", "confidence": confidence,
+            "reason": f"Fake decision: best matching department {name.strip()}."
+        })
+
+    def GenerativeModel(self, model_name: str) -> "FakeGenerativeModel":
+        return FakeGenerativeModel(self, model_name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": dict(self.calls),
+            "rate_limited": self.rate_limited,
+            "timeouts": self.timeouts,
+            "latency_ms": self.latency_ms,
+            "rate_limit_rate": self.rate_limit_rate,
+            "timeout_rate": self.timeout_rate,
+        }
+
+
+class FakeGenerativeModel:
+    def __init__(self, gemini: FakeGemini, model_name: str):
+        self.gemini = gemini
+        self.model_name = model_name
+
+    async def generate_content_async(self, prompt: str, generation_config=None, **kwargs) -> FakeResponse:
+        self.gemini.calls["generate"] += 1
+        delay, error = self.gemini._fault()
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        text = self.gemini.decide(prompt)
+        return FakeResponse(text, prompt_tokens=len(prompt) // 4, output_tokens=len(text) // 4)
+
+
+def _error(name: str, message: str) -> Exception:
+    if google_exceptions is not None:
+        return getattr(google_exceptions, name)(message)
+    return RuntimeError(message)
+
+
+class _Collection:
+    def __init__(self):
+        # point_id -> (unit vector, payload)
+        self.points: Dict[Any, Tuple[np.ndarray, Dict[str, Any]]] = {}
+
+
+def _matches(payload: Dict[str, Any], query_filter) -> bool:
+    # The subset the pipeline uses: `must` conditions matching one value.
+    for condition in getattr(query_filter, "must", None) or []:
+        if payload.get(condition.key) != condition.match.value:
+            return False
+    return True
+
+
+def _project(payload: Dict[str, Any], with_payload) -> Optional[Dict[str, Any]]:
+    if with_payload is True:
+        return dict(payload)
+    if isinstance(with_payload, list):
+        return {key: payload[key] for key in with_payload if key in payload}
+    return None
+
+
+def _point(point) -> Tuple[Any, List[float], Dict[str, Any]]:
+    # Like the gRPC client, which fails on anything but PointStruct.
+    if not isinstance(point, PointStruct):
+        raise ValueError(f"Expected PointStruct, got {type(point).__name__}")
+    return point.id, point.vector, point.payload or {}
+
+
+class FakeAsyncQdrantClient:
+    """In-memory stand-in for the AsyncQdrantClient calls the pipeline makes.
+
+    Covers get_collections/get_collection/get_aliases/collection_exists/create_collection, upsert, scroll
+    and query_points (cosine, `must` match filters, payload projection). Searches are exact.
+    """
+
+    def __init__(self, latency_ms: float = FAKE_QDRANT_LATENCY_MS):
+        self.latency_ms = latency_ms
+        self._collections: Dict[str, _Collection] = {}
+        self.queries = 0
+
+    async def _latency(self):
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+    def _collection(self, collection_name: str) -> _Collection:
+        if collection_name not in self._collections:
+            raise ValueError(f"Collection `{collection_name}` doesn't exist!")
+        return self._collections[collection_name]
+
+    async def get_collections(self):
+        return SimpleNamespace(collections=[SimpleNamespace(name=name) for name in self._collections])
+
+    async def get_aliases(self):
+        return SimpleNamespace(aliases=[])
+
+    async def collection_exists(self, collection_name: str) -> bool:
+        return collection_name in self._collections
+
+    async def create_collection(self, collection_name: str, **kwargs) -> bool:
+        self._collections[collection_name] = _Collection()
+        return True
+
+    async def get_collection(self, collection_name: str):
+        collection = self._collection(collection_name)
+        return SimpleNamespace(status="green", points_count=len(collection.points))
+
+    async def upsert(self, collection_name: str, points, **kwargs):
+        await self._latency()
+        collection = self._collections.setdefault(collection_name, _Collection())
+        for point in points:
+            point_id, vector, payload = _point(point)
+            vector = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            collection.points[point_id] = (vector / norm if norm else vector, dict(payload))
+        return SimpleNamespace(status="completed")
+
+    async def scroll(self, collection_name: str, limit: int = 10, offset=None, with_payload=True,
+                     with_vectors=False, scroll_filter=None, **kwargs):
+        await self._latency()
+        collection = self._collection(collection_name)
+        ids = sorted((i for i, (_, p) in collection.points.items() if _matches(p, scroll_filter)), key=str)
+        start = ids.index(offset) if offset is not None and offset in ids else 0
+        page = ids[start:start + limit]
+        records = [
+            Record(id=i, payload=_project(collection.points[i][1], with_payload),
+                   vector=collection.points[i][0].tolist() if with_vectors else None)
+            for i in page
+        ]
+        next_offset = ids[start + limit] if start + limit < len(ids) else None
+        return records, next_offset
+
+    async def query_points(self, collection_name: str, query, query_filter=None, limit: int = 10,
+                           with_payload=True, with_vectors=False, **kwargs) -> QueryResponse:
+        await self._latency()
+        self.queries += 1
+        collection = self._collection(collection_name)
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        query = query / norm if norm else query
+        scored = sorted(
+            ((float(vector @ query), point_id, payload)
+             for point_id, (vector, payload) in collection.points.items() if _matches(payload, query_filter)),
+            key=lambda item: item[0], reverse=True
+        )[:limit]
+        return QueryResponse(points=[
+            ScoredPoint(id=point_id, version=0, score=score, payload=_project(payload, with_payload),
+                        vector=collection.points[point_id][0].tolist() if with_vectors else None)
+            for score, point_id, payload in scored
+        ])
+
+    async def seed(self, departments: List[Dict[str, Any]], gemini: FakeGemini, collection_name: str = "departments"):
+        """Indexes department payloads with the fake embeddings, like index_departments does."""
+        await self.create_collection(collection_name)
+        texts = [f"{d.get('name') or ''} {d.get('description') or ''}" for d in departments]
+        vectors = gemini._embed(texts)["embedding"] if texts else []
+        await self.upsert(collection_name, [
+            PointStruct(id=index, vector=vector, payload={**d, "department_id": str(d["department_id"])})
+            for index, (d, vector) in enumerate(zip(departments, vectors))
+        ])
+        logger.info(f"Fake Qdrant seeded with {len(departments)} department points.")
+
+    async def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "collections": {name: len(c.points) for name, c in self._collections.items()},
+            "queries": self.queries,
+            "latency_ms": self.latency_ms,
+        }
+
+
+fake_gemini = FakeGemini()
+
+
+async def create_fake_qdrant() -> FakeAsyncQdrantClient:
+    """Fake client with the departments collection, seeded from FAKE_QDRANT_SEED_FILE when set."""
+    client = FakeAsyncQdrantClient()
+    departments = []
+    if FAKE_QDRANT_SEED_FILE:
+        with open(FAKE_QDRANT_SEED_FILE, encoding="utf-8") as f:
+            departments = json.load(f)
+    await client.seed(departments, fake_gemini)
+    return client
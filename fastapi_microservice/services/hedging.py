@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+# Configuration values.
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+# Cheaper, faster model the prompt is re-sent to when the primary is slow.
+LLM_HEDGE_MODEL = os.getenv("LLM_HEDGE_MODEL", "gemini-2.0-flash-lite-001")
+# The hedge fires once the primary has taken longer than this quantile of its recent latencies.
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", 0.95))
+# Delay used until enough latencies are observed, and the bounds of the computed delay.
+LLM_HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SECONDS", 4.0))
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", 0.5))
+LLM_HEDGE_MAX_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MAX_DELAY_SECONDS", 10.0))
+LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", 200))
+LLM_HEDGE_MIN_SAMPLES = 20
+
+logger = logging.getLogger("ai_pipeline.hedging")
+
+
+@dataclass
+class HedgeResult:
+    value: Any
+    model: str
+    hedged: bool
+
+
+class Hedger:
+    """Hedged requests: a second, faster model is raced against a slow primary.
+
+    The primary gets until the LLM_HEDGE_QUANTILE of its own recent latencies; after that
+    the same call goes to the hedge model, the first successful answer wins and the other
+    call is cancelled. Only the slowest few percent of calls are sent twice. A primary that
+    fails before the delay is not hedged: its error (a rate limit, an open circuit) goes to
+    the caller, whose fallbacks handle it without adding load upstream.
+    """
+
+    def __init__(self, enabled: bool = LLM_HEDGE_ENABLED, hedge_model: str = LLM_HEDGE_MODEL,
+                 quantile: float = LLM_HEDGE_QUANTILE, default_delay: float = LLM_HEDGE_DEFAULT_DELAY_SECONDS,
+                 min_delay: float = LLM_HEDGE_MIN_DELAY_SECONDS, max_delay: float = LLM_HEDGE_MAX_DELAY_SECONDS,
+                 window: int = LLM_HEDGE_WINDOW):
+        self.enabled = enabled
+        self.hedge_model = hedge_model
+        self.quantile = quantile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.window = window
+        self._latencies: Dict[str, Deque[float]] = {}
+
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def observe(self, model: str, seconds: float):
+        self._latencies.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def delay(self, model: str) -> float:
+        """Seconds the primary gets before the hedge fires."""
+        latencies = self._latencies.get(model)
+        if not latencies or len(latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return self.default_delay
+        ordered = sorted(latencies)
+        value = ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+        return min(self.max_delay, max(self.min_delay, value))
+
+    async def run(self, model: str, call: Callable[[str], Awaitable[Any]]) -> HedgeResult:
+        """Runs `call(model)`, hedged with `call(hedge_model)` when the primary is slow."""
+        self.calls += 1
+        if not self.enabled or not self.hedge_model or self.hedge_model == model:
+            return HedgeResult(await call(model), model, False)
+
+        started = time.monotonic()
+        primary = asyncio.ensure_future(call(model))
+        done, _ = await asyncio.wait({primary}, timeout=self.delay(model))
+        if done:
+            if primary.exception() is not None:
+                self.failures += 1
+                raise primary.exception()
+            self.observe(model, time.monotonic() - started)
+            return HedgeResult(primary.result(), model, False)
+
+        self.hedged += 1
+        logger.info(f"Primary model {model} slower than {self.delay(model):.2f}s; hedging with {self.hedge_model}.")
+        tasks = {asyncio.ensure_future(call(self.hedge_model)): self.hedge_model, primary: model}
+
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = tasks[task]
+                        if winner == model:
+                            self.observe(model, time.monotonic() - started)
+                        else:
+                            self.hedge_wins += 1
+                        return HedgeResult(task.result(), winner, True)
+        finally:
+            if not primary.done():
+                # Cancelled while slow: its latency was at least this long.
+                self.observe(model, time.monotonic() - started)
+            for task in tasks:
+                task.cancel()
+
+        # Both failed; the primary's error decides how the pipeline falls back.
+        self.failures += 1
+        raise primary.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "hedge_model": self.hedge_model,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.calls, 4) if self.calls else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures,
+            "delay_seconds": {model: round(self.delay(model), 3) for model in self._latencies},
+        }
+
+
+hedger = Hedger()
@@ -0,0 +1,151 @@
+import os
+import re
+import math
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from services.cache import normalize_text, strip_apostrophes
+from services.embedding_provider import point_text
+
+# Configuration values.
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+# Depth of each ranking fed into the fusion; the LLM still sees the top 3 fused candidates.
+HYBRID_RANK_DEPTH = int(os.getenv("HYBRID_RANK_DEPTH", 10))
+# Reciprocal-rank fusion constant: higher values flatten the advantage of the top ranks.
+RRF_K = int(os.getenv("RRF_K", 60))
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Tokens are cut to this prefix: a crude stemmer for Uzbek suffixes and Russian endings.
+STEM_LENGTH = 6
+
+logger = logging.getLogger("ai_pipeline.lexical_index")
+
+# Cyrillic (Uzbek and Russian) to Uzbek Latin, so both scripts share tokens.
+_CYRILLIC_TO_LATIN = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo", "ж": "j", "з": "z",
+    "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r",
+    "с": "s", "т": "t", "у": "u", "ф": "f", "х": "x", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh",
+    "ъ": "", "ы": "i", "ь": "", "э": "e", "ю": "yu", "я": "ya", "ў": "o", "қ": "q", "ғ": "g", "ҳ": "h",
+})
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    text = strip_apostrophes(normalize_text(text)).translate(_CYRILLIC_TO_LATIN)
+    return [token[:STEM_LENGTH] for token in _TOKEN_RE.findall(text) if len(token) > 1]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Any]], k: int = RRF_K) -> Dict[Any, float]:
+    """Fuses ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in."""
+    fused: Dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+class _Corpus:
+    """BM25 statistics of one language's documents."""
+
+    def __init__(self):
+        self.ids: List[Any] = []
+        self.payloads: List[Dict[str, Any]] = []
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.rows: Dict[Any, int] = {}
+
+    def add(self, point_id, payload: Dict[str, Any], tokens: List[str]):
+        if point_id in self.rows:
+            # Correction point IDs derive from their text, so only the payload can change.
+            self.payloads[self.rows[point_id]] = payload
+            return
+        doc = len(self.ids)
+        self.rows[point_id] = doc
+        self.ids.append(point_id)
+        self.payloads.append(payload)
+        self.lengths.append(len(tokens))
+        for token, tf in Counter(tokens).items():
+            self.postings.setdefault(token, []).append((doc, tf))
+
+    def search(self, tokens: List[str], limit: int) -> List[Tuple[Any, Dict[str, Any], float]]:
+        n = len(self.ids)
+        if not n:
+            return []
+        avg_length = sum(self.lengths) / n or 1.0
+        scores: Dict[int, float] = {}
+        for token in set(tokens):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf in postings:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / avg_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(self.ids[doc], self.payloads[doc], score) for doc, score in best]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class LexicalIndex:
+    """In-memory BM25 index over department names, descriptions and correction texts.
+
+    Built from the same points as the vector mirror, partitioned by language like it.
+    """
+
+    def __init__(self):
+        self._corpora: Dict[str, _Corpus] = {}
+        self._built = False
+        self.rebuilds = 0
+        self.searches = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._built and len(self) > 0
+
+    def __len__(self) -> int:
+        return sum(len(c) for c in self._corpora.values())
+
+    def _build(self, points: List[Tuple[Any, Dict[str, Any]]]) -> Dict[str, _Corpus]:
+        corpora: Dict[str, _Corpus] = {}
+        for point_id, payload in points:
+            language = payload.get("language") or ""
+            corpora.setdefault(language, _Corpus()).add(point_id, payload, tokenize(point_text(payload)))
+        return corpora
+
+    async def rebuild(self, points: List[Tuple[Any, Dict[str, Any]]]):
+        self._corpora = await asyncio.to_thread(self._build, points)
+        self._built = True
+        self.rebuilds += 1
+        logger.info(f"Lexical index rebuilt: {len(self)} documents.")
+
+    def add(self, point_id, payload: Dict[str, Any]):
+        """Adds one point, e.g. a new correction. Statistics update with it."""
+        language = payload.get("language") or ""
+        self._corpora.setdefault(language, _Corpus()).add(point_id, payload, tokenize(point_text(payload)))
+
+    def search(self, text: str, language: Optional[str] = None,
+               limit: int = HYBRID_RANK_DEPTH) -> List[Tuple[Any, Dict[str, Any], float]]:
+        """Returns (point_id, payload, bm25) best first, within `language` when it has documents."""
+        self.searches += 1
+        tokens = tokenize(text)
+        if language and self._corpora.get(language):
+            return self._corpora[language].search(tokens, limit)
+        results = [hit for corpus in self._corpora.values() for hit in corpus.search(tokens, limit)]
+        return sorted(results, key=lambda hit: hit[2], reverse=True)[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": HYBRID_SEARCH_ENABLED,
+            "ready": self.ready,
+            "documents": len(self),
+            "terms": sum(len(c.postings) for c in self._corpora.values()),
+            "rebuilds": self.rebuilds,
+            "searches": self.searches,
+        }
+
+
+lexical_index = LexicalIndex()
@@ -0,0 +1,121 @@
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger("ai_pipeline.metrics")
+
+# From in-process stages (lang detect, local search) up to slow LLM calls.
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram(
+    "ai_pipeline_stage_seconds", "Time spent in each pipeline stage.", ["stage"], buckets=LATENCY_BUCKETS
+)
+PIPELINE_SECONDS = Histogram(
+    "ai_pipeline_seconds", "End-to-end analysis time by outcome.", ["outcome"], buckets=LATENCY_BUCKETS
+)
+PIPELINE_OUTCOMES = Counter("ai_pipeline_outcomes", "Finished analyses by outcome.", ["outcome"])
+FALLBACKS = Counter("ai_pipeline_fallbacks", "Degraded paths taken by the pipeline.", ["kind"])
+ERRORS = Counter("ai_pipeline_errors", "Failed pipeline stages.", ["stage"])
+IN_FLIGHT = Gauge("ai_pipeline_in_flight", "Work currently inside a pipeline stage.", ["stage"])
+CIRCUIT_STATE = Gauge(
+    "ai_circuit_state", "Circuit breaker state per dependency: 0 closed, 1 half-open, 2 open.", ["dependency"]
+)
+CIRCUIT_TRANSITIONS = Counter("ai_circuit_transitions", "Circuit breaker state changes.", ["dependency", "state"])
+
+
+@dataclass
+class PipelineTrace:
+    """Stage timings and outcome of one analysis, for callers that need them per request."""
+    stages: Dict[str, float] = field(default_factory=dict)
+    outcome: Optional[str] = None
+    seconds: float = 0.0
+
+
+# Set by the replay harness around each analysis; the service leaves it unset.
+pipeline_trace: ContextVar[Optional[PipelineTrace]] = ContextVar("pipeline_trace", default=None)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Times a block into ai_pipeline_stage_seconds and counts it as in flight meanwhile."""
+    gauge = IN_FLIGHT.labels(stage)
+    gauge.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        gauge.dec()
+        trace = pipeline_trace.get()
+        if trace is not None:
+            trace.stages[stage] = trace.stages.get(stage, 0.0) + elapsed
+
+
+def record_outcome(outcome: str, seconds: float):
+    PIPELINE_OUTCOMES.labels(outcome).inc()
+    PIPELINE_SECONDS.labels(outcome).observe(seconds)
+    trace = pipeline_trace.get()
+    if trace is not None:
+        trace.outcome = outcome
+        trace.seconds = seconds
+
+
+class StatsCollector:
+    """Exposes the numeric fields of the subsystems' stats() dicts as `ai_<name>_<field>` gauges.
+
+    Nested dicts of numbers (histograms, per-reason counters) become one gauge with a `key` label.
+    Async sources are awaited by refresh() before each scrape, since collect() must be sync.
+    """
+
+    def __init__(self):
+        self._sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._async_sources: Dict[str, Callable[[], Awaitable[Dict[str, Any]]]] = {}
+        self._async_stats: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, name: str, stats_fn: Callable[[], Dict[str, Any]]):
+        self._sources[name] = stats_fn
+
+    def register_async(self, name: str, stats_fn: Callable[[], Awaitable[Dict[str, Any]]]):
+        self._async_sources[name] = stats_fn
+
+    async def refresh(self):
+        for name, stats_fn in self._async_sources.items():
+            try:
+                self._async_stats[name] = await stats_fn()
+            except Exception as e:
+                logger.warning(f"Stats source '{name}' failed: {e}")
+
+    def collect(self):
+        snapshots = dict(self._async_stats)
+        for name, stats_fn in self._sources.items():
+            try:
+                snapshots[name] = stats_fn()
+            except Exception as e:
+                logger.warning(f"Stats source '{name}' failed: {e}")
+
+        for name, stats in snapshots.items():
+            for field, value in stats.items():
+                metric_name = f"ai_{name}_{field}"
+                if isinstance(value, dict):
+                    family = GaugeMetricFamily(metric_name, f"{name} stats: {field}", labels=["key"])
+                    for key, item in value.items():
+                        if _is_number(item):
+                            family.add_metric([str(key)], float(item))
+                    yield family
+                elif _is_number(value):
+                    yield GaugeMetricFamily(metric_name, f"{name} stats: {field}", value=float(value))
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float))
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
@@ -0,0 +1,175 @@
+import os
+import re
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from services.cache import normalize_text, strip_apostrophes
+
+# Configuration values.
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "true").lower() == "true"
+# 1 - hamming distance / 64 between SimHash fingerprints; 0.95 allows 3 differing bits.
+NEAR_DUPLICATE_MIN_SIMILARITY = float(os.getenv("NEAR_DUPLICATE_MIN_SIMILARITY", 0.95))
+# Only recent decisions are reused: a burst of reports about one incident.
+NEAR_DUPLICATE_TTL_SECONDS = float(os.getenv("NEAR_DUPLICATE_TTL_SECONDS", 900))
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", 5000))
+
+FINGERPRINT_BITS = 64
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_BIT_SHIFTS = np.arange(FINGERPRINT_BITS, dtype=np.uint64)
+
+logger = logging.getLogger("ai_pipeline.near_duplicate")
+
+
+def _shingle_text(text: str) -> str:
+    # Apostrophe variants of Uzbek Latin (o', oʻ, o`) and other punctuation are dropped.
+    return _PUNCTUATION_RE.sub("", strip_apostrophes(normalize_text(text)))
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over character 3-grams and words."""
+    text = _shingle_text(text)
+    padded = f" {text} "
+    features = [padded[i:i + 3] for i in range(len(padded) - 2)] + text.split()
+    if not features:
+        return 0
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "little") for f in features],
+        dtype=np.uint64
+    )
+    bits = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).astype(np.int32)
+    totals = (bits * 2 - 1).sum(axis=0)
+    return int(sum(1 << i for i in range(FINGERPRINT_BITS) if totals[i] > 0))
+
+
+def similarity(a: int, b: int) -> float:
+    return 1 - bin(a ^ b).count("1") / FINGERPRINT_BITS
+
+
+@dataclass
+class NearDuplicateMatch:
+    message_uuid: str
+    similarity: float
+    decision: Dict[str, Any]
+
+
+class NearDuplicateIndex:
+    """Recent routing decisions indexed by SimHash fingerprint, with banded lookup.
+
+    With at most k differing bits allowed, splitting fingerprints into k + 1 bands guarantees
+    that a match shares at least one band exactly, so lookups only compare a few candidates.
+    """
+
+    def __init__(self, enabled: bool = NEAR_DUPLICATE_ENABLED, min_similarity: float = NEAR_DUPLICATE_MIN_SIMILARITY,
+                 ttl_seconds: float = NEAR_DUPLICATE_TTL_SECONDS, max_entries: int = NEAR_DUPLICATE_MAX_ENTRIES):
+        self.enabled = enabled
+        self.min_similarity = min_similarity
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_distance = int((1 - min_similarity) * FINGERPRINT_BITS + 1e-9)
+        self.bands = self.max_distance + 1
+        self.band_bits = FINGERPRINT_BITS // self.bands
+
+        # message_uuid -> (fingerprint, language, decision, created_at), oldest first.
+        self._entries: "OrderedDict[str, Tuple[int, str, Dict[str, Any], float]]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, int], Set[str]] = {}
+
+        self.lookups = 0
+        self.matches = 0
+        self.evictions = 0
+
+    def _band_keys(self, fingerprint: int, language: str) -> List[Tuple[str, int, int]]:
+        mask = (1 << self.band_bits) - 1
+        return [(language, band, (fingerprint >> (band * self.band_bits)) & mask) for band in range(self.bands)]
+
+    def _remove(self, message_uuid: str):
+        fingerprint, language, _, _ = self._entries.pop(message_uuid)
+        for key in self._band_keys(fingerprint, language):
+            bucket = self._buckets.get(key)
+            if bucket:
+                bucket.discard(message_uuid)
+                if not bucket:
+                    del self._buckets[key]
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._entries:
+            message_uuid, (_, _, _, created_at) = next(iter(self._entries.items()))
+            if created_at >= cutoff and len(self._entries) <= self.max_entries:
+                break
+            if created_at >= cutoff:
+                self.evictions += 1
+            self._remove(message_uuid)
+
+    def _nearest(self, fingerprint: int, language: str) -> Optional[Tuple[str, float]]:
+        candidates: Set[str] = set()
+        for key in self._band_keys(fingerprint, language):
+            candidates |= self._buckets.get(key, set())
+        best = None
+        for message_uuid in candidates:
+            score = similarity(fingerprint, self._entries[message_uuid][0])
+            if score >= self.min_similarity and (best is None or score > best[1]):
+                best = (message_uuid, score)
+        return best
+
+    def find(self, text: str, language: str, count: bool = True) -> Optional[NearDuplicateMatch]:
+        """Returns the decision of the most similar recent message, if it is similar enough."""
+        if not self.enabled:
+            return None
+        self._expire()
+        best = self._nearest(simhash(text), language)
+        if count:
+            self.lookups += 1
+            self.matches += best is not None
+        if best is None:
+            return None
+        message_uuid, score = best
+        return NearDuplicateMatch(message_uuid=message_uuid, similarity=score, decision=dict(self._entries[message_uuid][2]))
+
+    def add(self, text: str, language: str, message_uuid: str, decision: Dict[str, Any]):
+        if not self.enabled:
+            return
+        fingerprint = simhash(text)
+        if message_uuid in self._entries:
+            self._remove(message_uuid)
+        self._entries[message_uuid] = (fingerprint, language, decision, time.monotonic())
+        for key in self._band_keys(fingerprint, language):
+            self._buckets.setdefault(key, set()).add(message_uuid)
+        self._expire()
+
+    def invalidate_text(self, text: str) -> int:
+        """Drops every entry near `text` in any language, e.g. after a staff correction."""
+        fingerprint = simhash(text)
+        languages = {entry[1] for entry in self._entries.values()}
+        removed = 0
+        for language in languages:
+            while (best := self._nearest(fingerprint, language)) is not None:
+                self._remove(best[0])
+                removed += 1
+        return removed
+
+    def clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+
+    async def invalidate_all(self):
+        self.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "min_similarity": self.min_similarity,
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "match_rate": round(self.matches / self.lookups, 4) if self.lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+near_duplicate_index = NearDuplicateIndex()
@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import contextlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from services.metrics import stage_timer, ERRORS
+from services.circuit_breaker import CircuitOpenError
+
+# Configuration values.
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "true").lower() == "true"
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", str(Path(__file__).resolve().parent.parent / "data" / "outbox.sqlite3"))
+# Results per batched POST.
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 50))
+# Idle flusher wakes up this often to pick up due retries.
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", 1.0))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 12))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", 2.0))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", 300.0))
+# Claimed entries are invisible to other flushers for this long; longer than the HTTP timeout.
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", 30.0))
+
+logger = logging.getLogger("ai_pipeline.outbox")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    idempotency_key TEXT,
+    payload TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT,
+    UNIQUE (url, idempotency_key)
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+
+def _retryable(status_code: int) -> bool:
+    # 404: the message may not be committed on the Django side yet.
+    return status_code >= 500 or status_code in (404, 408, 429)
+
+
+class Outbox:
+    """Persistent outbox for webhooks to Django, delivered by a background flusher.
+
+    Entries are keyed by (url, message_uuid), so a resent result replaces the pending one.
+    Entries whose URL has a bulk endpoint are POSTed together; the rest go one by one.
+    Failed deliveries are retried with exponential backoff and parked as 'dead' after
+    OUTBOX_MAX_ATTEMPTS. While the optional circuit breaker is open, nothing is posted and
+    entries wait without spending attempts.
+    """
+
+    def __init__(self, http_client, path: str = OUTBOX_PATH, batch_routes: Optional[Dict[str, str]] = None,
+                 batch_size: int = OUTBOX_BATCH_SIZE, max_attempts: int = OUTBOX_MAX_ATTEMPTS, breaker=None):
+        self.http_client = http_client
+        self.breaker = breaker
+        self.path = path
+        # Maps a single-result path suffix to its bulk endpoint.
+        self.batch_routes = batch_routes or {}
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._initialized = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.dead = 0
+        self.posts = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._initialized = True
+        return conn
+
+    def _init_path(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+
+    # --- Blocking SQLite operations (run in a worker thread) ---
+
+    def _insert(self, url: str, key: Optional[str], payload: str):
+        now = time.time()
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute(
+                """
+                INSERT INTO outbox (url, idempotency_key, payload, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (url, idempotency_key) DO UPDATE SET
+                    payload = excluded.payload, version = version + 1, attempts = 0, status = 'pending',
+                    next_attempt_at = excluded.next_attempt_at, last_error = NULL
+                """,
+                (url, key, payload, now, now)
+            )
+
+    def _claim(self, limit: int) -> List[tuple]:
+        now = time.time()
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, url, idempotency_key, payload, version, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                [(now + OUTBOX_LEASE_SECONDS, row[0]) for row in rows]
+            )
+            conn.execute("COMMIT")
+        return rows
+
+    def _complete(self, rows: List[tuple]):
+        with contextlib.closing(self._connect()) as conn:
+            # A version bump means the entry was replaced while in flight; keep the newer payload.
+            conn.executemany("DELETE FROM outbox WHERE id = ? AND version = ?", [(row[0], row[4]) for row in rows])
+
+    def _fail(self, rows: List[tuple], error: str, permanent: bool = False) -> int:
+        now = time.time()
+        dead = 0
+        updates = []
+        for row in rows:
+            attempts = row[5] + 1
+            if permanent or attempts >= self.max_attempts:
+                dead += 1
+                updates.append(("dead", attempts, now, error, row[0], row[4]))
+            else:
+                backoff = min(OUTBOX_MAX_BACKOFF_SECONDS, OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1))
+                backoff *= random.uniform(0.8, 1.2)
+                updates.append(("pending", attempts, now + backoff, error, row[0], row[4]))
+        with contextlib.closing(self._connect()) as conn:
+            conn.executemany(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? "
+                "WHERE id = ? AND version = ?",
+                updates
+            )
+        return dead
+
+    def _counts(self) -> Dict[str, Any]:
+        with contextlib.closing(self._connect()) as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            oldest = conn.execute("SELECT MIN(created_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+        return {
+            "pending": counts.get("pending", 0),
+            "dead_entries": counts.get("dead", 0),
+            "oldest_pending_age_seconds": round(time.time() - oldest, 1) if oldest else 0.0,
+        }
+
+    # --- Async API ---
+
+    async def add(self, url: str, data: Dict[str, Any]):
+        """Persists one webhook; the flusher delivers it."""
+        if not self._initialized:
+            await asyncio.to_thread(self._init_path)
+        key = data.get("message_uuid")
+        await asyncio.to_thread(self._insert, url, str(key) if key else None, json.dumps(data))
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _batch_url(self, url: str) -> Optional[str]:
+        for single, bulk in self.batch_routes.items():
+            if url.endswith(single):
+                return url[:-len(single)] + bulk
+        return None
+
+    async def flush_once(self) -> int:
+        """Delivers due entries once; returns how many were claimed."""
+        if self.breaker and not self.breaker.available:
+            return 0
+        rows = await asyncio.to_thread(self._claim, self.batch_size * 4)
+        if not rows:
+            return 0
+
+        batches: Dict[str, List[tuple]] = {}
+        singles = []
+        for row in rows:
+            batch_url = self._batch_url(row[1])
+            if batch_url:
+                batches.setdefault(batch_url, []).append(row)
+            else:
+                singles.append(row)
+
+        # Rows left unposted when the circuit opens stay leased, then become due again.
+        for batch_url, batch_rows in batches.items():
+            for i in range(0, len(batch_rows), self.batch_size):
+                if not await self._post_batch(batch_url, batch_rows[i:i + self.batch_size]):
+                    return len(rows)
+        for row in singles:
+            if not await self._post_single(row):
+                break
+        return len(rows)
+
+    async def _post(self, url: str, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        if self.breaker and not self.breaker.allow():
+            raise CircuitOpenError(f"{self.breaker.name} circuit is open")
+        self.posts += 1
+        try:
+            with stage_timer("webhook"):
+                response = await self.http_client.post(url, json=body, headers=headers)
+        except asyncio.CancelledError:
+            if self.breaker:
+                self.breaker.record_cancelled()
+            raise
+        except Exception:
+            if self.breaker:
+                self.breaker.record_failure()
+            raise
+        if self.breaker:
+            # Only an unreachable or failing Django counts; 4xx answers come from a healthy server.
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        return response
+
+    async def _post_single(self, row: tuple) -> bool:
+        """Posts one entry; returns False when the circuit is open and delivery should pause."""
+        headers = {"Idempotency-Key": row[2]} if row[2] else None
+        try:
+            response = await self._post(row[1], json.loads(row[3]), headers)
+        except CircuitOpenError:
+            return False
+        except Exception as e:
+            await self._record_failure([row], f"connection: {e}")
+            return True
+        if 200 <= response.status_code < 300:
+            await self._record_success([row])
+        else:
+            await self._record_failure([row], f"HTTP {response.status_code}: {response.text[:200]}",
+                                       permanent=not _retryable(response.status_code))
+        return True
+
+    async def _post_batch(self, url: str, rows: List[tuple]) -> bool:
+        """Posts one batch; returns False when the circuit is open and delivery should pause."""
+        logger.info(f"Delivering {len(rows)} results to {url}")
+        try:
+            response = await self._post(url, {"results": [json.loads(row[3]) for row in rows]})
+        except CircuitOpenError:
+            return False
+        except Exception as e:
+            await self._record_failure(rows, f"connection: {e}")
+            return True
+        if not 200 <= response.status_code < 300:
+            await self._record_failure(rows, f"HTTP {response.status_code}: {response.text[:200]}",
+                                       permanent=not _retryable(response.status_code))
+            return True
+
+        # The bulk endpoint reports a status per result, in request order.
+        items = response.json().get("results", [])
+        done, retry, rejected = [], [], []
+        for row, item in zip(rows, items):
+            status_code = item.get("status_code", 200)
+            if 200 <= status_code < 300:
+                done.append(row)
+            elif _retryable(status_code):
+                retry.append(row)
+            else:
+                rejected.append(row)
+        # Results Django didn't answer for are retried.
+        retry.extend(rows[len(items):])
+        if done:
+            await self._record_success(done)
+        if retry:
+            await self._record_failure(retry, "rejected in batch (retryable)")
+        if rejected:
+            await self._record_failure(rejected, "rejected in batch", permanent=True)
+        return True
+
+    async def _record_success(self, rows: List[tuple]):
+        await asyncio.to_thread(self._complete, rows)
+        self.delivered += len(rows)
+
+    async def _record_failure(self, rows: List[tuple], error: str, permanent: bool = False):
+        logger.error(f"Webhook delivery of {len(rows)} entries failed: {error}")
+        ERRORS.labels("webhook").inc()
+        self.failed_attempts += len(rows)
+        dead = await asyncio.to_thread(self._fail, rows, error, permanent)
+        if dead:
+            self.dead += dead
+            logger.error(f"{dead} outbox entries exhausted their retries and were parked as dead.")
+
+    async def run(self):
+        """Flusher loop; sleeps until a new entry arrives or the poll interval passes."""
+        while True:
+            try:
+                claimed = await self.flush_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox flush failed: {e}")
+                claimed = 0
+            if claimed:
+                continue
+            self._wakeup.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_SECONDS)
+
+    async def start(self):
+        await asyncio.to_thread(self._init_path)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def stats(self) -> Dict[str, Any]:
+        if not self._initialized:
+            await asyncio.to_thread(self._init_path)
+        counts = await asyncio.to_thread(self._counts)
+        return {
+            "enabled": OUTBOX_ENABLED,
+            **counts,
+            "delivered": self.delivered,
+            "failed_attempts": self.failed_attempts,
+            "dead": self.dead,
+            "posts": self.posts,
+            "circuit": self.breaker.state if self.breaker else None,
+        }
@@ -0,0 +1,214 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:  # pragma: no cover - google-api-core ships with google-generativeai
+    google_exceptions = None
+
+# Configuration values.
+# Requests per minute allowed by the Gemini quota (0 disables the request bucket).
+GEMINI_GENERATE_RPM = float(os.getenv("GEMINI_GENERATE_RPM", 1000))
+GEMINI_EMBED_RPM = float(os.getenv("GEMINI_EMBED_RPM", 1500))
+# Tokens per minute for generation, debited from usage_metadata after each call (0 disables).
+GEMINI_GENERATE_TPM = float(os.getenv("GEMINI_GENERATE_TPM", 0))
+# Ceiling of the adaptive concurrency limit; the limit starts at half of it.
+GEMINI_GENERATE_MAX_CONCURRENCY = int(os.getenv("GEMINI_GENERATE_MAX_CONCURRENCY", 32))
+GEMINI_EMBED_MAX_CONCURRENCY = int(os.getenv("GEMINI_EMBED_MAX_CONCURRENCY", 8))
+# Rate-limited calls are retried this many times before the error reaches the caller.
+GEMINI_RATE_LIMIT_RETRIES = int(os.getenv("GEMINI_RATE_LIMIT_RETRIES", 3))
+GEMINI_BACKOFF_SECONDS = float(os.getenv("GEMINI_BACKOFF_SECONDS", 1.0))
+GEMINI_MAX_BACKOFF_SECONDS = float(os.getenv("GEMINI_MAX_BACKOFF_SECONDS", 30.0))
+
+# Multiplicative decrease applied to the concurrency limit on a 429.
+DECREASE_FACTOR = 0.5
+# Longest a waiter sleeps before re-checking, in case a wake-up is missed.
+MAX_WAIT_SLICE_SECONDS = 1.0
+
+logger = logging.getLogger("ai_pipeline.rate_limiter")
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Recognizes quota errors by type, falling back to the message for wrapped errors."""
+    if google_exceptions is not None and isinstance(
+        error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+    ):
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+
+class AdaptiveLimiter:
+    """Token bucket plus AIMD concurrency limit in front of one Gemini API.
+
+    Callers queue for a slot instead of failing. A 429 halves the concurrency limit and pauses
+    new calls for a growing backoff; every success raises the limit by 1/limit (about +1 per
+    round of calls), so throughput settles just under the quota.
+    """
+
+    def __init__(self, name: str, rpm: float, max_concurrency: int, min_concurrency: int = 1,
+                 tpm: float = 0, max_retries: int = GEMINI_RATE_LIMIT_RETRIES,
+                 backoff_seconds: float = GEMINI_BACKOFF_SECONDS,
+                 max_backoff_seconds: float = GEMINI_MAX_BACKOFF_SECONDS):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = max(min_concurrency, max_concurrency / 2)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        self._requests = rpm
+        self._tokens = tpm
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._consecutive_throttles = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+        self.prompt_tokens = 0
+        self.total_tokens = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def _delay(self) -> Optional[float]:
+        """Seconds until a call may start, 0 if it may start now, None if it must wait for a release."""
+        self._refill()
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.rpm and self._requests < 1:
+            return (1 - self._requests) * 60 / self.rpm
+        if self.tpm and self._tokens <= 0:
+            return -self._tokens * 60 / self.tpm + 0.001
+        if self.in_flight >= int(self.limit):
+            return None
+        return 0.0
+
+    async def acquire(self):
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            while True:
+                delay = self._delay()
+                if delay == 0.0:
+                    if self.rpm:
+                        self._requests -= 1
+                    self.in_flight += 1
+                    return
+                future = asyncio.get_running_loop().create_future()
+                self._waiters.append(future)
+                try:
+                    await asyncio.wait_for(future, min(delay or MAX_WAIT_SLICE_SECONDS, MAX_WAIT_SLICE_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    if future in self._waiters:
+                        self._waiters.remove(future)
+        finally:
+            self.waiting -= 1
+            self.wait_seconds += time.monotonic() - started
+
+    def release(self, throttled: bool = False, cancelled: bool = False):
+        self.in_flight -= 1
+        if cancelled:
+            # A cancelled call (e.g. the losing side of a hedge) says nothing about the quota.
+            self._wake()
+            return
+        now = time.monotonic()
+        if throttled:
+            self.throttled += 1
+            # Calls already in flight when the quota ran out fail together; that is one signal.
+            if now >= self._paused_until:
+                self._consecutive_throttles += 1
+                self.limit = max(self.min_concurrency, self.limit * DECREASE_FACTOR)
+                backoff = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (self._consecutive_throttles - 1))
+                self._paused_until = now + backoff
+                logger.warning(f"{self.name}: rate limited, concurrency limit {self.limit:.1f}, pausing {backoff:.1f}s.")
+        else:
+            self._consecutive_throttles = 0
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+
+    def record_usage(self, prompt_tokens: int, total_tokens: int):
+        """Accounts the tokens a finished call reported; debits the TPM bucket."""
+        self.prompt_tokens += prompt_tokens
+        self.total_tokens += total_tokens
+        if self.tpm:
+            self._tokens -= total_tokens
+
+    async def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs an API call under the limiter, retrying rate-limited attempts.
+
+        Coroutine functions are awaited; blocking functions run in a worker thread.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire()
+            self.calls += 1
+            try:
+                if asyncio.iscoroutinefunction(fn):
+                    result = await fn(*args, **kwargs)
+                else:
+                    result = await asyncio.to_thread(fn, *args, **kwargs)
+            except asyncio.CancelledError:
+                self.release(cancelled=True)
+                raise
+            except Exception as e:
+                throttled = is_rate_limit_error(e)
+                self.release(throttled=throttled)
+                if not throttled or attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                continue
+            self.release()
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "concurrency_limit": round(self.limit, 2),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rpm": self.rpm,
+            "requests_available": round(self._requests, 1) if self.rpm else None,
+            "tpm": self.tpm,
+            "tokens_available": round(self._tokens, 1) if self.tpm else None,
+            "paused_seconds": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "avg_wait_ms": round(self.wait_seconds / self.calls * 1000, 2) if self.calls else 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "total_tokens": self.total_tokens,
+        }
+
+
+generate_limiter = AdaptiveLimiter("generate", GEMINI_GENERATE_RPM, GEMINI_GENERATE_MAX_CONCURRENCY,
+                                   tpm=GEMINI_GENERATE_TPM)
+embed_limiter = AdaptiveLimiter("embed", GEMINI_EMBED_RPM, GEMINI_EMBED_MAX_CONCURRENCY)
@@ -0,0 +1,49 @@
+import os
+import time
+import logging
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+# Configuration values.
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+# DB 0 is Celery, DB 1 is the Django cache.
+REDIS_DB = int(os.getenv("REDIS_DB", 2))
+REDIS_URL = os.getenv("REDIS_URL", f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}")
+# Seconds to wait before reconnecting after Redis was found unreachable.
+REDIS_RETRY_SECONDS = float(os.getenv("REDIS_RETRY_SECONDS", 30))
+
+logger = logging.getLogger("ai_pipeline.redis")
+
+_client: Optional[aioredis.Redis] = None
+_down_until = 0.0
+
+
+async def get_redis() -> Optional[aioredis.Redis]:
+    """Returns the shared Redis client, or None while Redis is unreachable."""
+    global _client, _down_until
+
+    if _client is not None:
+        return _client
+    if time.monotonic() < _down_until:
+        return None
+
+    try:
+        client = aioredis.from_url(REDIS_URL, socket_connect_timeout=1.0, socket_timeout=2.0)
+        await client.ping()
+        _client = client
+        logger.info(f"✅ SUCCESS: Connected to Redis at {REDIS_URL}")
+        return _client
+    except Exception as e:
+        logger.warning(f"⚠️ Redis unavailable at {REDIS_URL}: {e}. Retrying in {REDIS_RETRY_SECONDS:.0f}s.")
+        _down_until = time.monotonic() + REDIS_RETRY_SECONDS
+        return None
+
+
+def mark_redis_down(error: Exception):
+    """Drops the shared client after a failed command so callers degrade to local state."""
+    global _client, _down_until
+    logger.warning(f"⚠️ Redis command failed: {error}. Falling back to local state.")
+    _client = None
+    _down_until = time.monotonic() + REDIS_RETRY_SECONDS
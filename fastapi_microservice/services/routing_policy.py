@@ -0,0 +1,91 @@
+import os
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from api.v1.models import Candidate
+
+# Configuration values.
+# Off by default: enable once the thresholds are tuned against the bypass metrics.
+ROUTING_BYPASS_ENABLED = os.getenv("ROUTING_BYPASS_ENABLED", "false").lower() == "true"
+# Minimum cosine score of the top candidate.
+ROUTING_BYPASS_MIN_SCORE = float(os.getenv("ROUTING_BYPASS_MIN_SCORE", 0.80))
+# Minimum lead of the top candidate over the best candidate of any other department.
+ROUTING_BYPASS_MIN_MARGIN = float(os.getenv("ROUTING_BYPASS_MIN_MARGIN", 0.08))
+# Staff corrections among the candidates that must point at the same department.
+ROUTING_BYPASS_MIN_CORRECTION_VOTES = int(os.getenv("ROUTING_BYPASS_MIN_CORRECTION_VOTES", 0))
+
+logger = logging.getLogger("ai_pipeline.routing_policy")
+
+
+@dataclass
+class BypassDecision:
+    department_id: str
+    name: str
+    score: float
+    margin: float
+    correction_votes: int
+
+    @property
+    def reason(self) -> str:
+        return (
+            f"Routed by vector search without LLM: top score {self.score:.2%}, "
+            f"margin {self.margin:.2%} over the next department, {self.correction_votes} agreeing corrections."
+        )
+
+
+class RoutingPolicy:
+    """Decides when the top vector candidate dominates enough to skip the LLM rerank."""
+
+    def __init__(self, enabled: bool = ROUTING_BYPASS_ENABLED, min_score: float = ROUTING_BYPASS_MIN_SCORE,
+                 min_margin: float = ROUTING_BYPASS_MIN_MARGIN,
+                 min_correction_votes: int = ROUTING_BYPASS_MIN_CORRECTION_VOTES):
+        self.enabled = enabled
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.min_correction_votes = min_correction_votes
+        self.evaluated = 0
+        self.bypassed = 0
+        self.rejections = {"low_score": 0, "low_margin": 0, "no_correction_agreement": 0}
+
+    def decide(self, candidates: List[Candidate]) -> Optional[BypassDecision]:
+        if not self.enabled or not candidates:
+            return None
+        self.evaluated += 1
+
+        top = max(candidates, key=lambda c: c.score)
+        if top.score < self.min_score:
+            self.rejections["low_score"] += 1
+            return None
+
+        # Several points (UZ/RU descriptions, corrections) can belong to one department.
+        runner_up = max((c.score for c in candidates if c.id != top.id), default=0.0)
+        margin = top.score - runner_up
+        if margin < self.min_margin:
+            self.rejections["low_margin"] += 1
+            return None
+
+        votes = sum(1 for c in candidates if c.is_correction and c.id == top.id)
+        if votes < self.min_correction_votes:
+            self.rejections["no_correction_agreement"] += 1
+            return None
+
+        self.bypassed += 1
+        # Correction points are named "User Correction"; prefer a department's own name.
+        name = next((c.name for c in candidates if c.id == top.id and not c.is_correction), top.name)
+        return BypassDecision(department_id=top.id, name=name, score=top.score, margin=margin, correction_votes=votes)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "min_score": self.min_score,
+            "min_margin": self.min_margin,
+            "min_correction_votes": self.min_correction_votes,
+            "evaluated": self.evaluated,
+            "bypassed": self.bypassed,
+            "bypass_rate": round(self.bypassed / self.evaluated, 4) if self.evaluated else 0.0,
+            "rejections": dict(self.rejections),
+        }
+
+
+routing_policy = RoutingPolicy()
@@ -0,0 +1,283 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from qdrant_client.models import ScoredPoint
+
+# Configuration values.
+VECTOR_INDEX_ENABLED = os.getenv("VECTOR_INDEX_ENABLED", "true").lower() == "true"
+# How often Qdrant is polled for a changed point count or alias target.
+VECTOR_INDEX_POLL_SECONDS = float(os.getenv("VECTOR_INDEX_POLL_SECONDS", 30))
+# A full reload also happens after this long, to pick up re-embedded descriptions.
+VECTOR_INDEX_MAX_AGE_SECONDS = float(os.getenv("VECTOR_INDEX_MAX_AGE_SECONDS", 600))
+SCROLL_PAGE_SIZE = 256
+
+logger = logging.getLogger("ai_pipeline.vector_index")
+
+
+def _normalize(vector) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+class _Partition:
+    """Row-normalized float32 matrix of one language's points."""
+
+    def __init__(self):
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self.ids: List[Any] = []
+        self.payloads: List[Dict[str, Any]] = []
+        self.rows: Dict[Any, int] = {}
+
+    def upsert(self, point_id, vector: np.ndarray, payload: Dict[str, Any]):
+        row = self.rows.get(point_id)
+        if row is not None:
+            self.matrix[row] = vector
+            self.payloads[row] = payload
+            return
+        if self.matrix.size == 0:
+            self.matrix = vector.reshape(1, -1).copy()
+        else:
+            self.matrix = np.vstack([self.matrix, vector])
+        self.rows[point_id] = len(self.ids)
+        self.ids.append(point_id)
+        self.payloads.append(payload)
+
+    def remove(self, point_id):
+        row = self.rows.pop(point_id, None)
+        if row is None:
+            return
+        self.matrix = np.delete(self.matrix, row, axis=0)
+        del self.ids[row]
+        del self.payloads[row]
+        self.rows = {pid: i for i, pid in enumerate(self.ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class LocalVectorIndex:
+    """In-process mirror of a Qdrant collection answering top-k cosine queries with one matmul.
+
+    Qdrant stays the source of truth: the mirror is loaded from it, patched on local
+    upserts and reloaded when a poll notices the collection changed: a different point
+    count, or the alias pointing at another collection (a blue/green re-index can keep
+    the count).
+    """
+
+    def __init__(self, collection_name: str = "departments"):
+        self.collection_name = collection_name
+        self._partitions: Dict[str, _Partition] = {}
+        self._languages: Dict[Any, str] = {}
+        # Qdrant point count at the last load, compared on every poll.
+        self.version: Optional[int] = None
+        # Collection behind the `collection_name` alias at the last load, compared on every poll.
+        self.target: Optional[str] = None
+        # Bumped on every full reload.
+        self.generation = 0
+        # Digest of the department (non-correction) points; a change means the departments were re-indexed.
+        self.fingerprint: Optional[str] = None
+        self._reindex_listeners: List[Callable[[], Awaitable[None]]] = []
+        self._load_listeners: List[Callable[[], Awaitable[None]]] = []
+        self.loaded_at = 0.0
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.refresh_errors = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.version is not None and len(self) > 0
+
+    def __len__(self) -> int:
+        return sum(len(p) for p in self._partitions.values())
+
+    def on_reindex(self, listener: Callable[[], Awaitable[None]]):
+        """Registers a coroutine called when a reload finds re-indexed department points."""
+        self._reindex_listeners.append(listener)
+
+    def on_load(self, listener: Callable[[], Awaitable[None]]):
+        """Registers a coroutine called after every full load."""
+        self._load_listeners.append(listener)
+
+    def points(self) -> List[Tuple[Any, Dict[str, Any]]]:
+        """Returns (id, payload) of every mirrored point."""
+        return [
+            (point_id, payload)
+            for partition in self._partitions.values()
+            for point_id, payload in zip(partition.ids, partition.payloads)
+        ]
+
+    def entries(self) -> List[Tuple[Any, np.ndarray, Dict[str, Any]]]:
+        """Returns (id, normalized vector, payload) of every mirrored point."""
+        return [
+            (point_id, partition.matrix[row], payload)
+            for partition in self._partitions.values()
+            for row, (point_id, payload) in enumerate(zip(partition.ids, partition.payloads))
+        ]
+
+    def upsert(self, point_id, vector, payload: Dict[str, Any]):
+        language = payload.get("language") or ""
+        old_language = self._languages.get(point_id)
+        if old_language is not None and old_language != language:
+            self._partitions[old_language].remove(point_id)
+        self._partitions.setdefault(language, _Partition()).upsert(point_id, _normalize(vector), payload)
+        self._languages[point_id] = language
+
+    def remove(self, point_id):
+        language = self._languages.pop(point_id, None)
+        if language is not None:
+            self._partitions[language].remove(point_id)
+
+    def search(self, vector, language: Optional[str] = None, limit: int = 3) -> List[ScoredPoint]:
+        """Returns up to `limit` nearest points, restricted to `language` when it has any points."""
+        return self.search_many([vector], [language], limit)[0]
+
+    def search_many(self, vectors, languages: List[Optional[str]], limit: int = 3) -> List[List[ScoredPoint]]:
+        """Batched search: all queries against a partition are scored with one matmul."""
+        started = time.perf_counter()
+        queries = np.stack([_normalize(v) for v in vectors])
+
+        # Queries are grouped by the partitions they search.
+        groups: Dict[Optional[str], List[int]] = {}
+        for row, language in enumerate(languages):
+            key = language if language and self._partitions.get(language) else None
+            groups.setdefault(key, []).append(row)
+
+        scored: List[list] = [[] for _ in vectors]
+        for key, rows in groups.items():
+            if key is not None:
+                partitions = [self._partitions[key]]
+            else:
+                partitions = [p for p in self._partitions.values() if len(p)]
+            for partition in partitions:
+                scores = queries[rows] @ partition.matrix.T
+                k = min(limit, len(partition))
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                for i, row in enumerate(rows):
+                    scored[row].extend(
+                        (float(scores[i, j]), partition.ids[j], partition.payloads[j]) for j in top[i]
+                    )
+
+        results = []
+        for items in scored:
+            items.sort(key=lambda item: item[0], reverse=True)
+            results.append([
+                ScoredPoint(id=point_id, version=0, score=score, payload=payload)
+                for score, point_id, payload in items[:limit]
+            ])
+
+        self.searches += len(vectors)
+        self.search_seconds += time.perf_counter() - started
+        return results
+
+    async def resolve(self, client) -> str:
+        """Returns the collection the `collection_name` alias points at, or the name itself without an alias."""
+        for alias in (await client.get_aliases()).aliases:
+            if alias.alias_name == self.collection_name:
+                return alias.collection_name
+        return self.collection_name
+
+    async def load(self, client):
+        """Replaces the mirror with a full scroll of the Qdrant collection."""
+        started = time.perf_counter()
+        # Scrolls the resolved collection, so an alias switch mid-load can't mix two versions.
+        target = await self.resolve(client)
+        collection_info = await client.get_collection(collection_name=target)
+
+        partitions: Dict[str, _Partition] = {}
+        languages: Dict[Any, str] = {}
+        digest = hashlib.sha256()
+        offset = None
+        while True:
+            points, offset = await client.scroll(
+                collection_name=target,
+                limit=SCROLL_PAGE_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            )
+            for point in points:
+                if not isinstance(point.vector, list):
+                    continue
+                payload = point.payload or {}
+                language = payload.get("language") or ""
+                vector = _normalize(point.vector)
+                partitions.setdefault(language, _Partition()).upsert(point.id, vector, payload)
+                languages[point.id] = language
+                if not payload.get("is_correction"):
+                    digest.update(f"{point.id}:{payload.get('department_id')}:{payload.get('description')}".encode("utf-8"))
+                    digest.update(vector.tobytes())
+            if offset is None:
+                break
+
+        # Swaps in the new snapshot at once; searches never see a half-loaded index.
+        self._partitions = partitions
+        self._languages = languages
+        self.version = collection_info.points_count
+        self.target = target
+        self.generation += 1
+        self.loaded_at = time.monotonic()
+        sizes = {lang or "?": len(p) for lang, p in partitions.items()}
+        logger.info(f"Local vector index loaded {len(self)} points {sizes} in {(time.perf_counter() - started) * 1000:.1f}ms.")
+
+        # Scroll order is by point ID, so the digest is stable across reloads.
+        fingerprint = digest.hexdigest()
+        reindexed = self.fingerprint is not None and fingerprint != self.fingerprint
+        self.fingerprint = fingerprint
+        listeners = list(self._load_listeners)
+        if reindexed:
+            logger.info("Local vector index: department points changed since the last load (re-indexed).")
+            listeners.extend(self._reindex_listeners)
+        for listener in listeners:
+            try:
+                await listener()
+            except Exception as e:
+                logger.error(f"Vector index listener failed: {e}")
+
+    async def refresh_if_stale(self, client) -> bool:
+        """Reloads when the alias target or Qdrant's point count changed, or the snapshot is too old."""
+        target = await self.resolve(client)
+        collection_info = await client.get_collection(collection_name=target)
+        too_old = time.monotonic() - self.loaded_at > VECTOR_INDEX_MAX_AGE_SECONDS
+        if target == self.target and collection_info.points_count == self.version and not too_old:
+            return False
+        await self.load(client)
+        return True
+
+    async def poll_forever(self, client, interval: float = VECTOR_INDEX_POLL_SECONDS):
+        """Background task keeping the mirror in sync; a Qdrant blip keeps the last snapshot."""
+        while True:
+            try:
+                if self.version is None:
+                    await self.load(client)
+                else:
+                    await self.refresh_if_stale(client)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.warning(f"Local vector index refresh failed, serving last snapshot: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": VECTOR_INDEX_ENABLED,
+            "ready": self.ready,
+            "points": len(self),
+            "languages": {lang or "?": len(p) for lang, p in self._partitions.items()},
+            "qdrant_points_count": self.version,
+            "qdrant_collection": self.target,
+            "generation": self.generation,
+            "age_seconds": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at else None,
+            "searches": self.searches,
+            "avg_search_us": round(self.search_seconds / self.searches * 1e6, 1) if self.searches else 0.0,
+            "refresh_errors": self.refresh_errors,
+        }
+
+
+vector_index = LocalVectorIndex("departments")
@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from redis.exceptions import ResponseError
+
+from services.redis_client import get_redis, mark_redis_down
+
+# Configuration values.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", 8))
+# /analyze answers 429 once this many analyses are waiting or running.
+ANALYSIS_QUEUE_MAX_DEPTH = int(os.getenv("ANALYSIS_QUEUE_MAX_DEPTH", 1000))
+ANALYSIS_QUEUE_MAX_RETRIES = int(os.getenv("ANALYSIS_QUEUE_MAX_RETRIES", 3))
+# Entries delivered to a consumer that stayed silent this long are treated as crashed runs.
+# A consumer renews the claim on its running entries, so slow runs aren't taken over.
+ANALYSIS_QUEUE_CLAIM_IDLE_MS = int(os.getenv("ANALYSIS_QUEUE_CLAIM_IDLE_MS", 120000))
+# Without Redis, work is kept in an in-process queue (not durable) instead of being refused.
+ANALYSIS_QUEUE_LOCAL_FALLBACK = os.getenv("ANALYSIS_QUEUE_LOCAL_FALLBACK", "true").lower() == "true"
+
+CONSUMER_NAME = f"{socket.gethostname()}-{os.getpid()}"
+
+logger = logging.getLogger("ai_pipeline.work_queue")
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class QueueFull(Exception):
+    """Raised when the queue depth is at its limit."""
+
+
+class QueueUnavailable(Exception):
+    """Raised when no queue backend can accept work."""
+
+
+class WorkQueue:
+    """Bounded work queue on a Redis Stream consumer group, drained by an asyncio worker pool.
+
+    Every replica joins the same consumer group, so several FastAPI processes share
+    one queue. Entries are acknowledged only after the handler finished; entries left
+    pending by a crashed process are claimed again after `claim_idle_ms`. While a
+    handler runs, its entry's idle time is reset (XCLAIM JUSTID) every third of that.
+    """
+
+    def __init__(self, stream: str, handler: Handler, workers: int = ANALYSIS_WORKERS,
+                 max_depth: int = ANALYSIS_QUEUE_MAX_DEPTH, max_retries: int = ANALYSIS_QUEUE_MAX_RETRIES,
+                 claim_idle_ms: int = ANALYSIS_QUEUE_CLAIM_IDLE_MS):
+        self.stream = stream
+        self.group = f"{stream}:workers"
+        self.dead_letter_stream = f"{stream}:dead"
+        self.handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_retries = max_retries
+        self.claim_idle_ms = claim_idle_ms
+
+        self._local: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._group_ready = False
+
+        self.in_flight = 0
+        self.enqueued = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.reclaimed = 0
+        self.claims_renewed = 0
+        self.dead_lettered = 0
+
+    async def enqueue(self, payload: Dict[str, Any]) -> str:
+        depth = await self.depth()
+        if depth >= self.max_depth:
+            self.rejected += 1
+            raise QueueFull(f"Analysis queue is full ({depth} pending).")
+
+        entry_id = await self._add(payload, attempts=0)
+        self.enqueued += 1
+        return entry_id
+
+    async def _add(self, payload: Dict[str, Any], attempts: int) -> str:
+        fields = {"payload": json.dumps(payload), "attempts": attempts, "enqueued_at": time.time()}
+        client = await get_redis()
+        if client is not None:
+            try:
+                entry_id = await client.xadd(self.stream, fields)
+                return entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+            except Exception as e:
+                mark_redis_down(e)
+
+        if not ANALYSIS_QUEUE_LOCAL_FALLBACK:
+            raise QueueUnavailable("Redis is unavailable and the local fallback is disabled.")
+        self._local.put_nowait(fields)
+        return f"local-{self.enqueued}"
+
+    async def depth(self) -> int:
+        depth = self._local.qsize()
+        client = await get_redis()
+        if client is not None:
+            try:
+                # Acknowledged entries are deleted, so the stream length is waiting plus running work.
+                depth += await client.xlen(self.stream)
+            except Exception as e:
+                mark_redis_down(e)
+        return depth
+
+    async def oldest_age_seconds(self) -> Optional[float]:
+        client = await get_redis()
+        if client is not None:
+            try:
+                oldest = await client.xrange(self.stream, count=1)
+                if oldest:
+                    entry_id = oldest[0][0]
+                    entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+                    return round(time.time() - int(entry_id.split("-")[0]) / 1000, 3)
+            except Exception as e:
+                mark_redis_down(e)
+        if not self._local.empty():
+            return round(time.time() - float(self._local._queue[0]["enqueued_at"]), 3)
+        return None
+
+    async def start(self):
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+        self._tasks.append(asyncio.create_task(self._reclaimer()))
+        logger.info(f"Work queue '{self.stream}' started with {self.workers} workers as consumer {CONSUMER_NAME}.")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if not self._local.empty():
+            logger.warning(f"Work queue '{self.stream}' stopped with {self._local.qsize()} local entries unprocessed.")
+
+    async def _ensure_group(self, client):
+        if self._group_ready:
+            return
+        try:
+            await client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    async def _worker(self, number: int):
+        while True:
+            try:
+                if not self._local.empty():
+                    await self._run(None, self._local.get_nowait())
+                    continue
+
+                client = await get_redis()
+                if client is None:
+                    try:
+                        fields = await asyncio.wait_for(self._local.get(), timeout=1.0)
+                    except asyncio.TimeoutError:
+                        continue
+                    await self._run(None, fields)
+                    continue
+
+                await self._ensure_group(client)
+                response = await client.xreadgroup(self.group, CONSUMER_NAME, {self.stream: ">"}, count=1, block=1000)
+                for _, entries in response or []:
+                    for entry_id, fields in entries:
+                        await self._run(entry_id, fields)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Work queue worker {number} error: {e}")
+                self._group_ready = False
+                mark_redis_down(e)
+                await asyncio.sleep(1.0)
+
+    async def _reclaimer(self):
+        """Claims entries left pending by crashed consumers and runs them again."""
+        while True:
+            await asyncio.sleep(self.claim_idle_ms / 1000 / 2)
+            client = await get_redis()
+            if client is None:
+                continue
+            try:
+                await self._ensure_group(client)
+                pending = await client.xpending_range(
+                    self.stream, self.group, min="-", max="+", count=50, idle=self.claim_idle_ms
+                )
+                for entry in pending:
+                    claimed = await client.xclaim(
+                        self.stream, self.group, CONSUMER_NAME, self.claim_idle_ms, [entry["message_id"]]
+                    )
+                    for entry_id, fields in claimed:
+                        if not fields:
+                            continue
+                        self.reclaimed += 1
+                        logger.warning(f"Reclaimed stalled entry {entry_id} (delivered {entry['times_delivered']} times).")
+                        if entry["times_delivered"] > self.max_retries:
+                            await self._finish(entry_id, fields, dead=True)
+                        else:
+                            await self._run(entry_id, fields)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Work queue reclaimer error: {e}")
+
+    async def _keep_claimed(self, entry_id):
+        """Resets a running entry's idle time, so the reclaimer doesn't hand it to another consumer."""
+        while True:
+            await asyncio.sleep(self.claim_idle_ms / 1000 / 3)
+            client = await get_redis()
+            if client is None:
+                continue
+            try:
+                # JUSTID leaves the delivery count alone, so renewals don't use up retries.
+                await client.xclaim(self.stream, self.group, CONSUMER_NAME, 0, [entry_id], justid=True)
+                self.claims_renewed += 1
+            except Exception as e:
+                logger.warning(f"Work queue could not renew the claim on {_text(entry_id)}: {e}")
+
+    async def _run(self, entry_id, fields: Dict):
+        fields = {_text(k): _text(v) for k, v in fields.items()}
+        payload = json.loads(fields["payload"])
+        self.in_flight += 1
+        heartbeat = asyncio.create_task(self._keep_claimed(entry_id)) if entry_id is not None else None
+        try:
+            await self.handler(payload)
+            self.processed += 1
+            await self._finish(entry_id, fields)
+        except Exception as e:
+            self.failed += 1
+            attempts = int(fields.get("attempts", 0)) + 1
+            logger.error(f"Work queue handler failed (attempt {attempts}/{self.max_retries}): {e}")
+            if attempts >= self.max_retries:
+                await self._finish(entry_id, fields, dead=True)
+            else:
+                self.retried += 1
+                await self._add(payload, attempts=attempts)
+                await self._finish(entry_id, fields)
+        finally:
+            if heartbeat:
+                heartbeat.cancel()
+            self.in_flight -= 1
+
+    async def _finish(self, entry_id, fields: Dict, dead: bool = False):
+        """Acknowledges an entry, moving it to the dead-letter stream when it ran out of retries."""
+        if dead:
+            self.dead_lettered += 1
+            logger.error(f"Work queue entry gave up after {self.max_retries} attempts: {fields.get('payload', '')[:200]}")
+        if entry_id is None:
+            return
+        client = await get_redis()
+        if client is None:
+            return
+        try:
+            if dead:
+                await client.xadd(self.dead_letter_stream, fields)
+            await client.xack(self.stream, self.group, entry_id)
+            await client.xdel(self.stream, entry_id)
+        except Exception as e:
+            mark_redis_down(e)
+
+    async def stats(self) -> Dict[str, Any]:
+        client = await get_redis()
+        return {
+            "backend": "redis" if client is not None else "local",
+            "depth": await self.depth(),
+            "max_depth": self.max_depth,
+            "oldest_age_seconds": await self.oldest_age_seconds(),
+            "workers": self.workers,
+            "running": bool(self._tasks),
+            "in_flight": self.in_flight,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "reclaimed": self.reclaimed,
+            "claims_renewed": self.claims_renewed,
+            "dead_lettered": self.dead_lettered,
+        }
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
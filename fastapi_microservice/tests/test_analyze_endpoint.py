@@ -82,7 +82,7 @@ class TestAnalyzePipeline:
     
     @pytest.mark.asyncio
     @patch('services.ai_pipeline.send_webhook')
-    @patch('services.ai_pipeline.qdrant_client')
+    @patch('services.ai_pipeline.qdrant_client', new_callable=AsyncMock)
     @patch('services.ai_pipeline.async_embed')
     @patch('services.ai_pipeline.async_generate')
     async def test_pipeline_injection_detection(self, mock_generate, mock_embed, 
@@ -106,7 +106,7 @@ class TestAnalyzePipeline:
     
     @pytest.mark.asyncio
     @patch('services.ai_pipeline.send_webhook')
-    @patch('services.ai_pipeline.qdrant_client')
+    @patch('services.ai_pipeline.qdrant_client', new_callable=AsyncMock)
     @patch('services.ai_pipeline.async_embed')
     @patch('services.ai_pipeline.async_generate')
     async def test_pipeline_full_flow(self, mock_generate, mock_embed, 
@@ -152,6 +152,28 @@ class TestAnalyzePipeline:
         assert mock_generate.called
         assert mock_webhook.called
 
+    @pytest.mark.asyncio
+    @patch('services.ai_pipeline.qdrant_client', new_callable=AsyncMock)
+    async def test_qdrant_search_is_one_projected_query(self, mock_qdrant):
+        """Test that a Qdrant search is a single filtered query fetching only candidate fields."""
+        from services import ai_pipeline
+
+        mock_point = MagicMock()
+        mock_point.score = 0.9
+        mock_point.payload = {'department_id': '123', 'name': 'Test Department', 'description': 'Test description'}
+        mock_qdrant.query_points.return_value.points = [mock_point]
+
+        with patch('services.ai_pipeline.VECTOR_INDEX_ENABLED', False):
+            candidates = await ai_pipeline.search_candidates([0.1] * 768, "uz")
+
+        assert [c.id for c in candidates] == ["123"]
+        mock_qdrant.query_points.assert_called_once()
+        kwargs = mock_qdrant.query_points.call_args.kwargs
+        assert kwargs["with_payload"] == ai_pipeline.CANDIDATE_PAYLOAD_FIELDS
+        assert kwargs["query_filter"].must[0].key == "language"
+        assert not mock_qdrant.get_collection.called
+        assert not mock_qdrant.scroll.called
+
 
 class TestTrainCorrectionEndpoint:
     """Tests for POST /api/v1/train-correction endpoint."""
@@ -181,3 +203,87 @@ class TestTrainCorrectionEndpoint:
         
         assert response.status_code == 422  # Validation error
 
+
+
+class TestReadiness:
+    """Tests for the warmup and the /ready probe."""
+
+    def test_not_ready_before_warmup(self):
+        """Test that the probe answers 503 until the lifespan has warmed up."""
+        with patch('services.ai_pipeline.warmed_up', False):
+            response = client.get("/ready")
+
+        assert response.status_code == 503
+        assert response.json()["warmed_up"] is False
+
+    @pytest.mark.asyncio
+    async def test_warmup_loads_index_and_reports_ready(self):
+        """Test that warmup preloads collection info and the local index."""
+        from services import ai_pipeline
+        from services.vector_index import LocalVectorIndex
+        from qdrant_client.models import Record
+
+        mock_qdrant = AsyncMock()
+        mock_qdrant.get_collection.return_value.points_count = 1
+        mock_qdrant.scroll.return_value = (
+            [Record(id=1, vector=[1.0, 0.0], payload={"department_id": "7", "language": "uz"})], None
+        )
+        index = LocalVectorIndex("departments")
+        with patch('services.ai_pipeline.qdrant_client', mock_qdrant), \
+                patch('services.ai_pipeline.vector_index', index), \
+                patch('services.ai_pipeline.VECTOR_INDEX_ENABLED', True), \
+                patch('services.ai_pipeline.warmed_up', False):
+            await ai_pipeline.warmup()
+            status = ai_pipeline.readiness()
+
+        assert status["ready"] is True
+        assert index.ready
+
+    def test_generative_models_are_reused(self):
+        """Test that one GenerativeModel is created per model name."""
+        from services import ai_pipeline
+
+        assert ai_pipeline.get_model("gemini-2.0-flash-001") is ai_pipeline.get_model("gemini-2.0-flash-001")
+
+
+class TestSyncAnalyze:
+    """Tests for POST /api/v1/analyze?mode=sync."""
+
+    payload = {
+        "session_uuid": "123e4567-e89b-12d3-a456-426614174000",
+        "message_uuid": "523e4567-e89b-12d3-a456-426614174000",
+        "text": "My street light is broken"
+    }
+
+    @patch('services.ai_pipeline.send_webhook')
+    @patch('services.ai_pipeline.analyze_request')
+    def test_decision_is_returned_inline(self, mock_analyze, mock_webhook):
+        """Test that a result ready within the deadline is returned and not sent by webhook."""
+        from services.ai_pipeline import ROUTING_RESULT_PATH
+        mock_analyze.return_value = (ROUTING_RESULT_PATH, {"suggested_department_id": "123"})
+
+        response = client.post("/api/v1/analyze?mode=sync", json=self.payload)
+
+        assert response.status_code == 200
+        assert response.json()["status"] == "completed"
+        assert response.json()["result"]["suggested_department_id"] == "123"
+        assert not mock_webhook.called
+
+    @pytest.mark.asyncio
+    async def test_late_result_falls_back_to_webhook(self):
+        """Test that past the deadline the caller is told to wait and the result goes by webhook."""
+        import asyncio
+        from services import ai_pipeline
+
+        async def slow_analysis(request):
+            await asyncio.sleep(0.05)
+            return ai_pipeline.ROUTING_RESULT_PATH, {"suggested_department_id": "123"}
+
+        with patch('services.ai_pipeline.analyze_request', side_effect=slow_analysis), \
+                patch('services.ai_pipeline.send_webhook', new_callable=AsyncMock) as mock_webhook:
+            status, result = await ai_pipeline.analyze_sync(AnalyzeRequest(**self.payload), deadline_seconds=0.01)
+            assert (status, result) == ("processing", None)
+            assert not mock_webhook.called
+            await asyncio.gather(*ai_pipeline._late_analyses)
+
+        assert mock_webhook.call_args.args[1] == {"suggested_department_id": "123"}
@@ -0,0 +1,180 @@
+"""
+Tests for the dependency circuit breakers and the degraded paths they trigger.
+"""
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from api.v1.models import AnalyzeRequest, Candidate
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, HALF_OPEN, OPEN
+from services.embedding_batcher import EmbeddingBatcher
+from services.outbox import Outbox
+
+
+async def failing():
+    raise ConnectionError("deadline exceeded")
+
+
+async def succeeding():
+    return "ok"
+
+
+def open_breaker(name="test"):
+    breaker = CircuitBreaker(name, failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    return breaker
+
+
+class TestCircuitBreaker:
+    """Tests for the closed -> open -> half-open -> closed cycle."""
+
+    @pytest.mark.asyncio
+    async def test_opens_after_consecutive_failures(self):
+        """Test that the threshold of failures in a row opens the circuit and later calls fail fast."""
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=60)
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await breaker.call(failing)
+
+        assert breaker.state == OPEN
+        fn = AsyncMock()
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(fn)
+        assert not fn.called
+        assert breaker.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_success_resets_failure_count(self):
+        """Test that failures must be consecutive to open the circuit."""
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=60)
+        with pytest.raises(ConnectionError):
+            await breaker.call(failing)
+        await breaker.call(succeeding)
+        with pytest.raises(ConnectionError):
+            await breaker.call(failing)
+
+        assert breaker.state == CLOSED
+
+    @pytest.mark.asyncio
+    async def test_half_open_probe_closes_on_success(self):
+        """Test that after the reset timeout one probe passes and its success closes the circuit."""
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=0, half_open_probes=1)
+        breaker.record_failure()
+
+        assert breaker.allow()
+        assert breaker.state == HALF_OPEN
+        # The single probe slot is taken.
+        assert not breaker.allow()
+        breaker.record_success()
+        assert breaker.state == CLOSED
+
+    @pytest.mark.asyncio
+    async def test_half_open_probe_failure_reopens(self):
+        """Test that a failed probe opens the circuit again."""
+        breaker = CircuitBreaker("test", failure_threshold=3, reset_seconds=0)
+        for _ in range(3):
+            breaker.record_failure()
+
+        with pytest.raises(ConnectionError):
+            await breaker.call(failing)
+
+        assert breaker.state == OPEN
+        assert breaker.stats()["opened"] == 2
+
+
+class TestDegradedRouting:
+    """Tests for the pipeline and outbox while a dependency's circuit is open."""
+
+    @pytest.mark.asyncio
+    async def test_open_embedding_circuit_sends_manual_routing(self):
+        """Test that without any fallback index the message is still delivered, flagged for staff."""
+        from services import ai_pipeline
+
+        request = AnalyzeRequest(
+            session_uuid="123e4567-e89b-12d3-a456-426614174000",
+            message_uuid="323e4567-e89b-12d3-a456-426614174000",
+            text="Ko'cha chirog'i ishlamayapti"
+        )
+        embed = AsyncMock()
+        batcher = EmbeddingBatcher(embed, breaker=open_breaker("embedding"))
+        with patch.object(ai_pipeline, 'embedding_batcher', batcher), \
+             patch.object(ai_pipeline, 'EMBEDDING_FALLBACK_LOCAL', False), \
+             patch.object(ai_pipeline, 'hybrid_enabled', return_value=False), \
+             patch.object(ai_pipeline, 'embedding_cache', MagicMock(get=AsyncMock(return_value=None))):
+            path, data = await ai_pipeline.analyze_request(request)
+
+        assert not embed.called
+        assert path == ai_pipeline.ROUTING_RESULT_PATH
+        assert data["needs_manual_routing"]
+        assert data["suggested_department_id"] is None
+
+    @pytest.mark.asyncio
+    async def test_open_generation_circuit_fails_fast(self):
+        """Test that an open LLM circuit raises without calling Gemini; Step 5 then takes the best scored candidate."""
+        from services import ai_pipeline
+
+        generate = AsyncMock()
+        with patch.object(ai_pipeline, 'generation_breaker', open_breaker("generation")), \
+             patch.object(ai_pipeline, 'async_generate', generate):
+            with pytest.raises(CircuitOpenError):
+                await ai_pipeline.generate_decision("model", "prompt", {})
+
+        assert not generate.called
+
+    async def analyze_with_open_llm(self, candidates, text):
+        from services import ai_pipeline
+
+        request = AnalyzeRequest(
+            session_uuid="123e4567-e89b-12d3-a456-426614174000",
+            message_uuid="323e4567-e89b-12d3-a456-426614174001",
+            text=text
+        )
+        with patch.object(ai_pipeline, 'generation_breaker', open_breaker("generation")), \
+             patch.object(ai_pipeline, 'search_candidates', AsyncMock(return_value=candidates)), \
+             patch.object(ai_pipeline, 'hybrid_enabled', return_value=False), \
+             patch.object(ai_pipeline.decision_cache, 'enabled', False):
+            return await ai_pipeline.analyze_request(request, vector=[0.1] * 768)
+
+    @pytest.mark.asyncio
+    async def test_open_generation_circuit_takes_best_scored_candidate(self):
+        """Test that the fallback skips a BM25-only first candidate and reports the real cosine score."""
+        candidates = [
+            Candidate(id="5", name="Lexical only", lexical_score=3.2, fused_score=0.03),
+            Candidate(id="7", name="Roads", score=0.62, fused_score=0.02),
+            Candidate(id="9", name="Water", score=0.81, fused_score=0.01),
+        ]
+        _, data = await self.analyze_with_open_llm(candidates, "Open circuit fallback test: water")
+
+        assert data["suggested_department_id"] == "9"
+        assert data["confidence_score"] == 81
+        assert not data.get("needs_manual_routing")
+
+    @pytest.mark.asyncio
+    async def test_open_generation_circuit_without_close_candidate_needs_manual_routing(self):
+        """Test that the fallback routes to staff when no candidate reaches the similarity floor."""
+        from services import ai_pipeline
+
+        candidates = [Candidate(id="5", name="Lexical only", lexical_score=3.2),
+                      Candidate(id="7", name="Roads", score=ai_pipeline.LLM_FALLBACK_MIN_SCORE - 0.1)]
+        _, data = await self.analyze_with_open_llm(candidates, "Open circuit fallback test: unclear")
+
+        assert data["needs_manual_routing"]
+        assert data["suggested_department_id"] is None
+        assert len(data["vector_search_results"]) == 2
+
+    @pytest.mark.asyncio
+    async def test_outbox_holds_entries_while_circuit_is_open(self, tmp_path):
+        """Test that the outbox posts nothing and spends no attempts while Django's circuit is open."""
+        http_client = MagicMock()
+        http_client.post = AsyncMock()
+        outbox = Outbox(http_client, path=str(tmp_path / "outbox.sqlite3"), breaker=open_breaker("webhook"))
+        await outbox.add("http://django/api/internal/injection-alert/", {"message_uuid": "uuid-1"})
+
+        assert await outbox.flush_once() == 0
+        assert not http_client.post.called
+        stats = await outbox.stats()
+        assert stats["pending"] == 1
+        assert stats["failed_attempts"] == 0
+        assert stats["circuit"] == OPEN
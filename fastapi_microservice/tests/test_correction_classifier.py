@@ -0,0 +1,118 @@
+"""
+Tests for the correction kNN classifier.
+"""
+import time
+import pytest
+from unittest.mock import patch, MagicMock
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from api.v1.models import AnalyzeRequest
+from services.correction_classifier import CorrectionClassifier
+
+DAY = 86400
+
+
+def correction(department_id, corrected_at=None):
+    payload = {"department_id": department_id, "language": "uz", "name": "User Correction",
+               "description": "text", "is_correction": True}
+    if corrected_at:
+        payload["corrected_at"] = corrected_at
+    return payload
+
+
+def entries(*departments, vector=(1.0, 0.0, 0.0), corrected_at=None):
+    """Corrections close to `vector`, one per department ID given."""
+    points = [("d10", [0.0, 1.0, 0.0], {"department_id": "10", "language": "uz", "name": "Suv ta'minoti"})]
+    for n, department_id in enumerate(departments):
+        near = [vector[0], vector[1] + 0.05 * (n + 1), vector[2]]
+        points.append((f"c{n}", near, correction(department_id, corrected_at)))
+    return points
+
+
+class TestCorrectionClassifier:
+    """Tests for voting, thresholds and recency weighting."""
+
+    @pytest.mark.asyncio
+    async def test_agreeing_corrections_route(self):
+        """Test that enough close, agreeing corrections produce a decision with the department name."""
+        classifier = CorrectionClassifier(enabled=True, min_votes=3, min_agreement=0.8)
+        await classifier.rebuild(entries("10", "10", "10"))
+
+        decision, votes = classifier.classify([1.0, 0.0, 0.0], "uz")
+
+        assert decision.department_id == "10"
+        assert decision.name == "Suv ta'minoti"
+        assert votes[0].votes == 3
+        assert votes[0].share == 1.0
+
+    @pytest.mark.asyncio
+    async def test_split_vote_does_not_route(self):
+        """Test that disagreeing corrections report their distribution without a decision."""
+        classifier = CorrectionClassifier(enabled=True, min_votes=2, min_agreement=0.8)
+        await classifier.rebuild(entries("10", "10", "20", "20"))
+
+        decision, votes = classifier.classify([1.0, 0.0, 0.0], "uz")
+
+        assert decision is None
+        assert {v.department_id for v in votes} == {"10", "20"}
+        assert classifier.rejections["low_agreement"] == 1
+
+    @pytest.mark.asyncio
+    async def test_distant_corrections_do_not_vote(self):
+        """Test that corrections below the similarity threshold are ignored."""
+        classifier = CorrectionClassifier(enabled=True, min_votes=1, min_similarity=0.9)
+        await classifier.rebuild(entries("10", "10", "10"))
+
+        decision, votes = classifier.classify([0.0, 0.0, 1.0], "uz")
+
+        assert decision is None
+        assert votes == []
+
+    @pytest.mark.asyncio
+    async def test_recent_corrections_outweigh_old_ones(self):
+        """Test that recency weighting lets newer corrections win the vote."""
+        classifier = CorrectionClassifier(enabled=True, min_votes=1, min_agreement=0.6, half_life_days=30)
+        now = time.time()
+        await classifier.rebuild(entries("10", corrected_at=now - 365 * DAY))
+        classifier.add("c-new", [1.0, 0.06, 0.0], correction("20", now))
+
+        decision, votes = classifier.classify([1.0, 0.0, 0.0], "uz")
+
+        assert decision.department_id == "20"
+        assert votes[0].weight > votes[1].weight
+
+
+class TestKnnRouting:
+    """Tests for the kNN fast path in the pipeline."""
+
+    @pytest.mark.asyncio
+    @patch('services.ai_pipeline.send_webhook')
+    @patch('services.ai_pipeline.async_embed')
+    @patch('services.ai_pipeline.async_generate')
+    async def test_confident_vote_skips_llm(self, mock_generate, mock_embed, mock_webhook):
+        """Test that a confident vote routes without the LLM and is reported in the results."""
+        from services import ai_pipeline
+
+        classifier = CorrectionClassifier(enabled=True, min_votes=3, min_agreement=0.8)
+        await classifier.rebuild(entries("10", "10", "10"))
+        mock_embed.return_value = {"embedding": [1.0, 0.0, 0.0], "cached": False}
+
+        request = AnalyzeRequest(
+            session_uuid="123e4567-e89b-12d3-a456-426614174000",
+            message_uuid="223e4567-e89b-12d3-a456-426614174031",
+            text="Uch kundan beri suv yo'q"
+        )
+        with patch('services.ai_pipeline.correction_classifier', classifier), \
+                patch('services.ai_pipeline.search_candidates', return_value=[]), \
+                patch.object(ai_pipeline.near_duplicate_index, 'enabled', False):
+            await ai_pipeline.process_message_pipeline(request)
+
+        mock_generate.assert_not_called()
+        data = mock_webhook.call_args.args[1]
+        assert data["suggested_department_id"] == "10"
+        assert data["llm_bypassed"] is True
+        vote = data["vector_search_results"][-1]
+        assert vote["votes"] == 3
+        assert vote["vote_share"] == 1.0
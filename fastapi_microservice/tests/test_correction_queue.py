@@ -0,0 +1,259 @@
+"""
+Tests for the correction queue and batched correction training.
+"""
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+from fastapi.testclient import TestClient
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from main import app
+from api.v1.models import TrainCorrectionRequest
+from services.correction_queue import CorrectionQueue, CorrectionQueueFull
+
+client = TestClient(app)
+
+
+def make_correction(n, text="Ko'cha chirog'i ishlamayapti", department_id="12"):
+    return TrainCorrectionRequest(
+        text=text,
+        correct_department_id=department_id,
+        message_uuid=f"323e4567-e89b-12d3-a456-42661417400{n}",
+        language="uz"
+    )
+
+
+class TestCorrectionQueue:
+    """Tests for queueing, batching and retrying corrections."""
+
+    @pytest.mark.asyncio
+    async def test_newer_correction_replaces_pending_one(self, tmp_path):
+        """Test that a message corrected twice is trained once, with the later department."""
+        train = AsyncMock()
+        queue = CorrectionQueue(train, path=str(tmp_path / "corrections.sqlite3"), batch_size=10)
+        await queue.add("m1", make_correction(1, department_id="5"))
+        await queue.add("m2", make_correction(2))
+        assert await queue.add("m1", make_correction(1, department_id="7")) == 2
+
+        assert await queue.flush_once() == 2
+        batch = train.call_args.args[0]
+        assert [c.correct_department_id for c in batch] == ["7", "12"]
+        assert queue.stats()["replaced"] == 1
+        assert queue.stats()["pending"] == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_is_kept_for_retry(self, tmp_path):
+        """Test that a failed batch goes back to the front of the queue."""
+        train = AsyncMock(side_effect=[ConnectionError("qdrant down"), None])
+        queue = CorrectionQueue(train, path=str(tmp_path / "corrections.sqlite3"), batch_size=1)
+        await queue.add("m1", make_correction(1))
+        await queue.add("m2", make_correction(2))
+
+        assert await queue.flush_once() == 0
+        assert queue.is_pending("m1")
+        assert queue.stats()["failures_in_row"] == 1
+        assert await queue.flush_once() == 1
+
+        assert train.call_args.args[0][0].message_uuid == make_correction(1).message_uuid
+        assert queue.stats()["failed_batches"] == 1
+        assert queue.stats()["failures_in_row"] == 0
+        assert queue.stats()["pending"] == 1
+
+    @pytest.mark.asyncio
+    async def test_failing_batch_is_bisected_so_good_entries_train(self, tmp_path):
+        """Test that one poison correction doesn't hold back the rest of its batch."""
+        trained = []
+
+        async def train(batch):
+            if any(c.correct_department_id == "bad" for c in batch):
+                raise ValueError("unknown department")
+            trained.extend(c.message_uuid for c in batch)
+
+        queue = CorrectionQueue(train, path=str(tmp_path / "corrections.sqlite3"), batch_size=4)
+        for n in range(4):
+            await queue.add(f"m{n}", make_correction(n, department_id="bad" if n == 2 else "12"))
+
+        assert await queue.flush_once() == 3
+        assert len(trained) == 3
+        assert list(queue._pending) == ["m2"]
+        assert queue.stats()["failures_in_row"] == 0
+
+    @pytest.mark.asyncio
+    async def test_entry_is_dead_lettered_after_max_attempts(self, tmp_path):
+        """Test that a correction failing on every attempt is dropped and shown in stats."""
+        train = AsyncMock(side_effect=ValueError("unknown department"))
+        queue = CorrectionQueue(train, path=str(tmp_path / "corrections.sqlite3"), batch_size=10, max_attempts=3)
+        await queue.add("m1", make_correction(1))
+
+        for _ in range(3):
+            await queue.flush_once()
+
+        assert queue.stats()["pending"] == 0
+        assert queue.stats()["dead"] == 1
+        assert await queue.flush_once() == 0
+
+        # Dead letters are kept on disk, and a restarted queue doesn't train them again.
+        restarted = CorrectionQueue(train, path=str(tmp_path / "corrections.sqlite3"))
+        assert await restarted.restore() == 0
+        assert restarted.stats()["dead"] == 1
+        dead = await restarted.dead_letters()
+        assert dead[0]["key"] == "m1"
+        assert dead[0]["attempts"] == 3
+        assert dead[0]["error"] == "unknown department"
+
+    @pytest.mark.asyncio
+    async def test_pending_corrections_survive_a_restart(self, tmp_path):
+        """Test that corrections acknowledged before a crash are trained by the next process."""
+        path = str(tmp_path / "corrections.sqlite3")
+        crashed = CorrectionQueue(AsyncMock(), path=path, load_item=TrainCorrectionRequest.model_validate_json)
+        await crashed.add("m1", make_correction(1, department_id="5"))
+        await crashed.add("m2", make_correction(2))
+        await crashed.add("m1", make_correction(1, department_id="7"))
+
+        train = AsyncMock()
+        restarted = CorrectionQueue(train, path=path, load_item=TrainCorrectionRequest.model_validate_json)
+        assert await restarted.restore() == 2
+        assert await restarted.flush_once() == 2
+
+        assert [c.correct_department_id for c in train.call_args.args[0]] == ["7", "12"]
+        assert await CorrectionQueue(train, path=path).restore() == 0
+
+    @pytest.mark.asyncio
+    async def test_replacement_during_training_is_kept(self, tmp_path):
+        """Test that a correction replaced while its batch trains is not deleted with the old version."""
+        path = str(tmp_path / "corrections.sqlite3")
+        queue = CorrectionQueue(AsyncMock(), path=path, load_item=TrainCorrectionRequest.model_validate_json)
+
+        async def train(batch):
+            await queue.add("m1", make_correction(1, department_id="7"))
+        queue._train_batch = train
+        await queue.add("m1", make_correction(1, department_id="5"))
+
+        assert await queue.flush_once() == 1
+        restarted = CorrectionQueue(AsyncMock(), path=path, load_item=TrainCorrectionRequest.model_validate_json)
+        assert await restarted.restore() == 1
+        assert restarted._pending["m1"][0].correct_department_id == "7"
+
+    @pytest.mark.asyncio
+    async def test_rejects_past_max_pending(self, tmp_path):
+        """Test that a full queue refuses new messages but still takes replacements."""
+        queue = CorrectionQueue(AsyncMock(), path=str(tmp_path / "corrections.sqlite3"), max_pending=1)
+        await queue.add("m1", make_correction(1))
+        await queue.add("m1", make_correction(1))
+
+        with pytest.raises(CorrectionQueueFull):
+            await queue.add("m2", make_correction(2))
+        assert queue.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stop_trains_pending_corrections(self, tmp_path):
+        """Test that shutdown trains what is still queued."""
+        train = AsyncMock()
+        queue = CorrectionQueue(train, path=str(tmp_path / "corrections.sqlite3"), batch_size=10, window_ms=60000)
+        await queue.start()
+        await queue.add("m1", make_correction(1))
+
+        await queue.stop()
+
+        assert train.call_count == 1
+        assert queue.stats()["trained"] == 1
+
+
+class TestTrainCorrections:
+    """Tests for training a batch of corrections."""
+
+    @pytest.mark.asyncio
+    async def test_batch_shares_embedding_upsert_and_webhook(self):
+        """Test one upsert with one point per text and one batched webhook for all messages."""
+        from services import ai_pipeline
+
+        corrections = [make_correction(1), make_correction(2), make_correction(3, text="Suv yo'q")]
+        mock_qdrant = MagicMock(upsert=AsyncMock())
+        embed = AsyncMock(side_effect=lambda text: {"embedding": [0.1] * 768, "cached": text != "Suv yo'q"})
+        with patch.object(ai_pipeline, 'qdrant_client', mock_qdrant), \
+             patch.object(ai_pipeline, 'async_embed', embed), \
+             patch.object(ai_pipeline, 'send_webhooks', new_callable=AsyncMock) as mock_webhooks:
+            await ai_pipeline.train_corrections(corrections)
+
+        assert embed.call_count == 2
+        mock_qdrant.upsert.assert_called_once()
+        points = mock_qdrant.upsert.call_args.kwargs["points"]
+        assert len(points) == 2
+        assert all(p.payload["is_correction"] for p in points)
+        mock_webhooks.assert_called_once()
+        url, batch_url, items = mock_webhooks.call_args.args
+        assert batch_url.endswith(ai_pipeline.TRAIN_CORRECTION_BATCH_PATH)
+        assert [item["message_uuid"] for item in items] == [str(c.message_uuid) for c in corrections]
+
+    @pytest.mark.asyncio
+    async def test_points_are_upserted_through_a_real_client(self):
+        """Test the upsert against a real in-memory client; points must be PointStruct for gRPC."""
+        from qdrant_client import AsyncQdrantClient
+        from qdrant_client.models import Distance, PointStruct, VectorParams
+        from services import ai_pipeline
+
+        qdrant = AsyncQdrantClient(":memory:")
+        await qdrant.create_collection("departments", vectors_config=VectorParams(size=4, distance=Distance.COSINE))
+        embed = AsyncMock(return_value={"embedding": [0.1, 0.2, 0.3, 0.4], "cached": True})
+        upsert = AsyncMock(side_effect=qdrant.upsert)
+        with patch.object(ai_pipeline, 'qdrant_client', MagicMock(upsert=upsert)), \
+             patch.object(ai_pipeline, 'vector_index', MagicMock(ready=False)), \
+             patch.object(ai_pipeline, 'correction_classifier', MagicMock(enabled=False)), \
+             patch.object(ai_pipeline, 'async_embed', embed), \
+             patch.object(ai_pipeline, 'send_webhooks', new_callable=AsyncMock):
+            await ai_pipeline.train_corrections([make_correction(1)])
+
+        assert all(isinstance(p, PointStruct) for p in upsert.call_args.kwargs["points"])
+        records, _ = await qdrant.scroll("departments", with_payload=True)
+        assert [r.payload["department_id"] for r in records] == ["12"]
+        await qdrant.close()
+
+    @pytest.mark.asyncio
+    async def test_outbox_delivers_corrections_in_bulk(self, tmp_path):
+        """Test that queued correction webhooks go to Django in one bulk POST."""
+        from services import ai_pipeline
+        from services.outbox import Outbox
+
+        http_client = MagicMock()
+        http_client.post = AsyncMock(return_value=MagicMock(status_code=200, json=lambda: {"results": []}))
+        outbox = Outbox(http_client, path=str(tmp_path / "outbox.sqlite3"), batch_routes=ai_pipeline.outbox.batch_routes)
+        items = [{"message_uuid": f"uuid-{n}", "correct_department_id": "12"} for n in range(3)]
+        with patch.object(ai_pipeline, 'outbox', outbox), patch.object(ai_pipeline, 'OUTBOX_ENABLED', True):
+            await ai_pipeline.send_webhooks("http://django/api/internal/train-correction/",
+                                            "http://django/api/internal/train-correction/batch/", items)
+        await outbox.flush_once()
+
+        http_client.post.assert_called_once()
+        assert http_client.post.call_args.args[0] == "http://django/api/internal/train-correction/batch/"
+        assert len(http_client.post.call_args.kwargs["json"]["results"]) == 3
+
+
+class TestTrainCorrectionQueueEndpoint:
+    """Tests for queueing through POST /api/v1/train-correction and the status endpoint."""
+
+    def test_correction_is_acknowledged_and_visible_in_status(self, tmp_path):
+        """Test that the endpoint answers without training and the backlog shows the message."""
+        from services import ai_pipeline
+
+        queue = CorrectionQueue(AsyncMock(), path=str(tmp_path / "corrections.sqlite3"))
+        payload = make_correction(1).model_dump(mode="json")
+        with patch('api.v1.routes.correction_queue', queue), \
+             patch.object(ai_pipeline, 'train_corrections', new_callable=AsyncMock) as mock_train:
+            response = client.post("/api/v1/train-correction", json=payload)
+            status = client.get("/api/v1/train-correction/status",
+                                params={"message_uuid": payload["message_uuid"]}).json()
+
+        assert response.status_code == 200
+        assert response.json()["queued"]
+        assert not mock_train.called
+        assert status["pending"] == 1
+        assert status["queued"]
+
+    def test_full_queue_answers_429(self, tmp_path):
+        """Test back-pressure once the backlog is at its limit."""
+        queue = CorrectionQueue(AsyncMock(), path=str(tmp_path / "corrections.sqlite3"), max_pending=0)
+        with patch('api.v1.routes.correction_queue', queue):
+            response = client.post("/api/v1/train-correction", json=make_correction(1).model_dump(mode="json"))
+
+        assert response.status_code == 429
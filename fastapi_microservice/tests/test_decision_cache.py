@@ -0,0 +1,132 @@
+"""
+Tests for the LLM decision cache.
+"""
+import time
+import pytest
+from unittest.mock import patch, AsyncMock
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from services.decision_cache import DecisionCache
+
+class FakePipeline:
+    """Queues commands against a FakeRedis and runs them on execute()."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args) for name, args in self.commands]
+
+
+class FakeRedis:
+    """The few commands the decision cache uses, over a dict; records every command name."""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.calls = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def get(self, key):
+        self.calls.append("get")
+        return self.data.get(key)
+
+    async def hget(self, key, field):
+        self.calls.append("hget")
+        return self.data.get(key, {}).get(field)
+
+    async def hset(self, key, field, value):
+        self.calls.append("hset")
+        self.data.setdefault(key, {})[field] = value
+
+    async def expire(self, key, seconds):
+        self.calls.append("expire")
+        self.ttls[key] = time.time() + seconds
+
+    async def delete(self, *keys):
+        self.calls.append("delete")
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def incr(self, key):
+        self.calls.append("incr")
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+
+DECISION = {"department_id": "7", "intent": "Shikoyat", "confidence": 90, "reason": "Water outage", "extra": 1}
+
+
+class TestDecisionCache:
+    """Tests for keys, hits and invalidation."""
+
+    @pytest.mark.asyncio
+    async def test_hit_ignores_candidate_order_and_whitespace(self):
+        """Test that the same text and candidate set hits regardless of order."""
+        cache = DecisionCache(use_redis=False)
+        await cache.set("Suv yo'q", "uz", "gemini", ["7", "3"], DECISION)
+
+        result = await cache.get("suv  yo'q", "uz", "gemini", ["3", "7"])
+
+        assert result == {"department_id": "7", "intent": "Shikoyat", "confidence": 90, "reason": "Water outage"}
+        assert await cache.get("Suv yo'q", "uz", "gemini", ["7", "4"]) is None
+        assert await cache.get("Suv yo'q", "ru", "gemini", ["7", "3"]) is None
+
+    @pytest.mark.asyncio
+    async def test_invalidate_text_only_drops_that_text(self):
+        """Test that training a correction drops decisions for the corrected text."""
+        cache = DecisionCache(use_redis=False)
+        await cache.set("Suv yo'q", "uz", "gemini", ["7"], DECISION)
+        await cache.set("Yo'l buzilgan", "uz", "gemini", ["7"], DECISION)
+
+        await cache.invalidate_text("SUV YO'Q")
+
+        assert await cache.get("Suv yo'q", "uz", "gemini", ["7"]) is None
+        assert await cache.get("Yo'l buzilgan", "uz", "gemini", ["7"]) is not None
+
+    @pytest.mark.asyncio
+    async def test_invalidate_all_on_reindex(self):
+        """Test that a re-index invalidates every decision."""
+        cache = DecisionCache(use_redis=False)
+        await cache.set("Suv yo'q", "uz", "gemini", ["7"], DECISION)
+
+        await cache.invalidate_all()
+
+        assert await cache.get("Suv yo'q", "uz", "gemini", ["7"]) is None
+        assert cache.stats()["generation"] == 1
+
+    @pytest.mark.asyncio
+    async def test_shared_entries_of_a_text_are_dropped_with_one_delete(self):
+        """Test that all decisions for a text live in one Redis hash that invalidation deletes."""
+        redis = FakeRedis()
+        cache = DecisionCache()
+        with patch('services.decision_cache.get_redis', AsyncMock(return_value=redis)):
+            await cache.set("Suv yo'q", "uz", "gemini", ["7"], DECISION)
+            await cache.set("Suv yo'q", "uz", "gemini", ["7", "3"], DECISION)
+            await cache.set("Yo'l buzilgan", "uz", "gemini", ["7"], DECISION)
+            assert len(redis.data) == 2
+            assert len(redis.ttls) == 2
+
+            cache.local.clear()
+            assert await cache.get("Suv yo'q", "uz", "gemini", ["3", "7"]) is not None
+
+            redis.calls.clear()
+            await cache.invalidate_text("Suv yo'q")
+            assert redis.calls == ["delete"]
+
+            cache.local.clear()
+            assert await cache.get("Suv yo'q", "uz", "gemini", ["7"]) is None
+            assert await cache.get("Yo'l buzilgan", "uz", "gemini", ["7"]) is not None
@@ -0,0 +1,135 @@
+"""
+Tests for the micro-batching embedding dispatcher.
+"""
+import asyncio
+import pytest
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED
+from services.embedding_batcher import EmbeddingBatcher
+
+
+class FakeBatchEmbedder:
+    """Records batch calls and returns one vector per text."""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, model, task_type, texts):
+        self.calls.append(list(texts))
+        if self.fail:
+            raise RuntimeError("quota exceeded")
+        return [[float(len(text))] for text in texts]
+
+
+class TestEmbeddingBatcher:
+    """Tests for coalescing and fan-out of embed requests."""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_one_call(self):
+        """Test that requests inside the window are sent as one batch."""
+        embedder = FakeBatchEmbedder()
+        batcher = EmbeddingBatcher(embedder, window_ms=20, max_batch_size=100)
+
+        texts = ["a", "bb", "ccc", "bb"]
+        vectors = await asyncio.gather(*(batcher.embed(t, "m", "retrieval_query") for t in texts))
+
+        assert len(embedder.calls) == 1
+        # Duplicate texts are embedded once but answered for every caller.
+        assert embedder.calls[0] == ["a", "bb", "ccc"]
+        assert vectors == [[1.0], [2.0], [3.0], [2.0]]
+        assert batcher.stats()["largest_batch"] == 4
+
+    @pytest.mark.asyncio
+    async def test_full_batch_is_sent_without_waiting(self):
+        """Test that the size limit splits batches."""
+        embedder = FakeBatchEmbedder()
+        batcher = EmbeddingBatcher(embedder, window_ms=5000, max_batch_size=2)
+
+        vectors = await asyncio.wait_for(
+            asyncio.gather(*(batcher.embed(t, "m", "retrieval_query") for t in ["a", "bb"])),
+            timeout=1.0,
+        )
+
+        assert vectors == [[1.0], [2.0]]
+        assert batcher.stats()["batches"] == 1
+
+    @pytest.mark.asyncio
+    async def test_batch_error_reaches_every_caller(self):
+        """Test that a failed batch call fails all waiting requests."""
+        batcher = EmbeddingBatcher(FakeBatchEmbedder(fail=True), window_ms=1, max_batch_size=10)
+
+        results = await asyncio.gather(
+            batcher.embed("a", "m", "retrieval_query"),
+            batcher.embed("b", "m", "retrieval_query"),
+            return_exceptions=True,
+        )
+
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert batcher.stats()["errors"] == 1
+
+    @pytest.mark.asyncio
+    async def test_dispatch_tasks_are_held_until_done(self):
+        """Test that a running batch is referenced by the batcher and released once it finished."""
+        release = asyncio.Event()
+
+        async def embed(model, task_type, texts):
+            await release.wait()
+            return [[1.0] for _ in texts]
+
+        batcher = EmbeddingBatcher(embed, window_ms=1, max_batch_size=10)
+        waiting = asyncio.ensure_future(batcher.embed("a", "m", "retrieval_query"))
+        await asyncio.sleep(0.02)
+
+        assert batcher.stats()["in_flight_batches"] == 1
+        release.set()
+        assert await waiting == [1.0]
+        await asyncio.sleep(0)
+        assert batcher.stats()["in_flight_batches"] == 0
+
+    @pytest.mark.asyncio
+    async def test_short_batch_response_fails_callers(self):
+        """Test that a response missing vectors fails the callers instead of leaving them waiting."""
+        async def embed(model, task_type, texts):
+            return [[1.0]]
+
+        batcher = EmbeddingBatcher(embed, window_ms=1, max_batch_size=10)
+        results = await asyncio.wait_for(asyncio.gather(
+            batcher.embed("a", "m", "retrieval_query"),
+            batcher.embed("b", "m", "retrieval_query"),
+            return_exceptions=True,
+        ), timeout=1.0)
+
+        assert all(isinstance(r, ValueError) for r in results)
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_counts_once_against_the_breaker(self):
+        """Test that one failed upstream call for many callers is a single circuit failure."""
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=60)
+        batcher = EmbeddingBatcher(FakeBatchEmbedder(fail=True), window_ms=5, max_batch_size=10,
+                                   breaker=breaker)
+
+        results = await asyncio.gather(
+            *(batcher.embed(t, "m", "retrieval_query") for t in ["a", "b", "c", "d", "e"]),
+            return_exceptions=True,
+        )
+
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert breaker.failures == 1
+        assert breaker.state == CLOSED
+
+    @pytest.mark.asyncio
+    async def test_open_breaker_fails_fast_without_a_batch(self):
+        """Test that requests are refused while the circuit is open and nothing is sent."""
+        embedder = FakeBatchEmbedder()
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=60)
+        breaker.record_failure()
+        batcher = EmbeddingBatcher(embedder, window_ms=1, max_batch_size=10, breaker=breaker)
+
+        with pytest.raises(CircuitOpenError):
+            await batcher.embed("a", "m", "retrieval_query")
+
+        assert embedder.calls == []
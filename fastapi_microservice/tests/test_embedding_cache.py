@@ -0,0 +1,71 @@
+"""
+Tests for the two-tier embedding cache.
+"""
+import pytest
+from unittest.mock import patch, AsyncMock
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from services.cache import LRUCache, normalize_text
+from services.embedding_cache import EmbeddingCache, encode_vector, decode_vector, embedding_key
+
+
+class TestLRUCache:
+    """Tests for the in-process LRU tier."""
+
+    def test_evicts_least_recently_used(self):
+        """Test that the oldest untouched entry is evicted first."""
+        cache = LRUCache(max_entries=2, ttl_seconds=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.evictions == 1
+
+    def test_expired_entries_are_misses(self):
+        """Test that entries past their TTL are dropped."""
+        cache = LRUCache(max_entries=10, ttl_seconds=-1)
+        cache.set("a", 1)
+
+        assert cache.get("a") is None
+        assert cache.expirations == 1
+        assert cache.misses == 1
+
+
+class TestEmbeddingCache:
+    """Tests for embedding keys, storage format and lookups."""
+
+    def test_key_ignores_case_and_whitespace(self):
+        """Test that trivially different resends share a key."""
+        assert normalize_text("  Suv   YO'Q\n") == "suv yo'q"
+        assert embedding_key("m", "retrieval_query", "Suv yo'q") == embedding_key("m", "retrieval_query", " suv  yo'q ")
+        assert embedding_key("m", "retrieval_query", "suv") != embedding_key("m", "retrieval_document", "suv")
+
+    def test_float16_roundtrip(self):
+        """Test that vectors survive float16 packing within half precision."""
+        vector = [0.123456, -0.5, 0.0, 0.999]
+        data = encode_vector(vector)
+
+        assert len(data) == 2 * len(vector)
+        assert decode_vector(data) == pytest.approx(vector, abs=1e-3)
+
+    @pytest.mark.asyncio
+    @patch('services.ai_pipeline.genai.embed_content_async', new_callable=AsyncMock)
+    async def test_async_embed_skips_network_on_repeat(self, mock_embed_content):
+        """Test that a repeated text is served from the cache."""
+        from services import ai_pipeline
+
+        mock_embed_content.return_value = {'embedding': [[0.25] * 768]}
+        cache = EmbeddingCache(max_entries=10, ttl_seconds=60, use_redis=False)
+
+        with patch.object(ai_pipeline, 'embedding_cache', cache):
+            first = await ai_pipeline.async_embed("Suv yo'q")
+            second = await ai_pipeline.async_embed("suv yo'q ")
+
+        assert mock_embed_content.call_count == 1
+        assert second['embedding'] == pytest.approx(first['embedding'], abs=1e-3)
+        assert cache.stats()["local"]["hits"] == 1
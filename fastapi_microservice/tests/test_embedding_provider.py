@@ -0,0 +1,110 @@
+"""
+Tests for the embedding providers and the offline embedding index.
+"""
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import numpy as np
+from api.v1.models import AnalyzeRequest
+from services.embedding_provider import EmbeddingProvider, HashingEmbeddingProvider, LocalEmbeddingIndex
+
+POINTS = [
+    (1, {"department_id": "10", "name": "Elektr tarmoqlari", "language": "uz",
+         "description": "Elektr energiyasi, ko'cha chiroqlari va transformatorlar bo'yicha murojaatlar"}),
+    (2, {"department_id": "20", "name": "Suv ta'minoti", "language": "uz",
+         "description": "Ichimlik suvi, kanalizatsiya va quvurlar nosozligi"}),
+    (3, {"department_id": "30", "name": "Водоканал", "language": "ru",
+         "description": "Водоснабжение, канализация и прорывы труб"}),
+]
+
+
+class TestHashingEmbeddingProvider:
+    """Tests for the offline hashing vectorizer."""
+
+    def test_provider_without_embed_cannot_be_created(self):
+        """Test that a provider must implement embed."""
+        class Incomplete(EmbeddingProvider):
+            name = "incomplete"
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    def test_vectors_are_normalized_and_deterministic(self):
+        """Test that equal (normalized) texts embed identically to unit vectors."""
+        provider = HashingEmbeddingProvider(dimension=256)
+        first, second = provider.embed(["Suv  yo'q", "suv yo'q"])
+
+        assert first.shape == (256,)
+        assert np.linalg.norm(first) == pytest.approx(1.0, abs=1e-5)
+        assert np.allclose(first, second)
+
+    def test_similar_texts_score_higher(self):
+        """Test that shared character n-grams raise cosine similarity."""
+        provider = HashingEmbeddingProvider().fit([p["description"] for _, p in POINTS])
+        query, close, far = provider.embed(["ko'chadagi chiroqlar yonmayapti", "ko'cha chiroqlari", "ichimlik suvi"])
+
+        assert float(query @ close) > float(query @ far)
+
+
+class TestLocalEmbeddingIndex:
+    """Tests for the index built from the mirrored payloads."""
+
+    @pytest.mark.asyncio
+    async def test_routes_by_description_text(self):
+        """Test that a message finds its department through the local index."""
+        index = LocalEmbeddingIndex()
+        await index.rebuild(POINTS)
+
+        assert index.ready
+        uz_hits = index.search("Ko'chada chiroqlar yonmayapti", "uz")
+        assert uz_hits[0].payload["department_id"] == "10"
+        ru_hits = index.search("Прорвало трубу, нет воды", "ru")
+        assert ru_hits[0].payload["department_id"] == "30"
+
+    @pytest.mark.asyncio
+    async def test_corrections_are_searchable(self):
+        """Test that an upserted correction text is matched."""
+        index = LocalEmbeddingIndex()
+        await index.rebuild(POINTS)
+        index.upsert("c1", {"department_id": "20", "language": "uz", "is_correction": True,
+                            "description": "Hovlimizdagi quduq qurib qoldi"})
+
+        hits = index.search("hovlimizdagi quduq qurib qoldi", "uz")
+        assert hits[0].id == "c1"
+
+
+class TestEmbeddingFallback:
+    """Tests for the degraded-mode fallback in the pipeline."""
+
+    @pytest.mark.asyncio
+    @patch('services.ai_pipeline.send_webhook')
+    @patch('services.ai_pipeline.async_embed')
+    @patch('services.ai_pipeline.async_generate')
+    async def test_gemini_failure_falls_back_to_local_index(self, mock_generate, mock_embed, mock_webhook):
+        """Test that a failed Gemini embedding still routes through the local index."""
+        from services import ai_pipeline
+
+        index = LocalEmbeddingIndex()
+        await index.rebuild(POINTS)
+        mock_embed.side_effect = RuntimeError("network unreachable")
+        mock_response = MagicMock()
+        mock_response.text = '{"department_id": "10", "intent": "Shikoyat", "confidence": 80, "reason": "Test"}'
+        mock_generate.return_value = mock_response
+
+        request = AnalyzeRequest(
+            session_uuid="123e4567-e89b-12d3-a456-426614174000",
+            message_uuid="223e4567-e89b-12d3-a456-426614174011",
+            text="Ko'chada chiroqlar yonmayapti"
+        )
+        with patch('services.ai_pipeline.local_embedding_index', index), \
+                patch('services.ai_pipeline.EMBEDDING_FALLBACK_LOCAL', True), \
+                patch.object(ai_pipeline.decision_cache, 'enabled', False):
+            await ai_pipeline.process_message_pipeline(request)
+
+        data = mock_webhook.call_args.args[1]
+        assert data["embedding_provider"] == "local"
+        assert data["vector_search_results"][0]["id"] == "10"
+        assert data["suggested_department_id"] == "10"
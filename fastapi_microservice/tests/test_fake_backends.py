@@ -0,0 +1,113 @@
+"""
+Tests for the in-process Gemini and Qdrant stand-ins.
+"""
+import pytest
+from unittest.mock import patch
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from qdrant_client.models import Filter, FieldCondition, MatchValue
+from api.v1.models import AnalyzeRequest
+from services.fake_backends import FakeGemini, FakeAsyncQdrantClient
+from services.rate_limiter import is_rate_limit_error
+
+DEPARTMENTS = [
+    {"department_id": 1, "name": "Suv ta'minoti", "description": "Ichimlik suvi, suv quvuri yorilishi", "language": "uz"},
+    {"department_id": 2, "name": "Elektr tarmoqlari", "description": "Elektr uzilishi, ko'cha chiroqlari", "language": "uz"},
+    {"department_id": 3, "name": "Водоснабжение", "description": "Питьевая вода, прорыв трубы", "language": "ru"},
+]
+
+
+async def seeded(gemini):
+    client = FakeAsyncQdrantClient()
+    await client.seed(DEPARTMENTS, gemini)
+    return client
+
+
+class TestFakeGemini:
+    """Tests for deterministic embeddings, decisions and injected faults."""
+
+    @pytest.mark.asyncio
+    async def test_embeddings_are_deterministic(self):
+        """Test that the same text embeds to the same 768-dim vector in separate instances."""
+        first = await FakeGemini().embed_content_async("models/text-embedding-004", ["suv yo'q"])
+        second = await FakeGemini().embed_content_async("models/text-embedding-004", ["suv yo'q"])
+
+        assert first == second
+        assert len(first["embedding"][0]) == 768
+
+    @pytest.mark.asyncio
+    async def test_decision_picks_first_listed_candidate(self):
+        """Test that the fake LLM answers routing JSON naming the best-scored candidate."""
+        model = FakeGemini().GenerativeModel("gemini-2.0-flash-001")
+        prompt = 'User Message: "Suv yo\'q"\n ID: 7, Name: Suv, Desc: a\n ID: 9, Name: Gaz, Desc: b'
+
+        response = await model.generate_content_async(prompt)
+
+        assert '"department_id": "7"' in response.text
+        assert response.usage_metadata.total_token_count > 0
+
+    @pytest.mark.asyncio
+    async def test_injected_rate_limits_look_like_quota_errors(self):
+        """Test that a 429 storm raises errors the rate limiter recognizes."""
+        gemini = FakeGemini(rate_limit_rate=1.0)
+
+        with pytest.raises(Exception) as error:
+            await gemini.embed_content_async("models/text-embedding-004", ["text"])
+
+        assert is_rate_limit_error(error.value)
+        assert gemini.stats()["rate_limited"] == 1
+
+
+class TestFakeQdrant:
+    """Tests for the query/upsert/scroll subset."""
+
+    @pytest.mark.asyncio
+    async def test_query_filters_and_projects(self):
+        """Test that a language filter and a payload field list apply like in Qdrant."""
+        gemini = FakeGemini()
+        client = await seeded(gemini)
+        query = (await gemini.embed_content_async("m", "suv quvuri yorildi"))["embedding"]
+
+        response = await client.query_points(
+            collection_name="departments", query=query, limit=2, with_payload=["department_id", "name"],
+            query_filter=Filter(must=[FieldCondition(key="language", match=MatchValue(value="uz"))])
+        )
+
+        assert [p.payload["department_id"] for p in response.points] == ["1", "2"]
+        assert set(response.points[0].payload) == {"department_id", "name"}
+
+    @pytest.mark.asyncio
+    async def test_scroll_pages_through_all_points(self):
+        """Test that scroll returns every point once, with vectors, across pages."""
+        client = await seeded(FakeGemini())
+
+        first, offset = await client.scroll(collection_name="departments", limit=2, with_vectors=True)
+        rest, end = await client.scroll(collection_name="departments", limit=2, offset=offset, with_vectors=True)
+
+        assert len(first) + len(rest) == 3
+        assert end is None
+        assert len(first[0].vector) == 768
+        assert (await client.get_collection("departments")).points_count == 3
+
+    @pytest.mark.asyncio
+    async def test_pipeline_routes_on_fakes(self):
+        """Test that the whole analysis runs on the stand-ins and routes to the matching department."""
+        from services import ai_pipeline
+
+        gemini = FakeGemini()
+        client = await seeded(gemini)
+        request = AnalyzeRequest(
+            session_uuid="123e4567-e89b-12d3-a456-426614174000",
+            message_uuid="423e4567-e89b-12d3-a456-426614174000",
+            text="Mahallamizda ichimlik suvi quvuri yorilib ketdi"
+        )
+        with patch.object(ai_pipeline, 'gemini', gemini), \
+             patch.object(ai_pipeline, 'qdrant_client', client), \
+             patch.object(ai_pipeline, 'VECTOR_INDEX_ENABLED', False), \
+             patch.dict(ai_pipeline._models, clear=True):
+            _, data = await ai_pipeline.analyze_request(request)
+
+        assert data["suggested_department_id"] == "1"
+        assert gemini.calls["embed"] == 1
@@ -0,0 +1,143 @@
+"""
+Tests for hedged LLM requests.
+"""
+import asyncio
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from api.v1.models import AnalyzeRequest
+from services.hedging import Hedger
+
+
+def fake_call(delays, failures=()):
+    """Call answering after a per-model delay; records started and cancelled models."""
+    log = {"started": [], "cancelled": []}
+
+    async def call(model):
+        log["started"].append(model)
+        try:
+            await asyncio.sleep(delays[model])
+        except asyncio.CancelledError:
+            log["cancelled"].append(model)
+            raise
+        if model in failures:
+            raise ValueError(f"{model} returned invalid JSON")
+        return f"answer from {model}"
+    return call, log
+
+
+class TestHedger:
+    """Tests for the race between the primary and the hedge model."""
+
+    @pytest.mark.asyncio
+    async def test_fast_primary_is_not_hedged(self):
+        """Test that a primary answering within the delay is the only call."""
+        hedger = Hedger(enabled=True, hedge_model="fast", default_delay=0.2)
+        call, log = fake_call({"primary": 0.0, "fast": 0.0})
+
+        result = await hedger.run("primary", call)
+
+        assert result.model == "primary"
+        assert not result.hedged
+        assert log["started"] == ["primary"]
+
+    @pytest.mark.asyncio
+    async def test_slow_primary_loses_to_hedge(self):
+        """Test that the hedge fires after the delay, wins and cancels the primary."""
+        hedger = Hedger(enabled=True, hedge_model="fast", default_delay=0.02)
+        call, log = fake_call({"primary": 5.0, "fast": 0.0})
+
+        result = await hedger.run("primary", call)
+        await asyncio.sleep(0)
+
+        assert result.value == "answer from fast"
+        assert result.hedged
+        assert log["cancelled"] == ["primary"]
+        assert hedger.stats()["hedge_rate"] == 1.0
+
+    @pytest.mark.asyncio
+    async def test_invalid_hedge_answer_waits_for_primary(self):
+        """Test that a failing hedge doesn't win; the slow primary's answer is used."""
+        hedger = Hedger(enabled=True, hedge_model="fast", default_delay=0.01)
+        call, _ = fake_call({"primary": 0.05, "fast": 0.0}, failures={"fast"})
+
+        result = await hedger.run("primary", call)
+
+        assert result.model == "primary"
+        assert result.hedged
+
+    @pytest.mark.asyncio
+    async def test_both_failing_raises_primary_error(self):
+        """Test that the primary's error reaches the caller when both models fail."""
+        hedger = Hedger(enabled=True, hedge_model="fast", default_delay=0.01)
+        call, _ = fake_call({"primary": 0.05, "fast": 0.0}, failures={"primary", "fast"})
+
+        with pytest.raises(ValueError, match="primary"):
+            await hedger.run("primary", call)
+
+    @pytest.mark.asyncio
+    async def test_fast_primary_failure_is_not_hedged(self):
+        """Test that an error before the delay (e.g. a rate limit) is raised without calling the hedge model."""
+        hedger = Hedger(enabled=True, hedge_model="fast", default_delay=0.2)
+        call, log = fake_call({"primary": 0.0, "fast": 0.0}, failures={"primary"})
+
+        with pytest.raises(ValueError, match="primary"):
+            await hedger.run("primary", call)
+
+        assert log["started"] == ["primary"]
+        assert hedger.stats()["hedged"] == 0
+
+    def test_delay_follows_primary_latency_quantile(self):
+        """Test that the hedge delay is the configured quantile of observed latencies."""
+        hedger = Hedger(enabled=True, quantile=0.95, min_delay=0.0, max_delay=100.0)
+        for n in range(100):
+            hedger.observe("primary", n / 100)
+
+        assert hedger.delay("primary") == pytest.approx(0.95)
+
+
+class TestHedgedPipeline:
+    """Tests for the hedge in Step 5 of the pipeline."""
+
+    @pytest.mark.asyncio
+    @patch('services.ai_pipeline.send_webhook')
+    @patch('services.ai_pipeline.async_embed')
+    @patch('services.ai_pipeline.async_generate')
+    @patch('services.ai_pipeline.search_candidates')
+    async def test_winning_model_is_recorded(self, mock_search, mock_generate, mock_embed, mock_webhook):
+        """Test that the model that answered and the hedge flag reach the routing result."""
+        from services import ai_pipeline
+        from api.v1.models import Candidate
+
+        mock_embed.return_value = {"embedding": [0.1] * 768, "cached": False}
+        mock_search.return_value = [Candidate(id="10", name="Suv", description="d", score=0.7)]
+
+        async def generate(model_name, prompt, config):
+            if model_name != "fast":
+                await asyncio.sleep(5)
+            response = MagicMock()
+            response.text = '{"department_id": "10", "intent": "Shikoyat", "confidence": 80, "reason": "Test"}'
+            return response
+        mock_generate.side_effect = generate
+
+        request = AnalyzeRequest(
+            session_uuid="123e4567-e89b-12d3-a456-426614174000",
+            message_uuid="223e4567-e89b-12d3-a456-426614174041",
+            text="Suv yo'q"
+        )
+        cache_set = AsyncMock()
+        with patch('services.ai_pipeline.hedger', Hedger(enabled=True, hedge_model="fast", default_delay=0.01)), \
+                patch.object(ai_pipeline.decision_cache, 'get', AsyncMock(return_value=None)), \
+                patch.object(ai_pipeline.decision_cache, 'set', cache_set), \
+                patch.object(ai_pipeline.near_duplicate_index, 'enabled', False):
+            await ai_pipeline.process_message_pipeline(request)
+
+        data = mock_webhook.call_args.args[1]
+        # The hedge model's answer is cached under its own model, not the primary's.
+        assert cache_set.call_args.args[2] == "fast"
+        assert data["llm_model"] == "fast"
+        assert data["llm_hedged"] is True
+        assert data["suggested_department_id"] == "10"
@@ -0,0 +1,123 @@
+"""
+Tests for the BM25 lexical index and hybrid rank fusion.
+"""
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from api.v1.models import AnalyzeRequest, Candidate
+from services.lexical_index import LexicalIndex, tokenize, reciprocal_rank_fusion
+
+POINTS = [
+    ("p10", {"department_id": "10", "name": "Yo'l va yoritish", "language": "uz",
+             "description": "Ko'cha chiroqlari, yo'llar ta'miri"}),
+    ("p20", {"department_id": "20", "name": "Suv ta'minoti", "language": "uz",
+             "description": "Ichimlik suvi, quvurlar, kanalizatsiya"}),
+    ("p30", {"department_id": "30", "name": "Водоканал", "language": "ru",
+             "description": "Водопровод, прорыв трубы, нет воды"}),
+]
+
+
+class TestTokenize:
+    """Tests for the multilingual tokenizer."""
+
+    def test_scripts_and_apostrophes_share_tokens(self):
+        """Test that Cyrillic and Latin Uzbek spellings give the same tokens."""
+        assert tokenize("Ko'cha chiroqlari") == tokenize("Кўча чироқлари")
+        assert tokenize("yoʻl") == tokenize("yo'l")
+
+    def test_rank_fusion_rewards_agreement(self):
+        """Test that an item ranked in both lists beats one ranked first in only one."""
+        fused = reciprocal_rank_fusion([["a", "b"], ["b", "c"]])
+        assert fused["b"] > fused["a"] > fused["c"]
+
+
+class TestLexicalIndex:
+    """Tests for BM25 search and incremental updates."""
+
+    @pytest.mark.asyncio
+    async def test_searches_within_language(self):
+        """Test that keyword matches rank first and stay in the message's language."""
+        index = LexicalIndex()
+        await index.rebuild(POINTS)
+
+        assert index.ready
+        assert index.search("Chiroqlari yonmayapti", "uz")[0][0] == "p10"
+        hits = index.search("Прорыв трубы", "ru")
+        assert [hit[0] for hit in hits] == ["p30"]
+
+    @pytest.mark.asyncio
+    async def test_added_correction_is_searchable_once(self):
+        """Test that a re-added correction replaces its payload instead of duplicating."""
+        index = LexicalIndex()
+        await index.rebuild(POINTS)
+        correction = {"department_id": "20", "language": "uz", "is_correction": True,
+                      "description": "Hovlimizdagi quduq qurib qoldi"}
+        index.add("c1", correction)
+        index.add("c1", {**correction, "department_id": "30"})
+
+        hits = index.search("quduq qurib qoldi", "uz")
+        assert len(index) == 4
+        assert hits[0][0] == "c1"
+        assert hits[0][1]["department_id"] == "30"
+
+
+class TestHybridFusion:
+    """Tests for fusing the vector ranking with BM25 in the pipeline."""
+
+    @pytest.mark.asyncio
+    async def test_fused_scores_are_exposed(self):
+        """Test that a lexical-only match joins the candidates with fused scores."""
+        from services import ai_pipeline
+
+        index = LexicalIndex()
+        await index.rebuild(POINTS)
+        vector_candidates = [
+            Candidate(id="20", name="Suv ta'minoti", description="", score=0.61, point_id="p20"),
+        ]
+        with patch('services.ai_pipeline.lexical_index', index):
+            fused = ai_pipeline.fuse_candidates(vector_candidates, "Ko'cha chiroqlari yonmayapti", "uz")
+
+        by_id = {c.id: c for c in fused}
+        assert by_id["10"].lexical_score > 0
+        assert by_id["10"].score == 0.0
+        assert by_id["20"].fused_score is not None
+        assert all(c.fused_score > 0 for c in fused)
+
+    @pytest.mark.asyncio
+    @patch('services.ai_pipeline.send_webhook')
+    @patch('services.ai_pipeline.async_embed')
+    @patch('services.ai_pipeline.async_generate')
+    @patch('services.ai_pipeline.qdrant_client', new_callable=AsyncMock)
+    async def test_pipeline_reports_fused_results(self, mock_qdrant, mock_generate, mock_embed, mock_webhook):
+        """Test that vector_search_results carry lexical and fused scores."""
+        from services import ai_pipeline
+
+        index = LexicalIndex()
+        await index.rebuild(POINTS)
+        mock_embed.return_value = {"embedding": [0.1] * 768, "cached": False}
+        hit = MagicMock()
+        hit.id = "p20"
+        hit.score = 0.6
+        hit.payload = POINTS[1][1]
+        mock_qdrant.query_points.return_value = MagicMock(points=[hit])
+        mock_response = MagicMock()
+        mock_response.text = '{"department_id": "10", "intent": "Shikoyat", "confidence": 80, "reason": "Test"}'
+        mock_generate.return_value = mock_response
+
+        request = AnalyzeRequest(
+            session_uuid="123e4567-e89b-12d3-a456-426614174000",
+            message_uuid="223e4567-e89b-12d3-a456-426614174021",
+            text="Ko'cha chiroqlari yonmayapti"
+        )
+        with patch('services.ai_pipeline.lexical_index', index), \
+                patch('services.ai_pipeline.VECTOR_INDEX_ENABLED', False), \
+                patch.object(ai_pipeline.decision_cache, 'enabled', False), \
+                patch.object(ai_pipeline.near_duplicate_index, 'enabled', False):
+            await ai_pipeline.process_message_pipeline(request)
+
+        results = mock_webhook.call_args.args[1]["vector_search_results"]
+        assert {r["id"] for r in results} == {"10", "20"}
+        assert all(r["fused_score"] for r in results)
@@ -0,0 +1,108 @@
+"""
+Tests for the Prometheus metrics endpoint and pipeline instrumentation.
+"""
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from main import app
+from services.metrics import StatsCollector, stage_timer
+
+client = TestClient(app)
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestMetricsEndpoint:
+    """Tests for GET /metrics."""
+
+    def test_metrics_exposes_pipeline_and_subsystem_metrics(self):
+        """Test that the endpoint serves the Prometheus text format."""
+        response = client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        assert "ai_pipeline_stage_seconds" in body
+        assert "ai_routing_policy_evaluated" in body
+        assert 'ai_embedding_cache_local{key="hits"}' in body
+
+
+class TestPipelineInstrumentation:
+    """Tests for stage timers, outcomes and fallback counters."""
+
+    def test_stage_timer_observes_and_tracks_in_flight(self):
+        """Test that the in-flight gauge is raised only inside the block."""
+        before = sample("ai_pipeline_stage_seconds_count", stage="test_stage")
+        with stage_timer("test_stage"):
+            assert sample("ai_pipeline_in_flight", stage="test_stage") == 1
+        assert sample("ai_pipeline_in_flight", stage="test_stage") == 0
+        assert sample("ai_pipeline_stage_seconds_count", stage="test_stage") == before + 1
+
+    @pytest.mark.asyncio
+    @patch('services.ai_pipeline.send_webhook')
+    @patch('services.ai_pipeline.qdrant_client', new_callable=AsyncMock)
+    @patch('services.ai_pipeline.async_embed')
+    @patch('services.ai_pipeline.async_generate')
+    async def test_rate_limit_fallback_is_counted(self, mock_generate, mock_embed, mock_qdrant, mock_webhook):
+        """Test that a 429 from the LLM records the fallback, the outcome and the stage timings."""
+        from services import ai_pipeline
+        from api.v1.models import AnalyzeRequest
+
+        mock_embed.return_value = {'embedding': [0.1] * 768}
+        mock_point = MagicMock()
+        mock_point.score = 0.9
+        mock_point.payload = {'department_id': '123', 'name': 'Test Department', 'description': 'd'}
+        mock_qdrant.query_points.return_value.points = [mock_point]
+        mock_generate.side_effect = Exception("429 Resource has been exhausted")
+
+        before = {
+            "fallback": sample("ai_pipeline_fallbacks_total", kind="llm_rate_limited"),
+            "outcome": sample("ai_pipeline_outcomes_total", outcome="llm_rate_limited"),
+            "embed": sample("ai_pipeline_stage_seconds_count", stage="embed"),
+            "llm": sample("ai_pipeline_stage_seconds_count", stage="llm"),
+        }
+        request = AnalyzeRequest(
+            session_uuid="123e4567-e89b-12d3-a456-426614174000",
+            message_uuid="223e4567-e89b-12d3-a456-426614174009",
+            text="Metrics fallback test message"
+        )
+        with patch('services.ai_pipeline.VECTOR_INDEX_ENABLED', False), \
+                patch.object(ai_pipeline.decision_cache, 'enabled', False):
+            await ai_pipeline.process_message_pipeline(request)
+
+        assert sample("ai_pipeline_fallbacks_total", kind="llm_rate_limited") == before["fallback"] + 1
+        assert sample("ai_pipeline_outcomes_total", outcome="llm_rate_limited") == before["outcome"] + 1
+        assert sample("ai_pipeline_stage_seconds_count", stage="embed") == before["embed"] + 1
+        assert sample("ai_pipeline_stage_seconds_count", stage="llm") == before["llm"] + 1
+
+
+class TestStatsCollector:
+    """Tests for exporting stats() dicts."""
+
+    @pytest.mark.asyncio
+    async def test_flattens_stats_dicts(self):
+        """Test scalar, nested and async stats fields, skipping non-numeric values."""
+        collector = StatsCollector()
+        collector.register("demo", lambda: {"hits": 3, "enabled": True, "name": "x", "sizes": {"1": 5}})
+
+        async def queue_stats():
+            return {"depth": 7}
+        collector.register_async("queue", queue_stats)
+        await collector.refresh()
+
+        samples = {
+            (s.name, tuple(s.labels.items())): s.value
+            for family in collector.collect() for s in family.samples
+        }
+        assert samples[("ai_demo_hits", ())] == 3
+        assert samples[("ai_demo_enabled", ())] == 1
+        assert samples[("ai_demo_sizes", (("key", "1"),))] == 5
+        assert samples[("ai_queue_depth", ())] == 7
+        assert not any(name == "ai_demo_name" for name, _ in samples)
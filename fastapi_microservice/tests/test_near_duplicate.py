@@ -0,0 +1,112 @@
+"""
+Tests for near-duplicate detection and routing reuse.
+"""
+import time
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from api.v1.models import AnalyzeRequest
+from services.near_duplicate import NearDuplicateIndex, simhash, similarity
+
+DECISION = {"intent_label": "Shikoyat", "suggested_department_id": "20", "confidence_score": 90}
+
+
+class TestSimHash:
+    """Tests for the SimHash fingerprint."""
+
+    def test_trivial_variants_match_exactly(self):
+        """Test that case, spacing and apostrophe variants give one fingerprint."""
+        assert simhash("Suv yo'q") == simhash("  suv   yoʻq ")
+
+    def test_similar_texts_are_closer_than_different_ones(self):
+        """Test that a small edit keeps most bits while unrelated texts don't."""
+        base = simhash("Mahallamizda ikki kundan beri suv yo'q, iltimos yordam bering")
+        edited = simhash("Mahallamizda ikki kundan beri suv yo'q iltimos yordam bering!!")
+        other = simhash("Ko'chadagi chiroqlar yonmayapti")
+        assert similarity(base, edited) > similarity(base, other)
+
+
+class TestNearDuplicateIndex:
+    """Tests for lookup, expiry and invalidation."""
+
+    def test_finds_recent_duplicate_in_same_language(self):
+        """Test that a matching text returns the stored decision and reference."""
+        index = NearDuplicateIndex(min_similarity=0.9)
+        index.add("Suv yo'q", "uz", "m1", DECISION)
+
+        match = index.find("suv yoq", "uz")
+        assert match.message_uuid == "m1"
+        assert match.decision == DECISION
+        assert index.find("suv yoq", "ru") is None
+        assert index.find("Gaz bosimi juda past", "uz") is None
+
+    def test_entries_expire(self):
+        """Test that decisions older than the TTL are not reused."""
+        index = NearDuplicateIndex(ttl_seconds=60)
+        index.add("Suv yo'q", "uz", "m1", DECISION)
+
+        with patch('services.near_duplicate.time.monotonic', return_value=time.monotonic() + 61):
+            assert index.find("Suv yo'q", "uz") is None
+        assert index.stats()["entries"] == 0
+
+    def test_capacity_evicts_oldest(self):
+        """Test that the index is bounded."""
+        index = NearDuplicateIndex(max_entries=2)
+        for n, text in enumerate(["Suv yo'q", "Gaz yo'q", "Svet yo'q"]):
+            index.add(text, "uz", f"m{n}", DECISION)
+
+        assert index.stats()["entries"] == 2
+        assert index.find("Suv yo'q", "uz") is None
+
+    def test_invalidate_text(self):
+        """Test that a correction drops the reusable decision."""
+        index = NearDuplicateIndex()
+        index.add("Suv yo'q", "uz", "m1", DECISION)
+
+        assert index.invalidate_text("suv yo'q") == 1
+        assert index.find("Suv yo'q", "uz") is None
+
+
+class TestNearDuplicatePipeline:
+    """Tests for the pipeline short-circuit."""
+
+    @pytest.mark.asyncio
+    @patch('services.ai_pipeline.send_webhook')
+    @patch('services.ai_pipeline.async_embed')
+    @patch('services.ai_pipeline.async_generate')
+    async def test_duplicate_reuses_previous_routing(self, mock_generate, mock_embed, mock_webhook):
+        """Test that the second of two near-identical messages skips embedding and the LLM."""
+        from services import ai_pipeline
+
+        mock_embed.return_value = {'embedding': [0.1] * 768}
+        mock_point = MagicMock()
+        mock_point.score = 0.9
+        mock_point.payload = {'department_id': '20', 'name': 'Suv', 'description': 'd'}
+        mock_response = MagicMock()
+        mock_response.text = '{"department_id": "20", "intent": "Shikoyat", "confidence": 88, "reason": "Test"}'
+        mock_generate.return_value = mock_response
+
+        first = AnalyzeRequest(session_uuid="123e4567-e89b-12d3-a456-426614174000",
+                               message_uuid="223e4567-e89b-12d3-a456-426614174021",
+                               text="Mahalla Navro'zda suv yo'q")
+        second = AnalyzeRequest(session_uuid="123e4567-e89b-12d3-a456-426614174001",
+                                message_uuid="223e4567-e89b-12d3-a456-426614174022",
+                                text="mahalla navrozda  suv yo'q!")
+        with patch('services.ai_pipeline.near_duplicate_index', NearDuplicateIndex()), \
+                patch('services.ai_pipeline.qdrant_client', new_callable=AsyncMock) as mock_qdrant, \
+                patch('services.ai_pipeline.VECTOR_INDEX_ENABLED', False), \
+                patch.object(ai_pipeline.decision_cache, 'enabled', False):
+            mock_qdrant.query_points.return_value.points = [mock_point]
+            await ai_pipeline.process_message_pipeline(first)
+            await ai_pipeline.process_message_pipeline(second)
+
+        assert mock_embed.call_count == 1
+        assert mock_generate.call_count == 1
+        data = mock_webhook.call_args.args[1]
+        assert data["message_uuid"] == str(second.message_uuid)
+        assert data["near_duplicate"] is True
+        assert data["reused_from_message_uuid"] == str(first.message_uuid)
+        assert data["suggested_department_id"] == "20"
@@ -0,0 +1,120 @@
+"""
+Tests for the persistent webhook outbox.
+"""
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from services.outbox import Outbox
+
+BASE = "http://django"
+SINGLE = "/api/internal/routing-result/"
+BULK = "/api/internal/routing-result/batch/"
+
+
+def response(status_code, body=None):
+    mock = MagicMock()
+    mock.status_code = status_code
+    mock.text = ""
+    mock.json.return_value = body or {}
+    return mock
+
+
+def make_outbox(tmp_path, http_client, **kwargs):
+    return Outbox(http_client, path=str(tmp_path / "outbox.sqlite3"), batch_routes={SINGLE: BULK}, **kwargs)
+
+
+def result(n):
+    return {"message_uuid": f"uuid-{n}", "suggested_department_id": "123"}
+
+
+class TestOutbox:
+    """Tests for persistence, batching, retries and idempotency."""
+
+    @pytest.mark.asyncio
+    async def test_routing_results_are_delivered_in_bulk(self, tmp_path):
+        """Test that results for a bulk-capable path go out in one POST and are removed."""
+        http_client = MagicMock()
+        http_client.post = AsyncMock(return_value=response(200, {"results": [{"status_code": 200}] * 3}))
+        outbox = make_outbox(tmp_path, http_client)
+        for n in range(3):
+            await outbox.add(f"{BASE}{SINGLE}", result(n))
+
+        assert await outbox.flush_once() == 3
+
+        http_client.post.assert_called_once()
+        assert http_client.post.call_args.args[0] == f"{BASE}{BULK}"
+        assert len(http_client.post.call_args.kwargs["json"]["results"]) == 3
+        stats = await outbox.stats()
+        assert stats["pending"] == 0
+        assert stats["delivered"] == 3
+
+    @pytest.mark.asyncio
+    async def test_resent_result_replaces_pending_entry(self, tmp_path):
+        """Test that the message_uuid idempotency key keeps one entry per message."""
+        http_client = MagicMock()
+        outbox = make_outbox(tmp_path, http_client)
+        await outbox.add(f"{BASE}{SINGLE}", result(1))
+        await outbox.add(f"{BASE}{SINGLE}", {**result(1), "suggested_department_id": "456"})
+
+        assert (await outbox.stats())["pending"] == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_delivery_is_kept_for_retry(self, tmp_path):
+        """Test that a Django outage keeps the entry with a backoff instead of dropping it."""
+        http_client = MagicMock()
+        http_client.post = AsyncMock(side_effect=ConnectionError("refused"))
+        outbox = make_outbox(tmp_path, http_client)
+        await outbox.add(f"{BASE}/api/internal/injection-alert/", result(1))
+
+        assert await outbox.flush_once() == 1
+        # Not due again until the backoff passes.
+        assert await outbox.flush_once() == 0
+        stats = await outbox.stats()
+        assert stats["pending"] == 1
+        assert stats["failed_attempts"] == 1
+
+    @pytest.mark.asyncio
+    async def test_per_item_batch_statuses(self, tmp_path):
+        """Test that retryable items stay pending and rejected ones are parked as dead."""
+        http_client = MagicMock()
+        http_client.post = AsyncMock(return_value=response(200, {"results": [
+            {"status_code": 200}, {"status_code": 404}, {"status_code": 400},
+        ]}))
+        outbox = make_outbox(tmp_path, http_client)
+        for n in range(3):
+            await outbox.add(f"{BASE}{SINGLE}", result(n))
+
+        await outbox.flush_once()
+
+        stats = await outbox.stats()
+        assert stats["delivered"] == 1
+        assert stats["pending"] == 1
+        assert stats["dead_entries"] == 1
+
+    @pytest.mark.asyncio
+    async def test_single_posts_carry_idempotency_key(self, tmp_path):
+        """Test that paths without a bulk endpoint are posted one by one with the key header."""
+        http_client = MagicMock()
+        http_client.post = AsyncMock(return_value=response(200))
+        outbox = make_outbox(tmp_path, http_client)
+        await outbox.add(f"{BASE}/api/internal/injection-alert/", result(7))
+
+        await outbox.flush_once()
+
+        assert http_client.post.call_args.kwargs["headers"] == {"Idempotency-Key": "uuid-7"}
+        assert (await outbox.stats())["pending"] == 0
+
+    @pytest.mark.asyncio
+    async def test_entries_survive_restart(self, tmp_path):
+        """Test that a new outbox on the same file sees undelivered entries."""
+        await make_outbox(tmp_path, MagicMock()).add(f"{BASE}{SINGLE}", result(1))
+
+        http_client = MagicMock()
+        http_client.post = AsyncMock(return_value=response(200, {"results": [{"status_code": 200}]}))
+        restarted = make_outbox(tmp_path, http_client)
+
+        assert await restarted.flush_once() == 1
+        assert restarted.delivered == 1
@@ -0,0 +1,115 @@
+"""
+Tests for the adaptive Gemini rate limiter.
+"""
+import asyncio
+import pytest
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from services.rate_limiter import AdaptiveLimiter, is_rate_limit_error
+
+
+class RateLimited(Exception):
+    pass
+
+
+class TestAdaptiveLimiter:
+    """Tests for AIMD concurrency, retries and token accounting."""
+
+    @pytest.mark.asyncio
+    async def test_concurrency_is_capped_and_callers_queue(self):
+        """Test that callers beyond the limit wait instead of failing."""
+        limiter = AdaptiveLimiter("test", rpm=0, max_concurrency=4)
+        assert limiter.limit == 2
+        peak = 0
+
+        def call():
+            nonlocal peak
+            peak = max(peak, limiter.in_flight)
+            return "ok"
+
+        results = await asyncio.gather(*(limiter.call(call) for _ in range(10)))
+
+        assert results == ["ok"] * 10
+        assert peak <= 4
+        assert limiter.in_flight == 0
+        assert limiter.limit > 2
+
+    @pytest.mark.asyncio
+    async def test_backs_off_and_retries_on_429(self):
+        """Test that a 429 halves the limit, pauses and the call is retried."""
+        limiter = AdaptiveLimiter("test", rpm=0, max_concurrency=8, backoff_seconds=0.01)
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RateLimited("429 Resource has been exhausted")
+            return "ok"
+
+        assert await limiter.call(flaky) == "ok"
+        assert len(attempts) == 2
+        assert limiter.throttled == 1
+        assert limiter.retries == 1
+        assert limiter.limit < 4
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_retries(self):
+        """Test that the quota error surfaces once retries are exhausted."""
+        limiter = AdaptiveLimiter("test", rpm=0, max_concurrency=2, max_retries=1, backoff_seconds=0.01)
+
+        def always_limited():
+            raise RateLimited("quota exceeded")
+
+        with pytest.raises(RateLimited):
+            await limiter.call(always_limited)
+        assert limiter.throttled == 2
+        assert limiter.limit == 1
+
+    @pytest.mark.asyncio
+    async def test_other_errors_are_not_retried(self):
+        """Test that non-quota errors fail immediately without lowering the limit."""
+        limiter = AdaptiveLimiter("test", rpm=0, max_concurrency=4)
+
+        def broken():
+            raise ValueError("bad request")
+
+        with pytest.raises(ValueError):
+            await limiter.call(broken)
+        assert limiter.retries == 0
+        assert limiter.limit > 2
+
+    @pytest.mark.asyncio
+    async def test_cancelled_call_frees_its_slot(self):
+        """Test that cancelling a call (e.g. a lost hedge) releases its slot without throttling."""
+        limiter = AdaptiveLimiter("test", rpm=0, max_concurrency=2)
+
+        async def slow():
+            await asyncio.sleep(5)
+
+        task = asyncio.ensure_future(limiter.call(slow))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert limiter.in_flight == 0
+        assert limiter.throttled == 0
+
+    def test_token_usage_debits_tpm_bucket(self):
+        """Test that reported usage is accounted and drains the token bucket."""
+        limiter = AdaptiveLimiter("test", rpm=0, max_concurrency=4, tpm=60000)
+        limiter.record_usage(100, 70000)
+
+        stats = limiter.stats()
+        assert stats["prompt_tokens"] == 100
+        assert stats["total_tokens"] == 70000
+        assert limiter._delay() > 0
+
+    def test_is_rate_limit_error(self):
+        """Test quota error detection by type and message."""
+        from google.api_core import exceptions as google_exceptions
+        assert is_rate_limit_error(google_exceptions.ResourceExhausted("exhausted"))
+        assert is_rate_limit_error(Exception("429 Too Many Requests"))
+        assert not is_rate_limit_error(Exception("500 Internal"))
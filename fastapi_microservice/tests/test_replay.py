@@ -0,0 +1,125 @@
+"""
+Tests for the offline replay harness.
+"""
+import os
+import pytest
+from unittest.mock import patch, AsyncMock
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import replay
+from services.vector_index import LocalVectorIndex
+from services.metrics import stage_timer, record_outcome
+
+
+def result(department_id, expected, outcome="llm", seconds=0.2, **kwargs):
+    return {
+        "message_uuid": "uuid", "department_id": department_id, "expected_department_id": expected,
+        "historical_department_id": kwargs.get("historical"), "outcome": outcome,
+        "llm_bypassed": outcome != "llm", "needs_manual_routing": False,
+        "seconds": seconds, "stages": {"embed": 0.05, "llm": seconds - 0.05},
+    }
+
+
+class TestReplay:
+    """Tests for record loading, per-request traces and the report."""
+
+    def test_load_records_fills_ids_and_skips_empty(self):
+        """Test that lines without text are skipped and missing UUIDs are generated."""
+        lines = ['{"text": "Suv yo\'q", "expected_department_id": 3}', '', '{"title": "no text"}', '{"body": "Gaz"}']
+
+        records = replay.load_records(lines)
+
+        assert [r["text"] for r in records] == ["Suv yo'q", "Gaz"]
+        assert all(r["message_uuid"] and r["session_uuid"] for r in records)
+
+    def test_summary_compares_with_corrections(self):
+        """Test accuracy against expected departments, the historical baseline and the bypass rate."""
+        results = [
+            result("3", 3, historical=7),
+            result(5, 5, outcome="bypassed", historical=5),
+            result(1, None),
+            {"message_uuid": "uuid", "error": "boom"},
+        ]
+
+        report = replay.summarize(results, wall_seconds=2.0)
+
+        assert report["accuracy"] == 1.0
+        assert report["historical_accuracy"] == 0.5
+        assert report["labeled"] == 2
+        assert report["errors"] == 1
+        assert report["llm_bypass_rate"] == round(1 / 3, 4)
+        assert report["throughput_per_second"] == 2.0
+        assert set(report["latency_ms"]) == {"total", "embed", "llm"}
+
+    def test_reused_decisions_are_reported_apart(self):
+        """Test that decision cache and near-duplicate hits don't count as routing decisions."""
+        results = [
+            result("3", 3),
+            result("3", 4, seconds=0.3),
+            result("3", 3, outcome="decision_cache_hit", seconds=0.01),
+            result("3", 3, outcome="near_duplicate", seconds=0.01),
+            result("3", 5, outcome="near_duplicate", seconds=0.01),
+        ]
+
+        report = replay.summarize(results, wall_seconds=1.0)
+
+        assert report["decided"] == 2
+        assert report["accuracy"] == 0.5
+        assert report["outcomes"] == {"llm": 2}
+        assert report["reused"] == {"decision_cache_hit": 1, "near_duplicate": 2, "labeled": 3, "accuracy": round(2 / 3, 4)}
+        assert report["latency_ms"]["total"]["p50"] == 250.0
+
+    def test_near_duplicate_reuse_is_off_by_default(self):
+        """Test that replay turns near-duplicate reuse off unless --near-duplicates is given."""
+        for argv, expected in ((["history.jsonl"], "false"), (["history.jsonl", "--near-duplicates"], "true")):
+            with patch.dict('os.environ', {}), \
+                    patch.object(replay, 'run_replay', AsyncMock(return_value={})):
+                replay.main([*argv, "--shared-redis"])
+                assert os.environ["NEAR_DUPLICATE_ENABLED"] == expected
+
+    @pytest.mark.asyncio
+    async def test_replay_collects_stage_timings_per_message(self):
+        """Test that each replayed message gets its own stage timings and outcome."""
+        async def analyze(request):
+            with stage_timer("embed"):
+                pass
+            record_outcome("bypassed", 0.01)
+            return "/path/", {"suggested_department_id": request.text, "llm_bypassed": True}
+
+        records = replay.load_records(['{"text": "1"}', '{"text": "2"}'])
+        with patch('services.ai_pipeline.analyze_request', side_effect=analyze):
+            results = await replay.replay(records, concurrency=2)
+
+        assert [r["department_id"] for r in results] == ["1", "2"]
+        assert all(r["outcome"] == "bypassed" and set(r["stages"]) == {"embed"} for r in results)
+
+    @pytest.mark.asyncio
+    async def test_own_correction_points_are_left_out(self):
+        """Test that a replayed text's correction point, under any language, leaves the snapshot."""
+        from services import ai_pipeline
+
+        index = LocalVectorIndex()
+        text = "Ko'cha chirog'i ishlamayapti"
+        own_id = ai_pipeline.correction_point_id(text, ai_pipeline.detect_language(text))
+        index.upsert(own_id, [1.0, 0.0], {"language": "uz", "is_correction": True, "description": text})
+        index.upsert("other-language", [1.0, 0.0], {"language": "ru", "is_correction": True, "description": text})
+        index.upsert("other-text", [0.0, 1.0], {"language": "uz", "is_correction": True, "description": "Suv yo'q"})
+        index.upsert("department", [0.5, 0.5], {"language": "uz", "description": text})
+
+        records = replay.load_records([f'{{"text": "{text}", "expected_department_id": 3}}'])
+        with patch.object(ai_pipeline, 'vector_index', index), \
+             patch.object(ai_pipeline, 'rebuild_local_embedding_index', AsyncMock()), \
+             patch.object(ai_pipeline, 'rebuild_lexical_index', AsyncMock()) as rebuild_lexical, \
+             patch.object(ai_pipeline, 'rebuild_correction_classifier', AsyncMock()) as rebuild_knn:
+            assert await replay.exclude_own_corrections(records) == 2
+
+        assert sorted(point_id for point_id, _ in index.points()) == ["department", "other-text"]
+        assert rebuild_lexical.called and rebuild_knn.called
+
+    def test_redis_defaults_to_separate_db(self):
+        """Test that replay points Redis at its own DB, keeping host and credentials."""
+        assert replay.replay_redis_url("redis://:secret@cache:6380/2", 3) == "redis://:secret@cache:6380/3"
+        assert replay.replay_redis_url("redis://localhost:6379", 3) == "redis://localhost:6379/3"
+        assert not replay.parse_args(["history.jsonl"]).shared_redis
@@ -0,0 +1,53 @@
+"""
+Tests for the confidence-gated LLM bypass policy.
+"""
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from api.v1.models import Candidate
+from services.routing_policy import RoutingPolicy
+
+
+def candidate(dept_id, score, is_correction=False):
+    return Candidate(id=dept_id, name=f"Dept {dept_id}", score=score, is_correction=is_correction)
+
+
+class TestRoutingPolicy:
+    """Tests for score, margin and correction-agreement gates."""
+
+    def test_dominant_candidate_bypasses(self):
+        """Test that a high score with a clear margin skips the LLM."""
+        policy = RoutingPolicy(enabled=True, min_score=0.8, min_margin=0.08)
+
+        decision = policy.decide([candidate("1", 0.91), candidate("1", 0.88), candidate("2", 0.75)])
+
+        assert decision.department_id == "1"
+        # Margin is measured against the next department, not the same department's second point.
+        assert round(decision.margin, 2) == 0.16
+        assert policy.stats()["bypass_rate"] == 1.0
+
+    def test_close_runner_up_goes_to_llm(self):
+        """Test that an ambiguous top two is left to the LLM."""
+        policy = RoutingPolicy(enabled=True, min_score=0.8, min_margin=0.08)
+
+        assert policy.decide([candidate("1", 0.90), candidate("2", 0.86)]) is None
+        assert policy.decide([candidate("1", 0.70)]) is None
+        assert policy.stats()["rejections"] == {"low_score": 1, "low_margin": 1, "no_correction_agreement": 0}
+
+    def test_requires_agreeing_corrections(self):
+        """Test the correction-vote gate and that department names win over correction labels."""
+        policy = RoutingPolicy(enabled=True, min_score=0.8, min_margin=0.05, min_correction_votes=1)
+
+        assert policy.decide([candidate("1", 0.95), candidate("2", 0.5)]) is None
+        decision = policy.decide([candidate("1", 0.95, is_correction=True), candidate("1", 0.9), candidate("2", 0.5)])
+
+        assert decision.correction_votes == 1
+        assert decision.name == "Dept 1"
+
+    def test_disabled_policy_never_bypasses(self):
+        """Test that the policy is inert unless enabled."""
+        policy = RoutingPolicy(enabled=False)
+
+        assert policy.decide([candidate("1", 0.99)]) is None
+        assert policy.stats()["evaluated"] == 0
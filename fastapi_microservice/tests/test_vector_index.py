@@ -0,0 +1,102 @@
+"""
+Tests for the in-process vector index mirroring the Qdrant collection.
+"""
+import pytest
+from unittest.mock import MagicMock, AsyncMock
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from qdrant_client.models import Record
+from services.vector_index import LocalVectorIndex
+
+
+def make_index():
+    index = LocalVectorIndex("departments")
+    index.upsert("p1", [1.0, 0.0, 0.0], {"department_id": "1", "language": "uz", "name": "Suv"})
+    index.upsert("p2", [0.0, 1.0, 0.0], {"department_id": "2", "language": "uz", "name": "Yo'l"})
+    index.upsert("p3", [0.9, 0.1, 0.0], {"department_id": "3", "language": "ru", "name": "Вода"})
+    return index
+
+
+class TestLocalVectorIndex:
+    """Tests for search, language partitions and loading."""
+
+    def test_search_orders_by_cosine(self):
+        """Test that hits are ranked by cosine similarity within the language."""
+        index = make_index()
+
+        hits = index.search([2.0, 0.2, 0.0], language="uz", limit=2)
+
+        assert [h.payload["department_id"] for h in hits] == ["1", "2"]
+        assert hits[0].score == pytest.approx(0.995, abs=1e-3)
+
+    def test_unknown_language_searches_all_partitions(self):
+        """Test the fallback to every language when the partition is empty."""
+        index = make_index()
+
+        hits = index.search([1.0, 0.0, 0.0], language="en", limit=3)
+
+        assert [h.id for h in hits] == ["p1", "p3", "p2"]
+
+    def test_upsert_overwrites_and_moves_language(self):
+        """Test that re-upserting a point replaces it in place."""
+        index = make_index()
+        index.upsert("p2", [1.0, 0.0, 0.0], {"department_id": "2", "language": "ru"})
+
+        assert len(index) == 3
+        assert [h.id for h in index.search([1.0, 0.0, 0.0], language="uz", limit=3)] == ["p1"]
+
+    @pytest.mark.asyncio
+    async def test_load_from_qdrant_scroll(self):
+        """Test that a load pages through the collection and bumps the generation."""
+        client = AsyncMock()
+        client.get_collection.return_value.points_count = 2
+        client.scroll.side_effect = [
+            ([Record(id=1, vector=[1.0, 0.0], payload={"department_id": "7", "language": "uz"})], 5),
+            ([Record(id=2, vector=[0.0, 1.0], payload={"department_id": "8", "language": "uz"})], None),
+        ]
+        index = LocalVectorIndex("departments")
+
+        await index.load(client)
+
+        assert index.ready
+        assert index.generation == 1
+        assert index.search([0.0, 1.0], language="uz", limit=1)[0].payload["department_id"] == "8"
+        assert not await index.refresh_if_stale(client)
+
+    @pytest.mark.asyncio
+    async def test_reindex_listener_fires_on_changed_departments(self):
+        """Test that listeners run only when department points change between loads."""
+        listener = AsyncMock()
+        client = AsyncMock()
+        client.get_collection.return_value.points_count = 1
+        index = LocalVectorIndex("departments")
+        index.on_reindex(listener)
+
+        client.scroll.return_value = ([Record(id=1, vector=[1.0, 0.0], payload={"department_id": "7", "language": "uz"})], None)
+        await index.load(client)
+        await index.load(client)
+        assert not listener.called
+
+        client.scroll.return_value = ([Record(id=1, vector=[0.0, 1.0], payload={"department_id": "7", "language": "uz"})], None)
+        await index.load(client)
+        assert listener.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_alias_switch_reloads_with_same_count(self):
+        """Test that a blue/green re-index with an unchanged point count is picked up."""
+        client = AsyncMock()
+        client.get_collection.return_value.points_count = 1
+        client.get_aliases.return_value.aliases = [MagicMock(alias_name="departments", collection_name="departments_v1")]
+        client.scroll.return_value = ([Record(id=1, vector=[1.0, 0.0], payload={"department_id": "7", "language": "uz"})], None)
+        index = LocalVectorIndex("departments")
+        await index.load(client)
+        assert client.scroll.call_args.kwargs["collection_name"] == "departments_v1"
+        assert not await index.refresh_if_stale(client)
+
+        client.get_aliases.return_value.aliases = [MagicMock(alias_name="departments", collection_name="departments_v2")]
+
+        assert await index.refresh_if_stale(client)
+        assert index.target == "departments_v2"
+        assert index.generation == 2
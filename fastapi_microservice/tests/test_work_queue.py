@@ -0,0 +1,118 @@
+"""
+Tests for the bounded analysis work queue.
+"""
+import asyncio
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+from fastapi.testclient import TestClient
+import sys
+from pathlib import Path
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from main import app
+from services.work_queue import WorkQueue, QueueFull
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def no_redis():
+    """Forces the in-process queue backend."""
+    with patch('services.work_queue.get_redis', AsyncMock(return_value=None)):
+        yield
+
+
+class TestWorkQueue:
+    """Tests for backpressure, the worker pool and retries."""
+
+    @pytest.mark.asyncio
+    async def test_rejects_when_full(self, no_redis):
+        """Test that enqueueing past max_depth raises QueueFull."""
+        queue = WorkQueue("test:analysis", AsyncMock(), max_depth=2)
+        await queue.enqueue({"n": 1})
+        await queue.enqueue({"n": 2})
+
+        with pytest.raises(QueueFull):
+            await queue.enqueue({"n": 3})
+        assert (await queue.stats())["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_workers_drain_queue(self, no_redis):
+        """Test that started workers process every entry."""
+        handler = AsyncMock()
+        queue = WorkQueue("test:analysis", handler, workers=2)
+        for n in range(5):
+            await queue.enqueue({"n": n})
+
+        await queue.start()
+        for _ in range(50):
+            if queue.processed == 5:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+
+        assert sorted(call.args[0]["n"] for call in handler.call_args_list) == [0, 1, 2, 3, 4]
+        assert await queue.depth() == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_runs_are_retried_then_dead_lettered(self, no_redis):
+        """Test that a failing handler is retried up to max_retries."""
+        handler = AsyncMock(side_effect=RuntimeError("boom"))
+        queue = WorkQueue("test:analysis", handler, workers=1, max_retries=3)
+        await queue.enqueue({"n": 1})
+
+        await queue.start()
+        for _ in range(50):
+            if queue.dead_lettered:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+
+        assert handler.call_count == 3
+        assert queue.retried == 2
+        assert queue.dead_lettered == 1
+
+    @pytest.mark.asyncio
+    async def test_slow_run_keeps_its_claim(self):
+        """Test that a handler running past the claim idle time renews its claim without a delivery."""
+        redis = MagicMock(xclaim=AsyncMock(return_value=[]), xack=AsyncMock(), xdel=AsyncMock())
+
+        async def slow(payload):
+            await asyncio.sleep(0.1)
+
+        queue = WorkQueue("test:analysis-batch", slow, claim_idle_ms=60)
+        with patch('services.work_queue.get_redis', AsyncMock(return_value=redis)):
+            await queue._run("1-0", {b"payload": b"{}", b"attempts": b"0"})
+
+        assert queue.claims_renewed >= 2
+        assert all(call.kwargs["justid"] and call.args[3] == 0 for call in redis.xclaim.call_args_list)
+        redis.xack.assert_called_once()
+
+        calls = redis.xclaim.call_count
+        await asyncio.sleep(0.05)
+        assert redis.xclaim.call_count == calls
+
+    def test_batch_queue_has_its_own_claim_idle_time(self):
+        """Test that batches are presumed crashed later than single analyses."""
+        from services import ai_pipeline
+
+        assert ai_pipeline.batch_queue.claim_idle_ms == ai_pipeline.ANALYSIS_BATCH_QUEUE_CLAIM_IDLE_MS
+        assert ai_pipeline.batch_queue.claim_idle_ms > ai_pipeline.analysis_queue.claim_idle_ms
+
+
+class TestAnalyzeBackpressure:
+    """Tests for /analyze answering 429 when the queue is full."""
+
+    @patch('api.v1.routes.analysis_queue.enqueue', side_effect=QueueFull("full"))
+    def test_analyze_returns_429(self, mock_enqueue):
+        """Test that a full queue is surfaced as 429 with Retry-After."""
+        payload = {
+            "session_uuid": "123e4567-e89b-12d3-a456-426614174000",
+            "message_uuid": "223e4567-e89b-12d3-a456-426614174000",
+            "text": "Suv yo'q"
+        }
+
+        response = client.post("/api/v1/analyze", json=payload)
+
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "5"